@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# A local on-disk cache of the contents of feature tables, see
+# WndcharmStorage.FeatureTable
+#
+# Each cached table is a directory named from the table id, the
+# lastModification timestamp and the number of rows, holding ids.npy,
+# values.npy (memory mapped when read) and meta.json. Entries are written to
+# a temporary directory which is renamed into place so they are never seen
+# partially written, and are never modified afterwards. Adding and evicting
+# entries is serialised between processes using a lock file. Entries are
+# touched when used so eviction removes the least recently used first.
+
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import numpy
+
+# Environment variable holding the directory used by defaultFeatureCache()
+CACHE_DIR_ENV = 'WNDCHARM_FEATURE_CACHE'
+
+# Default maximum total size of all cache entries in bytes
+CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+# Temporary directories left by failed writes are removed after this many
+# seconds
+CACHE_STALE_SECONDS = 3600
+
+CACHE_LOCK_FILE = '.lock'
+CACHE_TEMP_PREFIX = '.tmp-'
+CACHE_ENTRY_FORMAT = 'table-%d-%d-%d'
+CACHE_ENTRY_RE = re.compile('^table-(\d+)-(\d+)-(\d+)$')
+
+
+class FeatureCacheError(Exception):
+    """
+    Errors occuring in the FeatureCache module
+    """
+    pass
+
+
+class CachedFeatures(object):
+    """
+    The cached contents of a feature table
+    """
+
+    def __init__(self, tableId, lastModification, nrows, names, ids, values,
+                 rewrites=0):
+        """
+        @param tableId The OriginalFile id of the table
+        @param lastModification The lastModification timestamp of the table
+        @param nrows The number of rows in the table
+        @param names A list of single value feature names
+        @param ids A 1-D int64 array of object ids, one per row
+        @param values A 2-D float64 array of feature values with one row per
+        id, null features are NaN
+        @param rewrites The number of times existing rows of the table had
+        been overwritten when it was read, see
+        WndcharmStorage.incrementRewriteCount()
+        """
+        self.tableId = tableId
+        self.lastModification = lastModification
+        self.nrows = nrows
+        self.names = names
+        self.ids = ids
+        self.values = values
+        self.rewrites = rewrites
+
+
+class FeatureCache(object):
+    """
+    A size-bounded directory of cached feature tables which can be shared by
+    several processes
+    """
+
+    def __init__(self, cacheDir, maxBytes=CACHE_MAX_BYTES):
+        """
+        @param cacheDir The cache directory, this is created if necessary
+        @param maxBytes The maximum total size of all entries, the least
+        recently used entries are removed when this is exceeded
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            if not os.path.isdir(cacheDir):
+                raise
+
+
+    def get(self, tableId, lastModification, nrows):
+        """
+        Get a cached table
+        @param tableId The OriginalFile id of the table
+        @param lastModification The current lastModification timestamp of the
+        table
+        @param nrows The current number of rows in the table
+        @return a CachedFeatures object, or None if this version of the table
+        is not cached
+        """
+        return self._load((tableId, lastModification, nrows))
+
+
+    def latest(self, tableId):
+        """
+        Get the most recent cached version of a table regardless of whether
+        it is current, for incremental updates
+        @param tableId The OriginalFile id of the table
+        @return a CachedFeatures object, or None if the table is not cached
+        """
+        keys = [key for (key, p) in self._entries() if key[0] == tableId]
+        for key in sorted(keys, reverse=True):
+            c = self._load(key)
+            if c is not None:
+                return c
+        return None
+
+
+    def put(self, tableId, lastModification, nrows, names, ids, values,
+            rewrites=0):
+        """
+        Add a table to the cache, replacing any other versions of the same
+        table
+        @param tableId The OriginalFile id of the table
+        @param lastModification The lastModification timestamp of the table
+        @param nrows The number of rows in the table
+        @param names A list of single value feature names
+        @param ids A sequence of object ids
+        @param values A 2-D array of feature values corresponding to ids
+        @param rewrites The rewrite count of the table, see CachedFeatures
+        @return a CachedFeatures object, holding the given arrays instead of
+        the cache files if the entry is larger than maxBytes
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if ids.shape != (nrows,) or values.shape != (nrows, len(names)):
+            raise FeatureCacheError(
+                'Expected %d ids and values of shape (%d, %d)' % (
+                    nrows, nrows, len(names)))
+
+        tmp = tempfile.mkdtemp(prefix=CACHE_TEMP_PREFIX, dir=self.cacheDir)
+        try:
+            numpy.save(os.path.join(tmp, 'ids.npy'), ids)
+            numpy.save(os.path.join(tmp, 'values.npy'), values)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'tableId': tableId,
+                           'lastModification': lastModification,
+                           'nrows': nrows, 'names': list(names),
+                           'rewrites': rewrites}, f)
+
+            path = self._entryPath(tableId, lastModification, nrows)
+            with self._lock():
+                if os.path.exists(path):
+                    shutil.rmtree(tmp)
+                else:
+                    os.rename(tmp, path)
+                for (key, p) in self._entries():
+                    if key[0] == tableId and p != path:
+                        shutil.rmtree(p, ignore_errors=True)
+                self._evict()
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        c = self.get(tableId, lastModification, nrows)
+        if c is None:
+            # Larger than maxBytes so immediately evicted
+            c = CachedFeatures(tableId, lastModification, nrows, list(names),
+                               ids, values, rewrites)
+        return c
+
+
+    def remove(self, tableId):
+        """
+        Remove all cached versions of a table
+        @param tableId The OriginalFile id of the table
+        """
+        with self._lock():
+            for (key, p) in self._entries():
+                if key[0] == tableId:
+                    shutil.rmtree(p, ignore_errors=True)
+
+
+    def clear(self):
+        """
+        Remove all cached tables
+        """
+        with self._lock():
+            for (key, p) in self._entries():
+                shutil.rmtree(p, ignore_errors=True)
+
+
+    def _load(self, key):
+        """
+        Internal helper method, opens a cache entry
+        @param key A (tableId, lastModification, nrows) tuple
+        @return a CachedFeatures object, or None
+        """
+        tableId, lastModification, nrows = key
+        path = self._entryPath(tableId, lastModification, nrows)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            # Empty files can't be memory mapped
+            mmap = 'r' if nrows else None
+            ids = numpy.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap)
+            values = numpy.load(os.path.join(path, 'values.npy'),
+                                mmap_mode=mmap)
+        except (IOError, OSError, ValueError):
+            # Missing, or removed by another process
+            return None
+
+        self._touch(path)
+        return CachedFeatures(tableId, lastModification, nrows, meta['names'],
+                              ids, values, meta.get('rewrites', 0))
+
+
+    def _entryPath(self, tableId, lastModification, nrows):
+        """
+        Internal helper method, gets the directory of a cache entry
+        """
+        return os.path.join(self.cacheDir, CACHE_ENTRY_FORMAT % (
+                tableId, lastModification, nrows))
+
+
+    def _entries(self):
+        """
+        Internal helper method, lists all cache entries
+        @return a list of ((tableId, lastModification, nrows), path) tuples
+        """
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            m = CACHE_ENTRY_RE.match(name)
+            if m:
+                key = tuple(long(g) for g in m.groups())
+                entries.append((key, os.path.join(self.cacheDir, name)))
+        return entries
+
+
+    def _touch(self, path):
+        """
+        Internal helper method, marks an entry as recently used
+        """
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        """
+        Internal helper method, removes the least recently used entries
+        until the cache is within maxBytes, and any stale temporary
+        directories. Must be called with the lock held.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.cacheDir):
+            path = os.path.join(self.cacheDir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if name.startswith(CACHE_TEMP_PREFIX):
+                    if now - mtime > CACHE_STALE_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if not CACHE_ENTRY_RE.match(name):
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, f))
+                           for f in os.listdir(path))
+            except OSError:
+                continue
+            entries.append((mtime, size, path))
+            total += size
+
+        for (mtime, size, path) in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+    @contextmanager
+    def _lock(self):
+        """
+        Internal helper method, holds an exclusive lock on the cache
+        directory
+        """
+        with open(os.path.join(self.cacheDir, CACHE_LOCK_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def defaultFeatureCache():
+    """
+    Get the cache in the directory given by the CACHE_DIR_ENV environment
+    variable
+    @return a FeatureCache, or None if the variable is not set
+    """
+    cacheDir = os.environ.get(CACHE_DIR_ENV)
+    if not cacheDir:
+        return None
+    return FeatureCache(cacheDir)
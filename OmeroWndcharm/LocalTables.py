@@ -0,0 +1,834 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# An in-process stand-in for an OMERO session with OMERO.tables, for testing
+# and benchmarking TableConnection and WndcharmStorage without a server.
+#
+# Table data is held in numpy arrays. Only the subset of the OMERO API used
+# by this package is implemented: shared resources, tables, OriginalFile
+# lookups, and saving, querying and unlinking annotations such as version
+# tags.
+#
+# Usage:
+#   client = LocalTables.LocalClient(latency=0.01)
+#   tc = TableConnection(client=client, tableName='/test.h5')
+
+from copy import deepcopy
+import itertools
+import re
+import time
+import numpy
+import Ice
+import omero
+import omero.gateway
+from omero.grid import LongColumn, BoolColumn, DoubleColumn, \
+    LongArrayColumn, DoubleArrayColumn, FloatArrayColumn
+from omero.rtypes import rlong, rstring, unwrap
+
+# Numpy types used for storing columns, any other column types are held in
+# lists
+LOCAL_DTYPES = {
+    LongColumn: numpy.int64,
+    BoolColumn: numpy.bool_,
+    DoubleColumn: numpy.float64,
+    LongArrayColumn: numpy.int64,
+    DoubleArrayColumn: numpy.float64,
+    FloatArrayColumn: numpy.float32,
+    }
+
+# Wrapper classes returned by listAnnotations()
+ANNOTATION_WRAPPERS = {
+    omero.model.TagAnnotationI: omero.gateway.TagAnnotationWrapper,
+    omero.model.FileAnnotationI: omero.gateway.FileAnnotationWrapper,
+    omero.model.CommentAnnotationI: omero.gateway.CommentAnnotationWrapper,
+    }
+
+
+class LocalTablesError(Exception):
+    """
+    Errors occuring in the local stand-in, usually because a feature is not
+    supported
+    """
+    pass
+
+
+class LocalStore(object):
+    """
+    The objects held by the stand-in, the equivalent of a server. Clients
+    using the same store see the same tables.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.annotations = {}
+        # (parent type, parent id): [annotation links]
+        self.links = {}
+        self._ids = itertools.count(1)
+
+
+    def nextId(self):
+        return next(self._ids)
+
+
+# Used by all clients unless a store is given
+DEFAULT_STORE = LocalStore()
+
+
+class LocalClient(object):
+    """
+    A replacement for omero.client, pass this to Connection or any of its
+    subclasses
+    """
+
+    def __init__(self, store=None, latency=0.0, bandwidth=None,
+                 messageSizeMax=None):
+        """
+        @param store The LocalStore, default DEFAULT_STORE
+        @param latency The simulated time in seconds taken by every remote
+        call
+        @param bandwidth If provided the simulated transfer rate in bytes
+        per second of table data
+        @param messageSizeMax If provided table reads and writes larger than
+        this many bytes raise Ice.MemoryLimitException
+        """
+        if store is None:
+            store = DEFAULT_STORE
+        self.store = store
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.messageSizeMax = messageSizeMax
+        self._session = LocalSession(self)
+
+
+    def createSession(self, username=None, password=None):
+        return self._session
+
+
+    def getSession(self):
+        return self._session
+
+
+    def enableKeepAlive(self, seconds):
+        pass
+
+
+    def closeSession(self):
+        pass
+
+
+    def getGateway(self):
+        """
+        Get the BlitzGateway replacement for this client, used by
+        TableConnection.Connection in place of creating a BlitzGateway
+        """
+        return LocalGateway(self)
+
+
+    def _delay(self, nbytes=0):
+        """
+        Internal helper method, the simulated duration of a call
+        @param nbytes The number of bytes transferred
+        @return the delay in seconds
+        """
+        if self.messageSizeMax is not None and nbytes > self.messageSizeMax:
+            raise Ice.MemoryLimitException()
+        if self.bandwidth:
+            return self.latency + float(nbytes) / self.bandwidth
+        return self.latency
+
+
+    def _wait(self, nbytes=0):
+        """
+        Internal helper method, simulates a synchronous call
+        @param nbytes The number of bytes transferred
+        """
+        delay = self._delay(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LocalDeferredClient(object):
+    """
+    Used in place of a LocalClient when running an asynchronous call, the
+    simulated delays are added up instead of waited for
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.delay = 0.0
+
+
+    def _wait(self, nbytes=0):
+        self.delay += self._client._delay(nbytes)
+
+
+class LocalSession(object):
+    """
+    A replacement for an OMERO ServiceFactory
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+
+    def sharedResources(self):
+        return LocalResources(self._client)
+
+
+class LocalRepositories(object):
+    """
+    A replacement for omero.grid.RepositoryMap
+    """
+
+    def __init__(self):
+        self.descriptions = [omero.model.OriginalFileI(0, False)]
+
+
+class LocalResources(object):
+    """
+    A replacement for omero.grid.SharedResources
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+
+    def areTablesEnabled(self):
+        return True
+
+
+    def repositories(self):
+        self._client._wait()
+        return LocalRepositories()
+
+
+    def newTable(self, rid, name):
+        self._client._wait()
+        store = self._client.store
+        data = LocalTableData(store.nextId(), name)
+        store.tables[data.id] = data
+        return LocalTable(self._client, data)
+
+
+    def openTable(self, ofile):
+        self._client._wait()
+        data = self._client.store.tables.get(unwrap(ofile.getId()))
+        if data is None or data.deleted:
+            return None
+        return LocalTable(self._client, data)
+
+
+class LocalColumnData(object):
+    """
+    The values of a single column, numeric columns are stored in a numpy
+    array which is grown as required
+    """
+
+    def __init__(self, col):
+        self.dtype = LOCAL_DTYPES.get(type(col))
+        if isinstance(col, (LongArrayColumn, DoubleArrayColumn,
+                            FloatArrayColumn)):
+            self.shape = (col.size,)
+        else:
+            self.shape = ()
+        if self.dtype is None:
+            self.values = []
+        else:
+            self.values = numpy.empty((0,) + self.shape, dtype=self.dtype)
+        self.n = 0
+
+
+    def extend(self, values):
+        if self.dtype is None:
+            self.values.extend(values)
+            self.n = len(self.values)
+            return
+
+        a = numpy.asarray(values, dtype=self.dtype).reshape(
+            (len(values),) + self.shape)
+        q = self.n + len(a)
+        if q > len(self.values):
+            grown = numpy.empty((max(q, 2 * len(self.values)),) + self.shape,
+                                dtype=self.dtype)
+            grown[:self.n] = self.values[:self.n]
+            self.values = grown
+        self.values[self.n:q] = a
+        self.n = q
+
+
+    def get(self, rows):
+        """
+        @param rows A slice or a list of row indices
+        @return the values of the rows as a list
+        """
+        if self.dtype is None:
+            if isinstance(rows, slice):
+                return self.values[rows]
+            return [self.values[r] for r in rows]
+        return self.values[:self.n][rows].tolist()
+
+
+    def put(self, rows, values):
+        """
+        @param rows A list of row indices
+        @param values The new values
+        """
+        if self.dtype is None:
+            for (r, v) in itertools.izip(rows, values):
+                self.values[r] = v
+        else:
+            self.values[rows] = numpy.asarray(values, dtype=self.dtype)
+
+
+    def array(self):
+        if self.dtype is None:
+            return numpy.array(self.values)
+        return self.values[:self.n]
+
+
+    def nbytes(self, nrows):
+        """
+        @return the approximate size of nrows rows
+        """
+        if self.dtype is None:
+            return nrows * 8
+        return nrows * int(numpy.prod(self.shape)) * \
+            numpy.dtype(self.dtype).itemsize
+
+
+class LocalTableData(object):
+    """
+    The stored state of a table
+    """
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.headers = None
+        self.columns = None
+        self.lastModification = 0
+        self.deleted = False
+
+
+    def nrows(self):
+        if not self.columns:
+            return 0
+        return self.columns[0].n
+
+
+    def touch(self):
+        self.lastModification = int(time.time() * 1000)
+
+
+class LocalAsyncResult(object):
+    """
+    The result of an asynchronous call, the call is executed immediately but
+    end_ waits until the simulated reply time
+    """
+
+    def __init__(self, result, exception, readyAt):
+        self.result = result
+        self.exception = exception
+        self.readyAt = readyAt
+
+
+    def isCompleted(self):
+        return time.time() >= self.readyAt
+
+
+    def waitForCompleted(self):
+        delay = self.readyAt - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LocalTable(object):
+    """
+    A replacement for an omero.grid.Table proxy
+    """
+
+    def __init__(self, client, data):
+        self._client = client
+        self._data = data
+
+
+    def _check(self):
+        if self._data.deleted:
+            raise omero.ApiUsageException(None, None, 'Table deleted')
+        if self._data.headers is None:
+            raise omero.ApiUsageException(None, None, 'Table not initialized')
+
+
+    def initialize(self, cols):
+        self._client._wait()
+        if self._data.headers is not None:
+            raise omero.ApiUsageException(
+                None, None, 'Table already initialized')
+        self._data.headers = self._emptyColumns(cols)
+        self._data.columns = [LocalColumnData(c) for c in cols]
+        self._data.touch()
+
+
+    def getHeaders(self):
+        self._client._wait()
+        self._check()
+        return self._emptyColumns(self._data.headers)
+
+
+    def getNumberOfRows(self):
+        self._client._wait()
+        self._check()
+        return self._data.nrows()
+
+
+    def getOriginalFile(self):
+        self._client._wait()
+        return LocalGateway.originalFile(self._data)
+
+
+    def read(self, colNumbers, start, stop):
+        result = self._read(colNumbers, slice(start, stop))
+        self._client._wait(self._bytes(result))
+        return result
+
+
+    def readCoordinates(self, rowNumbers):
+        result = self._read(range(len(self._data.headers)), list(rowNumbers))
+        self._client._wait(self._bytes(result))
+        return result
+
+
+    def begin_read(self, colNumbers, start, stop):
+        return self._begin('read', colNumbers, start, stop)
+
+
+    def end_read(self, r):
+        return self._end(r)
+
+
+    def addData(self, cols):
+        self._check()
+        headers = self._data.headers
+        if len(cols) != len(headers) or \
+                [c.name for c in cols] != [h.name for h in headers]:
+            raise omero.ApiUsageException(None, None, 'Invalid columns')
+        nrows = set(len(c.values) for c in cols)
+        if len(nrows) != 1:
+            raise omero.ValidationException(
+                None, None, 'Columns have different lengths')
+
+        nrows = nrows.pop()
+        self._client._wait(sum(d.nbytes(nrows) for d in self._data.columns))
+        for (d, c) in itertools.izip(self._data.columns, cols):
+            d.extend(c.values)
+        self._data.touch()
+
+
+    def update(self, data):
+        self._check()
+        rows = list(data.rowNumbers)
+        if rows and (min(rows) < 0 or max(rows) >= self._data.nrows()):
+            raise omero.ApiUsageException(None, None, 'Invalid row number')
+        index = dict((h.name, n) for (n, h) in enumerate(self._data.headers))
+        self._client._wait(sum(self._data.columns[index[c.name]].nbytes(
+                    len(rows)) for c in data.columns))
+        for c in data.columns:
+            self._data.columns[index[c.name]].put(rows, c.values)
+        self._data.touch()
+
+
+    def getWhereList(self, condition, variables, start, stop, step):
+        """
+        The condition is evaluated as a python expression on numpy arrays of
+        the scalar columns, so simple conditions such as '(id==x)' are
+        compatible with OMERO.tables
+        """
+        self._client._wait()
+        self._check()
+        names = {}
+        for (h, d) in itertools.izip(self._data.headers, self._data.columns):
+            if not d.shape:
+                names[h.name] = d.array()
+        for (k, v) in (variables or {}).iteritems():
+            names[k] = unwrap(v)
+
+        match = numpy.asarray(eval(condition, {'__builtins__': {}}, names))
+        rows = numpy.flatnonzero(match)
+        if stop:
+            rows = rows[(rows >= start) & (rows < stop)]
+        else:
+            rows = rows[rows >= start]
+        if step:
+            rows = rows[::step]
+        return rows.tolist()
+
+
+    def begin_readCoordinates(self, rowNumbers):
+        return self._begin('readCoordinates', rowNumbers)
+
+
+    def end_readCoordinates(self, r):
+        return self._end(r)
+
+
+    def begin_addData(self, cols):
+        return self._begin('addData', cols)
+
+
+    def end_addData(self, r):
+        self._end(r)
+
+
+    def begin_update(self, data):
+        return self._begin('update', data)
+
+
+    def end_update(self, r):
+        self._end(r)
+
+
+    def begin_getWhereList(self, condition, variables, start, stop, step):
+        return self._begin('getWhereList', condition, variables, start, stop,
+                           step)
+
+
+    def end_getWhereList(self, r):
+        return self._end(r)
+
+
+    def close(self):
+        self._client._wait()
+
+
+    def delete(self):
+        self._client._wait()
+        self._data.deleted = True
+
+
+    def _begin(self, method, *args):
+        """
+        Internal helper method, runs a method immediately for an
+        asynchronous call, recording the simulated delay instead of sleeping
+        @param method The name of the synchronous method
+        @param args The method arguments
+        @return a LocalAsyncResult
+        """
+        client = LocalDeferredClient(self._client)
+        result = None
+        exception = None
+        t = time.time()
+        try:
+            result = getattr(LocalTable(client, self._data), method)(*args)
+        except Exception as e:
+            exception = e
+        return LocalAsyncResult(result, exception, t + client.delay)
+
+
+    def _end(self, r):
+        """
+        Internal helper method, waits for an asynchronous call
+        @param r The LocalAsyncResult
+        @return the result of the call
+        """
+        r.waitForCompleted()
+        if r.exception is not None:
+            raise r.exception
+        return r.result
+
+
+    def _read(self, colNumbers, rows):
+        """
+        Internal helper method, reads a set of rows
+        @param colNumbers The column indices
+        @param rows A slice or a list of row indices
+        @return an omero.grid.Data object
+        """
+        self._check()
+        nrows = self._data.nrows()
+        if isinstance(rows, slice):
+            rowNumbers = range(*rows.indices(nrows))
+        else:
+            if rows and (min(rows) < 0 or max(rows) >= nrows):
+                raise omero.ApiUsageException(None, None, 'Invalid row number')
+            rowNumbers = rows
+
+        columns = []
+        for n in colNumbers:
+            if n < 0 or n >= len(self._data.headers):
+                raise omero.ApiUsageException(
+                    None, None, 'Invalid column index: %d' % n)
+            c = deepcopy(self._data.headers[n])
+            c.values = self._data.columns[n].get(rows)
+            columns.append(c)
+        return omero.grid.Data(lastModification=self._data.lastModification,
+                               rowNumbers=rowNumbers, columns=columns)
+
+
+    def _bytes(self, data):
+        """
+        Internal helper method, the approximate size of a read
+        """
+        nrows = len(data.rowNumbers)
+        index = dict((h.name, n) for (n, h) in enumerate(self._data.headers))
+        return sum(self._data.columns[index[c.name]].nbytes(nrows)
+                   for c in data.columns)
+
+
+    def _emptyColumns(self, cols):
+        """
+        Internal helper method, copies a list of columns without values
+        """
+        headers = []
+        for c in cols:
+            h = deepcopy(c)
+            h.values = []
+            headers.append(h)
+        return headers
+
+
+class LocalFileWrapper(object):
+    """
+    A replacement for omero.gateway.OriginalFileWrapper
+    """
+
+    OMERO_CLASS = 'OriginalFile'
+
+    def __init__(self, gateway, data):
+        self._conn = gateway
+        self._data = data
+        self._obj = LocalGateway.originalFile(data)
+
+
+    def getId(self):
+        return self._data.id
+
+
+    def getName(self):
+        return self._data.name
+
+
+    def listAnnotations(self, ns=None):
+        links = self._conn.c.store.links.get(('OriginalFile', self._data.id))
+        for link in links or []:
+            a = link.getChild()
+            if ns is None or unwrap(a.getNs()) == ns:
+                cls = ANNOTATION_WRAPPERS.get(
+                    type(a), omero.gateway.AnnotationWrapper)
+                yield cls(self._conn, a, link=link)
+
+
+class LocalHandle(object):
+    """
+    A replacement for the handle of a command submitted to the server,
+    commands are completed before the handle is returned
+    """
+
+    def close(self):
+        pass
+
+
+class LocalQueryService(object):
+    """
+    A replacement for the OMERO query service. Only queries on annotations
+    of the form 'from Type a where a.x=:x and a.y.z=:y' are supported.
+    """
+
+    QUERY = re.compile(r'^\s*from\s+(\w+)\s+(\w+)\s+where\s+(.+?)\s*$')
+
+    def __init__(self, client):
+        self._client = client
+
+
+    def findByQuery(self, query, params):
+        found = self.findAllByQuery(query, params)
+        if len(found) > 1:
+            raise omero.ValidationException(
+                None, None, 'Query returned multiple results')
+        if found:
+            return found[0]
+        return None
+
+
+    def findAllByQuery(self, query, params):
+        self._client._wait()
+        m = self.QUERY.match(query)
+        if not m:
+            raise LocalTablesError('Unsupported query: %s' % query)
+        cls = getattr(omero.model, m.group(1) + 'I')
+        alias = m.group(2)
+
+        conditions = []
+        for cond in re.split(r'\s+and\s+', m.group(3)):
+            path, param = [s.strip() for s in cond.split('=:')]
+            path = path.split('.')
+            if path[0] != alias:
+                raise LocalTablesError('Unsupported query: %s' % query)
+            conditions.append((path[1:], unwrap(params.map[param])))
+
+        return [a for a in self._client.store.annotations.itervalues()
+                if isinstance(a, cls) and
+                all(self._getPath(a, p) == v for (p, v) in conditions)]
+
+
+    def _getPath(self, obj, path):
+        """
+        Internal helper method, follows a path of model properties
+        """
+        for p in path:
+            if obj is None:
+                return None
+            obj = getattr(obj, 'get' + p[0].upper() + p[1:])()
+        return unwrap(obj)
+
+
+class LocalUpdateService(object):
+    """
+    A replacement for the OMERO update service. Annotations and annotation
+    links are supported.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+
+    def saveObject(self, obj):
+        self.saveAndReturnObject(obj)
+
+
+    def saveArray(self, objs):
+        self._client._wait()
+        for obj in objs:
+            self._save(obj)
+
+
+    def saveAndReturnObject(self, obj):
+        self._client._wait()
+        return self._save(obj)
+
+
+    def _save(self, obj):
+        store = self._client.store
+        clsname = obj.__class__.__name__
+        if clsname.endswith('AnnotationLinkI'):
+            child = self._save(obj.getChild())
+            parentType = clsname[:-len('AnnotationLinkI')]
+            key = (parentType, unwrap(obj.getParent().getId()))
+            links = store.links.setdefault(key, [])
+            for link in links:
+                if link.getChild() is child:
+                    return link
+            obj.setChild(child)
+            if obj.getId() is None:
+                obj.setId(rlong(store.nextId()))
+            links.append(obj)
+            return obj
+
+        if not isinstance(obj, omero.model.Annotation):
+            raise LocalTablesError('Unsupported object type: %s' % clsname)
+        if obj.getId() is None:
+            obj.setId(rlong(store.nextId()))
+        store.annotations[unwrap(obj.getId())] = obj
+        return obj
+
+
+class LocalGateway(object):
+    """
+    A replacement for omero.gateway.BlitzGateway supporting OriginalFile
+    lookups and annotations
+    """
+
+    def __init__(self, client):
+        self.c = client
+
+
+    @staticmethod
+    def originalFile(data):
+        """
+        Create an OriginalFile object for a table
+        """
+        ofile = omero.model.OriginalFileI()
+        ofile.setId(rlong(data.id))
+        ofile.setName(rstring(data.name))
+        ofile.setMimetype(rstring('OMERO.tables'))
+        return ofile
+
+
+    def getObject(self, obj_type, oid=None, params=None, attributes=None):
+        self.c._wait()
+        if obj_type != 'OriginalFile':
+            raise LocalTablesError('Unsupported object type: %s' % obj_type)
+        if oid is None:
+            oid = (attributes or {}).get('id')
+        data = self.c.store.tables.get(unwrap(oid))
+        if data is None or data.deleted:
+            return None
+        if attributes and 'name' in attributes and \
+                attributes['name'] != data.name:
+            return None
+        return LocalFileWrapper(self, data)
+
+
+    def getObjects(self, obj_type, ids=None, params=None, attributes=None):
+        self.c._wait()
+        if obj_type != 'OriginalFile':
+            raise LocalTablesError('Unsupported object type: %s' % obj_type)
+        attributes = attributes or {}
+        for data in self.c.store.tables.values():
+            if data.deleted or (ids is not None and data.id not in ids):
+                continue
+            if 'name' in attributes and attributes['name'] != data.name:
+                continue
+            yield LocalFileWrapper(self, data)
+
+
+    def deleteObjects(self, graph_spec, obj_ids, **kwargs):
+        self.c._wait()
+        obj_ids = set(unwrap(oid) for oid in obj_ids)
+        if graph_spec == 'OriginalFile':
+            for oid in obj_ids:
+                data = self.c.store.tables.get(oid)
+                if data is not None:
+                    data.deleted = True
+        elif graph_spec.endswith('AnnotationLink'):
+            parentType = graph_spec[:-len('AnnotationLink')]
+            for (key, links) in self.c.store.links.iteritems():
+                if key[0] == parentType:
+                    links[:] = [l for l in links
+                                if unwrap(l.getId()) not in obj_ids]
+        else:
+            raise LocalTablesError('Unsupported object type: %s' % graph_spec)
+        return LocalHandle()
+
+
+    def _waitOnCmd(self, handle, loops=10, ms=500, failonerror=True):
+        pass
+
+
+    def getQueryService(self):
+        return LocalQueryService(self.c)
+
+
+    def getUpdateService(self):
+        return LocalUpdateService(self.c)
+
+
+    def _closeSession(self):
+        pass
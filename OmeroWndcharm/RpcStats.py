@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Counting and timing of remote calls made by TableConnection
+#
+
+from bisect import bisect_left
+import threading
+import time
+import types
+
+# Upper bounds (seconds) of the latency histogram buckets, slower calls are
+# counted in an additional final bucket
+LATENCY_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0)
+
+
+class MethodStats(object):
+    """
+    Statistics for a single remote method
+    """
+
+    def __init__(self, nbuckets):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.histogram = [0] * nbuckets
+
+
+class RpcStats(object):
+    """
+    Collects call counts, latency histograms and the approximate number of
+    bytes transferred for remote calls. A single instance can be shared
+    between several connections and threads.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, dumpOnClose=False):
+        """
+        @param buckets The upper bounds in seconds of the latency histogram
+        buckets
+        @param dumpOnClose If True connections using this object will log
+        summary() when they are closed
+        """
+        self.buckets = tuple(buckets)
+        self.dumpOnClose = dumpOnClose
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        """
+        Discard all recorded statistics
+        """
+        with self._lock:
+            self.methods = {}
+            self.retries = {}
+
+
+    def record(self, method, elapsed, nbytes=0, error=False):
+        """
+        Record a call
+        @param method The method name
+        @param elapsed The duration of the call in seconds
+        @param nbytes The approximate number of bytes sent or received
+        @param error True if the call raised an exception
+        """
+        with self._lock:
+            m = self.methods.get(method)
+            if m is None:
+                m = self.methods[method] = MethodStats(len(self.buckets) + 1)
+            m.calls += 1
+            m.seconds += elapsed
+            m.bytes += nbytes
+            m.histogram[bisect_left(self.buckets, elapsed)] += 1
+            if error:
+                m.errors += 1
+
+
+    def retry(self, method):
+        """
+        Record a retried call
+        @param method The method name
+        """
+        with self._lock:
+            self.retries[method] = self.retries.get(method, 0) + 1
+
+
+    def totals(self):
+        """
+        Get the totals over all methods
+        @return a tuple (calls, seconds, bytes)
+        """
+        with self._lock:
+            ms = self.methods.values()
+        return (sum(m.calls for m in ms), sum(m.seconds for m in ms),
+                sum(m.bytes for m in ms))
+
+
+    def summary(self):
+        """
+        Get a human readable summary of all calls
+        @return a multiline string
+        """
+        calls, seconds, nbytes = self.totals()
+        labels = ['<%gms' % (b * 1000) for b in self.buckets] + \
+            ['>%gms' % (self.buckets[-1] * 1000)]
+
+        lines = ['RPC calls: %d in %.3fs, %d bytes' % (calls, seconds, nbytes)]
+        for name in sorted(self.methods.keys()):
+            m = self.methods[name]
+            hist = ' '.join('%s:%d' % (l, h)
+                            for (l, h) in zip(labels, m.histogram) if h)
+            lines.append(
+                '\t%s calls:%d errors:%d time:%.3fs mean:%.1fms bytes:%d [%s]'
+                % (name, m.calls, m.errors, m.seconds,
+                   m.seconds * 1000 / m.calls, m.bytes, hist))
+        for name in sorted(self.retries.keys()):
+            lines.append('\t%s retries:%d' % (name, self.retries[name]))
+        return '\n'.join(lines) + '\n'
+
+
+    def __str__(self):
+        return self.summary()
+
+
+class InstrumentedProxy(object):
+    """
+    Wraps an object such as an Ice proxy or BlitzGateway so that all method
+    calls are recorded in an RpcStats object. Asynchronous Ice calls
+    (begin_x/end_x) are recorded as x, timed from begin_x to end_x, and may
+    be made from several threads. Generators returned by a call (such as
+    BlitzGateway.getObjects()) make their remote calls as they are iterated,
+    so they are consumed within the timed call.
+    """
+
+    def __init__(self, obj, stats, prefix='', sizer=None, wrapped=None):
+        """
+        @param obj The object to be wrapped
+        @param stats An RpcStats object
+        @param prefix A prefix added to all method names
+        @param sizer If provided a function sizer(method, args, result)
+        which returns the approximate number of bytes transferred by a call
+        @param wrapped A dictionary of method names to prefixes, the
+        non-null results of these methods are also wrapped
+        """
+        self._obj = obj
+        self._stats = stats
+        self._prefix = prefix
+        self._sizer = sizer
+        self._wrapped = wrapped or {}
+        # Start time and arguments of each begin_ call not yet ended
+        self._pending = {}
+        self._pendingLock = threading.Lock()
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+        if name.startswith('begin_'):
+            return self._begin(name[6:], attr)
+        if name.startswith('end_'):
+            return self._end(name[4:], attr)
+
+        def call(*args, **kwargs):
+            t0 = time.time()
+            try:
+                r = attr(*args, **kwargs)
+                if isinstance(r, types.GeneratorType):
+                    r = iter(list(r))
+            except Exception:
+                self._stats.record(
+                    self._prefix + name, time.time() - t0, error=True)
+                raise
+            self._stats.record(self._prefix + name, time.time() - t0,
+                               self._size(name, args, r))
+            return self._wrap(name, r)
+        return call
+
+
+    def _begin(self, name, attr):
+        """
+        Internal helper method, wraps an asynchronous begin_ method
+        """
+        def call(*args, **kwargs):
+            t0 = time.time()
+            r = attr(*args, **kwargs)
+            with self._pendingLock:
+                self._pending[r] = (t0, args)
+            return r
+        return call
+
+
+    def _end(self, name, attr):
+        """
+        Internal helper method, wraps an asynchronous end_ method
+        """
+        def call(r):
+            with self._pendingLock:
+                t0, args = self._pending.pop(r, (time.time(), ()))
+            try:
+                result = attr(r)
+            except Exception:
+                self._stats.record(
+                    self._prefix + name, time.time() - t0, error=True)
+                raise
+            self._stats.record(self._prefix + name, time.time() - t0,
+                               self._size(name, args, result))
+            return result
+        return call
+
+
+    def _size(self, name, args, result):
+        """
+        Internal helper method, estimates the bytes transferred by a call
+        """
+        if self._sizer:
+            return self._sizer(name, args, result)
+        return 0
+
+
+    def _wrap(self, name, result):
+        """
+        Internal helper method, wraps the result of a call if required
+        """
+        prefix = self._wrapped.get(name)
+        if prefix is None or result is None:
+            return result
+        return InstrumentedProxy(result, self._stats, prefix, self._sizer)
@@ -21,17 +21,125 @@
 
 #
 #
-from itertools import izip
+from itertools import izip, chain
+from collections import deque
 import logging
+import time
+import numpy
+import Ice
 import omero
 from copy import deepcopy
 from omero.gateway import BlitzGateway
-from omero.grid import LongColumn, BoolColumn, \
-    LongArrayColumn, DoubleArrayColumn
+from omero.grid import LongColumn, BoolColumn, DoubleColumn, StringColumn, \
+    LongArrayColumn, DoubleArrayColumn, FloatArrayColumn
+from RpcStats import InstrumentedProxy
+from TableFutures import IceFuture, ExecutorFuture
 
 # Retry openTable and newTable, see trac #10464
 TABLE_RETRIES = 5
 
+# Default number of chunked read requests to keep in flight at once
+READ_PIPELINE = 4
+
+# FeatureTableConnection table layouts:
+# LAYOUT_BOOLCOLUMNS has one BoolColumn per data column ('_b_' + name)
+# LAYOUT_PACKED has a single LongArrayColumn PACKED_VALID_COLUMN holding the
+# validity flags of all columns as a bitmask, PACKED_BITS per element
+LAYOUT_BOOLCOLUMNS = 1
+LAYOUT_PACKED = 2
+PACKED_VALID_COLUMN = '_valid_v2'
+PACKED_BITS = 63
+
+# readRows() will read up to this many unwanted rows between two requested
+# rows instead of making a separate call
+READ_ROWS_GAP = 16
+
+# compactTable(sort=True) holds up to approximately this many bytes of rows
+# in memory while sorting them, larger tables are sorted in several passes
+COMPACT_SORT_BYTES = 64 * 1024 * 1024
+
+# Pass as the chunk size to calculate the number of rows in each call from
+# the row width and a byte budget, see TableConnection.chunkBytes
+AUTO_CHUNK = -1
+
+# Default maximum number of bytes to transfer in each call when using
+# AUTO_CHUNK, this should be well below Ice.MessageSizeMax
+CHUNK_BYTES = 4 * 1024 * 1024
+
+# AUTO_CHUNK reduces the chunk size below CHUNK_BYTES if calls are slow, so
+# that each call takes roughly this many seconds, but never below
+# CHUNK_MIN_BYTES
+CHUNK_SECONDS = 2.0
+CHUNK_MIN_BYTES = 64 * 1024
+
+# Approximate number of bytes per element for each column type, used by
+# AUTO_CHUNK. Array and string columns are multiplied by the column size.
+COLUMN_BYTES = {
+    LongColumn: 8,
+    BoolColumn: 1,
+    DoubleColumn: 8,
+    StringColumn: 1,
+    LongArrayColumn: 8,
+    DoubleArrayColumn: 8,
+    FloatArrayColumn: 4,
+    }
+
+# Numpy types used for column values when reading with asarray=True, any
+# other column types are returned as lists
+ARRAY_DTYPES = {
+    LongColumn: numpy.int64,
+    BoolColumn: numpy.bool_,
+    DoubleColumn: numpy.float64,
+    LongArrayColumn: numpy.int64,
+    DoubleArrayColumn: numpy.float64,
+    FloatArrayColumn: numpy.float64,
+    }
+
+# Default maximum number of open tables held by a ConnectionPool, tables
+# which are in use by a connection are not counted
+POOL_MAX_TABLES = 8
+
+# Results of these methods are also instrumented when using RpcStats
+INSTRUMENTED_GATEWAY = {
+    'getQueryService': 'query.',
+    'getUpdateService': 'update.',
+    }
+INSTRUMENTED_RESOURCES = {
+    'newTable': 'table.',
+    'openTable': 'table.',
+    }
+
+
+def columnBytes(columns):
+    """
+    Estimate the size of a set of columns
+    @param columns A list of columns
+    @return the approximate number of bytes in the column values
+    """
+    return sum(len(c.values or ()) * COLUMN_BYTES.get(type(c), 8) *
+               getattr(c, 'size', 1) for c in columns)
+
+
+def rpcBytes(method, args, result):
+    """
+    Estimate the number of bytes transferred by a table call, for use with
+    InstrumentedProxy
+    @param method The method name
+    @param args The arguments
+    @param result The returned value
+    @return the approximate number of bytes sent or received
+    """
+    if method in ('read', 'readCoordinates', 'slice'):
+        return columnBytes(result.columns)
+    if method == 'addData':
+        return columnBytes(args[0])
+    if method == 'update':
+        return columnBytes(args[0].columns)
+    if method == 'getWhereList':
+        return 8 * len(result)
+    return 0
+
+
 class TableConnectionError(Exception):
     """
     Errors occuring in the TableConnection class
@@ -44,19 +152,34 @@ class Connection(object):
     A wrapper for managing a client session context
     """
 
-    def __init__(self, user = None, passwd = None, host = None, client = None):
+    def __init__(self, user = None, passwd = None, host = None, client = None,
+                 stats = None):
         """
         Create a new client session, either by specifying user and passwd or by
         providing a client object (for scripts)
         @param user Username
         @param passwd Password
         @param host The server hostname
-        @param client Client object with an active session
+        @param client Client object with an active session, or any object
+        with the same interface which also provides a getGateway() method
+        (e.g. LocalTables.LocalClient), or a ConnectionPool to share its
+        session and tables
+        @param stats If provided an RpcStats object used to record all remote
+        calls made through this connection, ignored if client is a
+        ConnectionPool (the pool's stats are used)
         """
 
         self.log = logging.getLogger(__name__)
         #self.log.setLevel(logging.DEBUG)
 
+        self.pool = None
+        if isinstance(client, ConnectionPool):
+            self.pool = client
+            self.conn = client.conn
+            self.res = client.res
+            self.stats = client.stats
+            return
+
         if not client:
             client = omero.client(host)
             sess = client.createSession(user, passwd)
@@ -64,9 +187,22 @@ class Connection(object):
         else:
             sess = client.getSession()
 
-        self.conn = BlitzGateway(client_obj = client)
+        # Clients which aren't an omero.client (such as
+        # LocalTables.LocalClient) provide their own gateway
+        getGateway = getattr(client, 'getGateway', None)
+        if getGateway:
+            self.conn = getGateway()
+        else:
+            self.conn = BlitzGateway(client_obj = client)
 
         self.res = sess.sharedResources()
+        self.stats = stats
+        if stats is not None:
+            self.conn = InstrumentedProxy(
+                self.conn, stats, 'gateway.', wrapped=INSTRUMENTED_GATEWAY)
+            self.res = InstrumentedProxy(
+                self.res, stats, 'resources.', rpcBytes,
+                wrapped=INSTRUMENTED_RESOURCES)
         if (not self.res.areTablesEnabled()):
             raise TableConnectionError('OMERO.tables not enabled')
 
@@ -84,9 +220,171 @@ class Connection(object):
         method to ensure the client session is cleaned
         """
         self.log.debug('Closing Connection')
+        if self.pool:
+            # The session belongs to the pool
+            return
+        self._dumpStats()
         self.conn._closeSession()
 
 
+    def _dumpStats(self):
+        """
+        Internal helper method, logs the RpcStats summary if enabled
+        """
+        if self.stats is not None and self.stats.dumpOnClose:
+            self.log.info('%s', self.stats.summary())
+
+
+    def _recordRetry(self, method):
+        """
+        Internal helper method, records a retried remote call if stats are
+        enabled
+        @param method The method name
+        """
+        if self.stats is not None:
+            self.stats.retry(method)
+
+
+class ConnectionPool(Connection):
+    """
+    A session shared by several connections: pass this as the client of a
+    TableConnection (or any subclass) to reuse one gateway and shared
+    resources proxy. Open tables are also shared, and when a connection
+    closes a table it is kept open in the pool so reopening it is free. The
+    least recently used tables which are not in use are closed when there are
+    more than maxTables.
+    """
+
+    def __init__(self, user = None, passwd = None, host = None, client = None,
+                 stats = None, maxTables = POOL_MAX_TABLES):
+        """
+        @param user Username
+        @param passwd Password
+        @param host The server hostname
+        @param client Client object with an active session, or any object
+        with the same interface which also provides a getGateway() method
+        @param stats If provided an RpcStats object used to record all remote
+        calls made by connections using this pool
+        @param maxTables The maximum number of unused open tables
+        """
+        if isinstance(client, ConnectionPool):
+            raise TableConnectionError('Pools cannot be nested')
+        super(ConnectionPool, self).__init__(user, passwd, host, client,
+                                             stats)
+        self.maxTables = maxTables
+        self.fileNames = {}
+        self.headers = {}
+        # tableId: [table, number of users, last used]
+        self._tables = {}
+        self._clock = 0
+        self._rid = None
+
+
+    def close(self):
+        """
+        Close all tables and the session
+        """
+        try:
+            self.closeTables()
+        finally:
+            super(ConnectionPool, self).close()
+
+
+    def closeTables(self):
+        """
+        Close all tables, including any still in use
+        """
+        tables = self._tables
+        self._tables = {}
+        for tableId in tables.keys():
+            self._closeTable(tableId, tables[tableId][0])
+
+
+    def getRepositoryId(self):
+        """
+        Get the id of the repository used for new tables, this is only
+        looked up once
+        """
+        if self._rid is None:
+            repos = self.res.repositories()
+            self._rid = repos.descriptions[0].id.val
+        return self._rid
+
+
+    def acquireTable(self, tableId, opener):
+        """
+        Get an open table, marking it as in use
+        @param tableId The table id
+        @param opener A function which opens the table if it isn't in the pool
+        @return the table proxy
+        """
+        e = self._tables.get(tableId)
+        if e is None:
+            e = [opener(), 0, 0]
+            self._tables[tableId] = e
+        e[1] += 1
+        self._clock += 1
+        e[2] = self._clock
+        self.log.debug('Acquired table id:%d (users:%d)', tableId, e[1])
+        return e[0]
+
+
+    def addTable(self, tableId, table):
+        """
+        Add a newly created table, marking it as in use
+        @param tableId The table id
+        @param table The table proxy
+        """
+        return self.acquireTable(tableId, lambda: table)
+
+
+    def releaseTable(self, tableId):
+        """
+        Mark a table as no longer in use by a connection, it remains open
+        until evicted
+        @param tableId The table id
+        """
+        e = self._tables.get(tableId)
+        if e is None:
+            return
+        e[1] = max(e[1] - 1, 0)
+        self.log.debug('Released table id:%d (users:%d)', tableId, e[1])
+        self._evict()
+
+
+    def discardTable(self, tableId):
+        """
+        Remove a table from the pool without closing it, for example because
+        it has been deleted
+        @param tableId The table id
+        """
+        self._tables.pop(tableId, None)
+        self.headers.pop(tableId, None)
+        self.fileNames.pop(tableId, None)
+
+
+    def _evict(self):
+        """
+        Internal helper method, closes the least recently used unused tables
+        until the limit is met
+        """
+        unused = sorted((e[2], tableId) for (tableId, e)
+                        in self._tables.iteritems() if e[1] == 0)
+        for (t, tableId) in unused[:max(len(unused) - self.maxTables, 0)]:
+            self._closeTable(tableId, self._tables.pop(tableId)[0])
+
+
+    def _closeTable(self, tableId, table):
+        """
+        Internal helper method, closes a table proxy
+        """
+        self.log.debug('Closing pooled table id:%d', tableId)
+        try:
+            table.close()
+        except Exception as e:
+            self.log.error('Failed to close table id:%d: %s', tableId, e)
+
+
 class TableConnection(Connection):
     """
     A basic client-side wrapper for OMERO.tables which handles opening
@@ -94,7 +392,7 @@ class TableConnection(Connection):
     """
 
     def __init__(self, user = None, passwd = None, host = None, client = None,
-                 tableName = None):
+                 tableName = None, stats = None):
         """
         Create a new table handler, either by specifying user and passwd or by
         providing a client object (for scripts)
@@ -105,16 +403,33 @@ class TableConnection(Connection):
         @param tableName If provided the name of any table opened by subsequent
         calls will be checked against this, and any new tables will be named
         by this
+        @param stats If provided an RpcStats object, see Connection
         """
-        super(TableConnection, self).__init__(user, passwd, host, client)
+        super(TableConnection, self).__init__(user, passwd, host, client,
+                                              stats)
 
-        repos = self.res.repositories()
-        self.rid = repos.descriptions[0].id.val
+        if self.pool:
+            self.rid = self.pool.getRepositoryId()
+        else:
+            repos = self.res.repositories()
+            self.rid = repos.descriptions[0].id.val
 
         self.tableName = tableName
         self.tableId = None
         self.table = None
 
+        # Names of OriginalFiles opened by this connection, used to check
+        # tableName without reloading the file
+        self._fileNames = self.pool.fileNames if self.pool else {}
+
+        # Cached table headers and column name to index map
+        self._headers = None
+        self._colIndex = None
+
+        # Byte budget and measured transfer rate for AUTO_CHUNK
+        self.chunkBytes = CHUNK_BYTES
+        self._chunkRate = None
+
     def close(self, parent=True):
         """
         Close all tables.
@@ -128,6 +443,8 @@ class TableConnection(Connection):
         finally:
             if parent:
                 super(TableConnection, self).close()
+            else:
+                self._dumpStats()
 
 
     def openTable(self, tableId):
@@ -151,6 +468,7 @@ class TableConnection(Connection):
                     return t
                 self.log.error('Failed to open table %d (attempt %d)',
                                ofile.getId().val, i + 1)
+                self._recordRetry('openTable')
             raise TableConnectionError(
                 'Failed to open table %d' % ofile.getId().val)
 
@@ -159,35 +477,43 @@ class TableConnection(Connection):
             tableId = self.tableId
         if not tableId:
             raise TableConnectionError('Table ID required')
+        tableId = long(tableId)
 
-        attrs = {'id': long(tableId)}
-        ofile = self.conn.getObject("OriginalFile", attributes = attrs)
-        if not ofile:
-            raise TableConnectionError('No table found with id:%s' % tableId)
-        if self.tableName and ofile.getName() != self.tableName:
+        if self.table and self.tableId == tableId:
+            self.log.debug('Using existing connection to table id:%d', tableId)
+            return self.table
+
+        name = self._fileNames.get(tableId)
+        if name is None:
+            attrs = {'id': tableId}
+            ofile = self.conn.getObject("OriginalFile", attributes = attrs)
+            if not ofile:
+                raise TableConnectionError(
+                    'No table found with id:%s' % tableId)
+            name = ofile.getName()
+            self._fileNames[tableId] = name
+        if self.tableName and name != self.tableName:
             raise TableConnectionError(
                 'Expected table id:%s to have name:%s, instead found %s' % (
-                    tableId, self.tableName, ofile.getName()))
+                    tableId, self.tableName, name))
 
-        if self.tableId == ofile.getId():
-            if not self.table:
-                self.log.warn('Expected table to be already open')
-        else:
-            self.table = None
-
-        if self.table:
-            self.log.debug('Using existing connection to table id:%d', tableId)
+        self.closeTable()
+        opener = lambda: openRetry(omero.model.OriginalFileI(tableId, False),
+                                   TABLE_RETRIES)
+        if self.pool:
+            self.table = self.pool.acquireTable(tableId, opener)
         else:
-            self.closeTable()
-            self.table = openRetry(ofile._obj, TABLE_RETRIES)
-            self.tableId = ofile.getId()
-            self.log.debug('Opened table id:%d', self.tableId)
+            self.table = opener()
+        self.tableId = tableId
+        self.log.debug('Opened table id:%d', self.tableId)
 
-        try:
-            self.log.debug('\t%d rows %d columns', self.table.getNumberOfRows(),
-                           len(self.table.getHeaders()))
-        except omero.ApiUsageException:
-            pass
+        if self.log.isEnabledFor(logging.DEBUG):
+            try:
+                self.log.debug('\t%d rows %d columns',
+                               self.table.getNumberOfRows(),
+                               len(self._getHeaders()))
+            except omero.ApiUsageException:
+                pass
 
         return self.table
 
@@ -214,8 +540,14 @@ class TableConnection(Connection):
         ofiles = self.conn.getObjects("OriginalFile", \
             attributes = {'name': self.tableName})
         ids = [f.getId() for f in ofiles]
+        if self.tableId in ids:
+            self.closeTable()
         self.log.debug('Deleting ids:%s', ids)
         self.conn.deleteObjects('OriginalFile', ids)
+        if self.pool:
+            # Other connections must not be given the deleted tables
+            for tableId in ids:
+                self.pool.discardTable(tableId)
 
 
     def closeTable(self):
@@ -223,11 +555,15 @@ class TableConnection(Connection):
         Close the table if open, and set table and tableId to None
         """
         try:
-            if self.table:
+            if self.pool and self.tableId is not None:
+                self.pool.releaseTable(self.tableId)
+            elif self.table:
                 self.table.close()
         finally:
             self.table = None
             self.tableId = None
+            self._headers = None
+            self._colIndex = None
 
 
     def newTable(self, schema):
@@ -248,6 +584,7 @@ class TableConnection(Connection):
                     return t
                 self.log.error('Failed to create new table %s (attempt %d)',
                                name, i + 1)
+                self._recordRetry('newTable')
             raise TableConnectionError(
                 'Failed to create new table %s' % name)
 
@@ -259,9 +596,13 @@ class TableConnection(Connection):
         self.table = newRetry(self.rid, self.tableName, TABLE_RETRIES)
         ofile = self.table.getOriginalFile()
         self.tableId = ofile.getId().getValue()
+        self._fileNames[self.tableId] = self.tableName
+        if self.pool:
+            self.pool.addTable(self.tableId, self.table)
 
         try:
             self.table.initialize(schema)
+            self._getHeaders()
             self.log.debug("Initialised '%s' (%d)",
                            self.tableName, self.tableId)
         except Exception as e:
@@ -271,6 +612,8 @@ class TableConnection(Connection):
             except Exception as ed:
                 self.log.error("Failed to delete table: %s", ed)
 
+            if self.pool:
+                self.pool.discardTable(self.tableId)
             self.table = None
             self.tableId = None
             raise e
@@ -281,9 +624,51 @@ class TableConnection(Connection):
     def getHeaders(self):
         """
         Get a set of empty columns corresponding to the table schema
-        @return a set of empty table columns
+        @return a set of empty table columns, these are copies of the cached
+        schema so can be filled with values
+        """
+        return self._copyHeaders()
+
+
+    def getColumnIndex(self, name):
+        """
+        Get the index of a column
+        @param name The column name
+        @return the column index
+        """
+        self._getHeaders()
+        try:
+            return self._colIndex[name]
+        except KeyError:
+            raise TableConnectionError('Column not found: %s' % name)
+
+
+    def _getHeaders(self):
         """
-        return self.table.getHeaders()
+        Internal helper method, gets the table headers which are cached
+        until the table is closed. The returned columns are shared so must
+        not be modified, use _copyHeaders() or getHeaders() instead.
+        @return the cached list of empty table columns
+        """
+        if self._headers is None:
+            headers = None
+            if self.pool:
+                headers = self.pool.headers.get(self.tableId)
+            if headers is None:
+                headers = self.table.getHeaders()
+                if self.pool:
+                    self.pool.headers[self.tableId] = headers
+            self._colIndex = dict((h.name, n) for (n, h) in enumerate(headers))
+            self._headers = headers
+        return self._headers
+
+
+    def _copyHeaders(self):
+        """
+        Internal helper method, gets a copy of all table headers
+        @return a list of empty table columns
+        """
+        return deepcopy(self._getHeaders())
 
 
     def getNumberOfRows(self):
@@ -294,38 +679,323 @@ class TableConnection(Connection):
         return self.table.getNumberOfRows()
 
 
-    def chunkedRead(self, colNumbers, start, stop, chunk):
+    def getLastModification(self):
+        """
+        Get the modification timestamp of the table, this changes whenever
+        the table is modified, and possibly when it is reopened by the server
+        @return the lastModification timestamp (milliseconds)
+        """
+        return self.table.read([0], 0, 0).lastModification
+
+
+    def chunkedRead(self, colNumbers, start, stop, chunk=AUTO_CHUNK,
+                    pipeline=READ_PIPELINE, asarray=False):
         """
         Split a call to table.read(), into multiple chunks to limit the number
         of rows returned in one go.
         @param colNumbers A list of columns indices to be read
         @param start The first row to be read
         @param stop The last + 1 row to be read
-        @param chunk The maximum number of rows to read in each call
-        @return a data object, note lastModified will be set to the timestamp
-        the first chunked call
+        @param chunk The maximum number of rows to read in each call, or
+        AUTO_CHUNK to calculate this from the row width
+        @param pipeline The maximum number of chunk requests to have in flight
+        at once, 1 to read each chunk sequentially
+        @param asarray If True rowNumbers and numeric column values are
+        returned as numpy arrays (2-D for array-columns) instead of lists,
+        see ARRAY_DTYPES
+        @return a data object, note lastModification will be set to the
+        timestamp of the first chunked call
+        """
+        reads = self.iterRead(colNumbers, start, stop, chunk, pipeline)
+        if asarray:
+            return self._readIntoArrays(reads, max(stop - start, 0))
+
+        data = next(reads)
+
+        for data2 in reads:
+            self._appendData(data, data2)
+
+        return data
+
+
+    def _appendData(self, data, data2):
+        """
+        Internal helper method, appends the rows in one data object to another
+        @param data The data object to be extended
+        @param data2 The data object holding the following rows
+        """
+        data.rowNumbers.extend(data2.rowNumbers)
+        for (c, c2) in izip(data.columns, data2.columns):
+            c.values.extend(c2.values)
+
+
+    def _readIntoArrays(self, reads, nrows):
+        """
+        Internal helper method, copies each chunk into a single set of
+        preallocated numpy arrays as soon as it is received so that the
+        per-chunk lists can be discarded
+        @param reads An iterator of data objects
+        @param nrows The maximum number of rows that will be read
+        @return a data object whose numeric column values are arrays
+        """
+        data = next(reads)
+        rowNumbers = numpy.empty(nrows, dtype=numpy.int64)
+        arrays = [self._emptyArray(c, nrows) for c in data.columns]
+
+        p = 0
+        for data2 in chain([data], reads):
+            q = p + len(data2.rowNumbers)
+            rowNumbers[p:q] = data2.rowNumbers
+            for (a, c, c2) in izip(arrays, data.columns, data2.columns):
+                if a is not None:
+                    if q > p:
+                        a[p:q] = c2.values
+                    c2.values = None
+                elif c2 is not c:
+                    c.values.extend(c2.values)
+            p = q
+
+        data.rowNumbers = rowNumbers[:p]
+        for (a, c) in izip(arrays, data.columns):
+            if a is not None:
+                c.values = a[:p]
+        return data
+
+
+    def _emptyArray(self, col, nrows):
+        """
+        Internal helper method, allocates an array for holding the values
+        of a column
+        @param col The column
+        @param nrows The number of rows
+        @return an uninitialised numpy array, or None if the column type does
+        not have a numpy representation
+        """
+        dtype = ARRAY_DTYPES.get(type(col))
+        if dtype is None:
+            return None
+        if isinstance(col, (LongArrayColumn, DoubleArrayColumn,
+                            FloatArrayColumn)):
+            return numpy.empty((nrows, col.size), dtype=dtype)
+        return numpy.empty(nrows, dtype=dtype)
+
+
+    def iterRead(self, colNumbers, start, stop, chunk=AUTO_CHUNK,
+                 pipeline=READ_PIPELINE):
+        """
+        A generator version of chunkedRead() which returns each chunk as it
+        is read instead of combining them, so that tables of any size can be
+        processed without holding all rows in memory.
+        @param colNumbers A list of columns indices to be read
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @param chunk The maximum number of rows to read in each call, or
+        AUTO_CHUNK to calculate this from the row width
+        @param pipeline The maximum number of chunk requests to have in flight
+        at once, 1 to read each chunk sequentially
+        @return an iterator of data objects, one per chunk in row order
+        """
+        rowBytes = self._rowBytes(colNumbers)
+        return self._readChunks(
+            colNumbers, self._chunkRanges(start, stop, chunk, rowBytes),
+            pipeline, rowBytes)
+
+
+    def _rowBytes(self, colNumbers=None):
+        """
+        Internal helper method, estimates the size of a row
+        @param colNumbers A list of column indices, default all columns
+        @return the approximate number of bytes in a row
+        """
+        headers = self._getHeaders()
+        if colNumbers is not None:
+            headers = [headers[n] for n in colNumbers]
+        return max(1, sum(COLUMN_BYTES.get(type(h), 8) * getattr(h, 'size', 1)
+                          for h in headers))
+
+
+    def _autoChunkRows(self, rowBytes):
+        """
+        Internal helper method, calculates the number of rows to transfer in
+        each call when using AUTO_CHUNK
+        @param rowBytes The approximate number of bytes in a row
+        @return the number of rows
+        """
+        nbytes = self.chunkBytes
+        if self._chunkRate:
+            nbytes = min(nbytes, max(self._chunkRate * CHUNK_SECONDS,
+                                     CHUNK_MIN_BYTES))
+        return max(1, int(nbytes // rowBytes))
+
+
+    def _recordChunkRate(self, nbytes, elapsed):
+        """
+        Internal helper method, updates the moving average of the transfer
+        rate used by AUTO_CHUNK
+        @param nbytes The approximate number of bytes transferred
+        @param elapsed The time taken in seconds
+        """
+        if elapsed <= 0:
+            return
+        rate = nbytes / elapsed
+        if self._chunkRate:
+            rate = (self._chunkRate + rate) / 2
+        self._chunkRate = rate
+
+
+    def _isMessageSizeError(self, e):
+        """
+        Internal helper method, checks whether an exception was caused by an
+        Ice message exceeding Ice.MessageSizeMax, either locally or on the
+        server
+        @param e The exception
+        @return True if the exception is a message size error
+        """
+        if isinstance(e, Ice.MemoryLimitException):
+            return True
+        return isinstance(e, Ice.UnknownLocalException) and \
+            'MemoryLimitException' in str(e.unknown)
+
+
+    def _chunkRanges(self, start, stop, chunk, rowBytes):
+        """
+        Internal helper method, splits a range of rows into chunks. At least
+        one (possibly empty) range is always returned.
+        @param start The first row
+        @param stop The last + 1 row
+        @param chunk The maximum number of rows in each range, or AUTO_CHUNK
+        in which case the size is recalculated before each range is returned
+        @param rowBytes The approximate number of bytes in a row
+        @return an iterator of (p, q) tuples
         """
+        def nextChunk():
+            if chunk == AUTO_CHUNK:
+                return self._autoChunkRows(rowBytes)
+            return chunk
+
         p = start
-        q = min(start + chunk, stop)
-        data = self.table.read(colNumbers, p, q)
-        p, q = q, min(q + chunk, stop)
+        q = min(start + nextChunk(), stop)
+        yield (p, q)
+        p, q = q, min(q + nextChunk(), stop)
 
         while p < stop:
-            data2 = self.table.read(colNumbers, p, q)
-            data.rowNumbers.extend(data2.rowNumbers)
-            for (c, c2) in izip(data.columns, data2.columns):
-                c.values.extend(c2.values)
-            p, q = q, min(q + chunk, stop)
+            yield (p, q)
+            p, q = q, min(q + nextChunk(), stop)
+
+
+    def _readChunks(self, colNumbers, ranges, pipeline, rowBytes):
+        """
+        Internal helper method, reads a sequence of row ranges. If pipeline
+        is greater than 1 the requests are sent asynchronously (Ice AMI) so
+        that up to pipeline requests are outstanding at any one time.
+        @param colNumbers A list of columns indices to be read
+        @param ranges An iterable of (start, stop) row ranges
+        @param pipeline The maximum number of requests in flight
+        @param rowBytes The approximate number of bytes in a row
+        @return an iterator of data objects in the same order as ranges
+        """
+        if pipeline <= 1:
+            for (p, q) in ranges:
+                t0 = time.time()
+                data = self._readSplit(colNumbers, p, q, rowBytes)
+                self._recordChunkRate(
+                    len(data.rowNumbers) * rowBytes, time.time() - t0)
+                yield data
+            return
+
+        pending = deque()
+        for (p, q) in ranges:
+            pending.append(
+                (p, q, self.table.begin_read(colNumbers, p, q), time.time()))
+            if len(pending) >= pipeline:
+                yield self._endRead(colNumbers, rowBytes, *pending.popleft())
+                # Subsequent requests are only timed from the previous
+                # reply so that time spent queued isn't counted
+                if pending:
+                    pending[0] = pending[0][:3] + (time.time(),)
+
+        while pending:
+            yield self._endRead(colNumbers, rowBytes, *pending.popleft())
+            if pending:
+                pending[0] = pending[0][:3] + (time.time(),)
+
+
+    def _endRead(self, colNumbers, rowBytes, p, q, r, t0):
+        """
+        Internal helper method, waits for an asynchronous read of a chunk.
+        If the read failed because the message size limit was exceeded the
+        chunk is split and read again synchronously.
+        @param colNumbers A list of columns indices to be read
+        @param rowBytes The approximate number of bytes in a row
+        @param p The first row of the chunk
+        @param q The last + 1 row of the chunk
+        @param r The Ice.AsyncResult returned by begin_read
+        @param t0 The time the read was started
+        @return a data object
+        """
+        try:
+            data = self.table.end_read(r)
+        except Ice.Exception as e:
+            if not self._isMessageSizeError(e):
+                raise
+            data = self._readSplit(colNumbers, p, q, rowBytes, e)
+        self._recordChunkRate(
+            len(data.rowNumbers) * rowBytes, time.time() - t0)
+        return data
+
 
+    def _readSplit(self, colNumbers, start, stop, rowBytes, error=None):
+        """
+        Internal helper method, calls table.read(). If the call fails
+        because the message size limit was exceeded the range is split in
+        two and each half is read separately, and the AUTO_CHUNK budget is
+        reduced.
+        @param colNumbers A list of columns indices to be read
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @param rowBytes The approximate number of bytes in a row
+        @param error If not None a message size error which has already been
+        raised for this range
+        @return a data object
+        """
+        if error is None:
+            try:
+                return self.table.read(colNumbers, start, stop)
+            except Ice.Exception as e:
+                if not self._isMessageSizeError(e):
+                    raise
+                error = e
+
+        if stop - start <= 1:
+            raise error
+        self.log.warn('Message size limit exceeded reading rows %d-%d, '
+                      'splitting', start, stop)
+        self._recordRetry('read')
+        self._shrinkChunkBytes(stop - start, rowBytes)
+        mid = (start + stop) / 2
+        data = self._readSplit(colNumbers, start, mid, rowBytes)
+        self._appendData(data, self._readSplit(colNumbers, mid, stop, rowBytes))
         return data
 
 
-    def chunkedAddData(self, columns, chunk):
+    def _shrinkChunkBytes(self, nrows, rowBytes):
+        """
+        Internal helper method, reduces the AUTO_CHUNK byte budget after a
+        message size failure
+        @param nrows The number of rows in the failed call
+        @param rowBytes The approximate number of bytes in a row
+        """
+        self.chunkBytes = max(rowBytes, min(self.chunkBytes,
+                                            nrows * rowBytes / 2))
+
+
+    def chunkedAddData(self, columns, chunk=AUTO_CHUNK):
         """
         Split a call to table.addData(), into multiple chunks to limit the
         number of rows added in one go.
         @param columns A full list of columns holding data to be added
-        @param chunk The maximum number of rows to write in each call
+        @param chunk The maximum number of rows to write in each call, or
+        AUTO_CHUNK to calculate this from the row width
         @return the number of rows written
         """
         nv = [len(c.values) for c in columns]
@@ -334,26 +1004,152 @@ class TableConnection(Connection):
                 'All columns must be the same length, received: %s' % nv)
         nv = nv[0]
 
-        headers = self.table.getHeaders()
+        headers = self._copyHeaders()
         if len(columns) != len(headers) or \
                 [h.name for h in headers] != [c.name for c in columns] or \
                 [type(h) for h in headers] != [type(c) for c in columns]:
             raise TableConnectionError(
                 'Mismatch between columns and table headers')
 
+        rowBytes = self._rowBytes()
         p = 0
-        q = 0
-        p, q = q, min(q + chunk, nv)
-
         while p < nv:
-            for (h, c) in izip(headers, columns):
-                h.values = c.values[p:q]
-            self.table.addData(headers)
-            p, q = q, min(q + chunk, nv)
+            if chunk == AUTO_CHUNK:
+                q = min(p + self._autoChunkRows(rowBytes), nv)
+            else:
+                q = min(p + chunk, nv)
+            t0 = time.time()
+            self._addDataSplit(headers, columns, p, q, rowBytes)
+            self._recordChunkRate((q - p) * rowBytes, time.time() - t0)
+            p = q
 
         return p
 
 
+    def _addDataSplit(self, headers, columns, start, stop, rowBytes):
+        """
+        Internal helper method, calls table.addData() for a range of rows.
+        If the call fails because the message size limit was exceeded the
+        range is split in two and each half is written separately.
+        @param headers A list of columns to be used for the call
+        @param columns A full list of columns holding data to be added
+        @param start The first row to be written
+        @param stop The last + 1 row to be written
+        @param rowBytes The approximate number of bytes in a row
+        """
+        for (h, c) in izip(headers, columns):
+            h.values = c.values[start:stop]
+        try:
+            self.table.addData(headers)
+        except Ice.Exception as e:
+            if not self._isMessageSizeError(e) or stop - start <= 1:
+                raise
+            self.log.warn('Message size limit exceeded writing rows %d-%d, '
+                          'splitting', start, stop)
+            self._recordRetry('addData')
+            self._shrinkChunkBytes(stop - start, rowBytes)
+            mid = (start + stop) / 2
+            self._addDataSplit(headers, columns, start, mid, rowBytes)
+            self._addDataSplit(headers, columns, mid, stop, rowBytes)
+
+
+    def openTableAsync(self, tableId):
+        """
+        Asynchronous version of openTable(), this requires several remote
+        calls so is run on a shared thread pool. Wait for the result before
+        making any other calls on this connection.
+        @param tableId The OriginalFile ID of the table file, required.
+        @return a TableFuture whose result is the table handle
+        """
+        return ExecutorFuture(self.openTable, tableId)
+
+
+    def readAsync(self, colNumbers, start, stop):
+        """
+        Asynchronous version of table.read()
+        @param colNumbers A list of columns indices to be read
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @return a TableFuture whose result is a data object
+        """
+        table = self.table
+        r = table.begin_read(colNumbers, start, stop)
+        return IceFuture([r], lambda: table.end_read(r))
+
+
+    def chunkedReadAsync(self, colNumbers, start, stop, chunk=AUTO_CHUNK,
+                         asarray=False):
+        """
+        Asynchronous version of chunkedRead(). The reads for all chunks are
+        sent immediately so limit the number of rows if the server should
+        not receive too many requests at once.
+        @param colNumbers A list of columns indices to be read
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @param chunk The maximum number of rows to read in each call, or
+        AUTO_CHUNK to calculate this from the row width
+        @param asarray If True rowNumbers and numeric column values are
+        returned as numpy arrays, see chunkedRead()
+        @return a TableFuture whose result is a data object
+        """
+        rowBytes = self._rowBytes(colNumbers)
+        pending = [(p, q, self.table.begin_read(colNumbers, p, q), time.time())
+                   for (p, q) in self._chunkRanges(start, stop, chunk,
+                                                   rowBytes)]
+
+        def finish():
+            reads = (self._endRead(colNumbers, rowBytes, *x) for x in pending)
+            if asarray:
+                return self._readIntoArrays(reads, max(stop - start, 0))
+            data = next(reads)
+            for data2 in reads:
+                self._appendData(data, data2)
+            return data
+
+        return IceFuture([x[2] for x in pending], finish)
+
+
+    def addDataAsync(self, columns):
+        """
+        Asynchronous version of table.addData(). The server may not process
+        concurrent calls in order, so wait for the result before adding more
+        rows.
+        @param columns A full list of columns holding data to be added
+        @return a TableFuture whose result is None
+        """
+        table = self.table
+        r = table.begin_addData(columns)
+        return IceFuture([r], lambda: table.end_addData(r))
+
+
+    def chunkedAddDataAsync(self, columns, chunk=AUTO_CHUNK):
+        """
+        Asynchronous version of chunkedAddData(), the chunks must be written
+        in order so this is run on a shared thread pool
+        @param columns A full list of columns holding data to be added
+        @param chunk The maximum number of rows to write in each call, or
+        AUTO_CHUNK to calculate this from the row width
+        @return a TableFuture whose result is the number of rows written
+        """
+        return ExecutorFuture(self.chunkedAddData, columns, chunk)
+
+
+    def getWhereListAsync(self, condition, variables, start=0, stop=0,
+                          step=0):
+        """
+        Asynchronous version of table.getWhereList()
+        @param condition The query condition
+        @param variables A dictionary of variables used in the condition
+        @param start The first row to be searched
+        @param stop The last + 1 row to be searched, 0 for all rows
+        @param step The step between rows, 0 for every row
+        @return a TableFuture whose result is a list of row indices
+        """
+        table = self.table
+        r = table.begin_getWhereList(condition, variables, start, stop, step)
+        return IceFuture([r], lambda: table.end_getWhereList(r))
+
+
 
 class FeatureTableConnection(TableConnection):
     """
@@ -362,43 +1158,181 @@ class FeatureTableConnection(TableConnection):
     Also allow within-array selections.
 
     Internally this uses an addition set of BoolColumns to indicate whether
-    a column contains valid data (True) or is null (False)
-
-    @todo Cache some of the metadata (e.g. column names) instead of
-    requesting every time
+    a column contains valid data (True) or is null (False), or a single
+    packed bitmask column, see LAYOUT_BOOLCOLUMNS and LAYOUT_PACKED. The
+    layout of an existing table is automatically detected.
     """
 
     def __init__(self, user = None, passwd = None, host = None, client = None,
-                 tableName = None):
+                 tableName = None, stats = None):
         """
         Just calls the base-class constructor
         """
         super(FeatureTableConnection, self).__init__(user, passwd, host, client,
-                                                     tableName)
+                                                     tableName, stats)
 
-    def createNewTable(self, idcolName, colDescriptions):
+        # Lazily created mapping of ids to row indices, see getRowIds()
+        self._rowIndex = None
+        self._rowIndexRows = 0
+        self._rowIndexDuplicates = None
+
+    def closeTable(self):
+        """
+        Close the table if open, and set table and tableId to None
+        """
+        try:
+            super(FeatureTableConnection, self).closeTable()
+        finally:
+            self._rowIndex = None
+            self._rowIndexRows = 0
+            self._rowIndexDuplicates = None
+
+    def createNewTable(self, idcolName, colDescriptions,
+                       layout=LAYOUT_BOOLCOLUMNS):
         """
         Create a new table with an id LongColumn followed by
         a set of nullable DoubleArrayColumns
         @param idcolName The name of the id LongColumn
         @param colDescriptions A list of 2-tuples describing each column in
         the form [(name, size), ...]
+        @param layout The table layout used for recording null columns,
+        LAYOUT_BOOLCOLUMNS or LAYOUT_PACKED
         """
 
         # Create an identical number of bool columns indicating whether
         # columns are valid or not. To make things easier this includes
         # a bool column for the id column even though it should always
         # be valid.
+        # The packed layout uses one bit per column in the same order.
 
         cols = [LongColumn(idcolName)] + \
             [DoubleArrayColumn(name, '', size) \
-                 for (name, size) in colDescriptions] + \
-                 [BoolColumn('_b_' + idcolName)] + \
-                 [BoolColumn('_b_' + name) \
-                      for (name, size) in colDescriptions]
+                 for (name, size) in colDescriptions]
+        if layout == LAYOUT_PACKED:
+            nwords = (len(cols) + PACKED_BITS - 1) / PACKED_BITS
+            cols.append(LongArrayColumn(PACKED_VALID_COLUMN, '', nwords))
+        elif layout == LAYOUT_BOOLCOLUMNS:
+            cols += [BoolColumn('_b_' + idcolName)] + \
+                [BoolColumn('_b_' + name) \
+                     for (name, size) in colDescriptions]
+        else:
+            raise TableConnectionError('Invalid table layout: %s' % layout)
         self.newTable(cols)
 
 
+    def getLayout(self):
+        """
+        Get the layout of the open table
+        @return LAYOUT_BOOLCOLUMNS or LAYOUT_PACKED
+        """
+        headers = self._getHeaders()
+        if isinstance(headers[-1], LongArrayColumn) and \
+                headers[-1].name == PACKED_VALID_COLUMN:
+            return LAYOUT_PACKED
+        return LAYOUT_BOOLCOLUMNS
+
+
+    def copyTable(self, layout=None, chunk=AUTO_CHUNK):
+        """
+        Copy the open table into a new table with the same name, for example
+        to convert it to a different layout. Rows are streamed one chunk at a
+        time so the whole table is never held in memory.
+        @param layout The layout of the new table, default unchanged
+        @param chunk The maximum number of rows to copy in each call
+        @return the id of the new table
+        """
+        if layout is None:
+            layout = self.getLayout()
+        headers = self._getHeaders()
+        nCols = self._nDataCols()
+        desc = [(h.name, h.size) for h in headers[1:nCols]]
+
+        dest = FeatureTableConnection(client=self.pool or self.conn.c,
+                                      tableName=self.tableName,
+                                      stats=self.stats)
+        try:
+            dest.createNewTable(headers[0].name, desc, layout)
+            nrows = self.getNumberOfRows()
+            for cols in self.iterReadArray(range(nCols), 0, nrows, chunk):
+                dest.addData(cols, copy=False)
+            newId = dest.tableId
+            self.log.debug('Copied table id:%d to id:%d (%d rows)',
+                           self.tableId, newId, nrows)
+        finally:
+            dest.close(False)
+        return newId
+
+
+    def compactTable(self, sort=False, layout=None, chunk=AUTO_CHUNK,
+                     sortBytes=COMPACT_SORT_BYTES):
+        """
+        Copy the open table into a new table with the same name keeping only
+        the last row for each id, for example after features have been
+        recalculated. Only the id column of the whole table is held in
+        memory. Without sorting rows are streamed one chunk at a time.
+
+        When sorting, the rows are copied in passes of up to sortBytes. Each
+        pass reads the range of the table holding its rows sequentially,
+        including rows which are skipped, and writes the rows in id order.
+        A table smaller than sortBytes is therefore read once from start to
+        end, a larger unsorted table may be read once per pass.
+        @param sort If True the rows of the new table are sorted by id,
+        otherwise they are kept in their original order
+        @param layout The layout of the new table, default unchanged
+        @param chunk The maximum number of rows to copy in each call
+        @param sortBytes The approximate maximum number of bytes of rows to
+        hold in memory in each pass when sorting
+        @return the id of the new table, or None if nothing would be changed
+        """
+        oldLayout = self.getLayout()
+        if layout is None:
+            layout = oldLayout
+        headers = self._getHeaders()
+        nCols = self._nDataCols()
+        colNumbers = range(nCols)
+        desc = [(h.name, h.size) for h in headers[1:nCols]]
+
+        nrows = self.getNumberOfRows()
+        ids = self.chunkedRead([0], 0, nrows, asarray=True).columns[0].values
+        # Index of the first occurrence in the reversed ids is the last row
+        u, last = numpy.unique(ids[::-1], return_index=True)
+        rows = nrows - 1 - last
+        if not sort:
+            rows.sort()
+        if layout == oldLayout and numpy.array_equal(rows, numpy.arange(nrows)):
+            self.log.debug('Table id:%d is already compact', self.tableId)
+            return None
+
+        rowBytes = self._rowBytes(
+            colNumbers + self._validityColNumbers(colNumbers, nCols))
+        if chunk == AUTO_CHUNK:
+            chunk = self._autoChunkRows(rowBytes)
+        if sort:
+            # Rows in id order are scattered through an unsorted table, so
+            # read all rows in the range of each pass instead of row by row
+            passRows = max(chunk, sortBytes // rowBytes)
+            gap = nrows
+        else:
+            passRows = chunk
+            gap = READ_ROWS_GAP
+
+        dest = FeatureTableConnection(client=self.pool or self.conn.c,
+                                      tableName=self.tableName,
+                                      stats=self.stats)
+        try:
+            dest.createNewTable(headers[0].name, desc, layout)
+            for p in xrange(0, len(rows), passRows):
+                cols = self.readRows(
+                    colNumbers, rows[p:p + passRows].tolist(), gap)
+                dest.chunkedAddData(cols, chunk)
+            newId = dest.tableId
+            self.log.debug('Compacted table id:%d to id:%d (%d/%d rows)',
+                           self.tableId, newId, len(rows), nrows)
+        finally:
+            dest.close(False)
+        return newId
+
+
     def isValid(self, colNumbers, start, stop):
         """
         Check whether the requested arrays are valid
@@ -409,69 +1343,326 @@ class FeatureTableConnection(TableConnection):
         row-column element is valid (True) or null (False).
         """
         nCols = self._checkColNumbers(colNumbers)
-        bcolNumbers = map(lambda x: x + nCols, colNumbers)
-        data = self.table.read(bcolNumbers, start, stop)
-        return data.columns
+        vcolNumbers = self._validityColNumbers(colNumbers, nCols)
+        data = self.table.read(vcolNumbers, start, stop)
+        if self.getLayout() == LAYOUT_BOOLCOLUMNS:
+            return data.columns
+
+        headers = self._getHeaders()
+        return [BoolColumn('_b_' + headers[n].name, '', v) for (n, v) in
+                izip(colNumbers, self._getValidity(colNumbers, data.columns))]
 
 
-    def readSubArray(self, colArrayNumbers, start, stop):
+    def readSubArray(self, colArrayNumbers, start, stop, asarray=False,
+                     chunk=None):
         """
         Read the requested array columns and indices from the table
         @param colArrayNumbers A dictionary mapping column numbers to
         an array of subindices e.g. {1:[1,3], 3:[0]}
         @param start The first row to be read
         @param stop The last + 1 row to be read
+        @param asarray If True return the values of each column as a numpy
+        array, see readArray()
+        @param chunk The number of rows to be read in each request, default
+        all, or AUTO_CHUNK. Only the selected elements of each chunk are
+        kept so large row ranges can be read in limited memory.
         @return A list of columns with the requested array elements, which
         may be empty (null). If the id column is requested this will not be
         an array. Columns are returned in the order given by
         colArrayNumbers.keys()
         """
+        if chunk is None:
+            chunk = max(stop - start, 1)
+
+        columns = None
+        for cols in self._iterSubArrays(colArrayNumbers, start, stop, chunk):
+            if columns is None:
+                columns = [c for (c, v) in cols]
+                parts = [[(c.values, v)] for (c, v) in cols]
+            else:
+                for (p, cv) in izip(parts, cols):
+                    p.append((cv[0].values, cv[1]))
+
+        for (c, p) in izip(columns, parts):
+            values, valid = self._concatSubArrays(p)
+            self._subArrayValues(c, values, valid, asarray)
+        return columns
+
+
+    def iterReadSubArray(self, colArrayNumbers, start, stop, chunk,
+                         pipeline=READ_PIPELINE, asarray=False):
+        """
+        A generator version of readSubArray() which returns the requested
+        columns and indices one chunk at a time
+        @param colArrayNumbers A dictionary mapping column numbers to
+        an array of subindices e.g. {1:[1,3], 3:[0]}
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @param chunk The number of rows to be read in each request
+        @param pipeline The maximum number of chunk requests to have in flight
+        @param asarray If True return the values of each column as a numpy
+        array, see readArray()
+        @return an iterator of lists of columns, null entries are handled in
+        the same way as readSubArray()
+        """
+        for cols in self._iterSubArrays(colArrayNumbers, start, stop, chunk,
+                                        pipeline):
+            for (c, v) in cols:
+                self._subArrayValues(c, c.values, v, asarray)
+            yield [c for (c, v) in cols]
 
+
+    def _iterSubArrays(self, colArrayNumbers, start, stop, chunk,
+                       pipeline=READ_PIPELINE):
+        """
+        Internal helper method, reads the requested columns in chunks and
+        selects the requested subindices of every row in a chunk in a single
+        numpy indexing operation
+        @param colArrayNumbers A dictionary mapping column numbers to
+        an array of subindices
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @param chunk The number of rows to be read in each request
+        @param pipeline The maximum number of chunk requests to have in flight
+        @return an iterator of lists of (column, valid) pairs, where the
+        column values are numpy arrays of the selected elements including
+        null rows, and valid is a numpy bool array
+        """
         colNumbers = colArrayNumbers.keys()
         subIndices = colArrayNumbers.values()
         nCols = self._checkColNumbers(colNumbers)
         nWanted = len(colNumbers)
 
-        bcolNumbers = map(lambda x: x + nCols, colNumbers)
-        data = self.table.read(colNumbers + bcolNumbers, start, stop)
-        columns = data.columns
+        vcolNumbers = self._validityColNumbers(colNumbers, nCols)
+        for data in self.iterRead(colNumbers + vcolNumbers, start, stop,
+                                  chunk, pipeline):
+            data = self._readIntoArrays(iter([data]), len(data.rowNumbers))
+            columns = data.columns
+            valid = self._getValidity(colNumbers, columns[nWanted:])
 
-        for (c, b, s) in izip(columns[:nWanted], columns[nWanted:], subIndices):
-            #indexer = opertor.itemgetter(*s)
-            if isinstance(c, (LongArrayColumn, DoubleArrayColumn)):
-                c.values = [[x[i] for i in s] if y else []
-                            for (x, y) in izip(c.values, b.values)]
-            else:
-                self._nullEmptyColumns(c, b)
+            for (c, s) in izip(columns[:nWanted], subIndices):
+                if isinstance(c, (LongArrayColumn, DoubleArrayColumn)):
+                    c.values = c.values.take(s, axis=1)
+            yield zip(columns[:nWanted], valid)
+
+
+    def _concatSubArrays(self, parts):
+        """
+        Internal helper method, joins the chunks of a sub-array column
+        @param parts A list of (values, valid) numpy array pairs
+        @return a single (values, valid) pair
+        """
+        if len(parts) == 1:
+            return parts[0]
+        return (numpy.concatenate([p[0] for p in parts]),
+                numpy.concatenate([p[1] for p in parts]))
 
-        return columns[:nWanted]
 
+    def _subArrayValues(self, col, values, valid, asarray):
+        """
+        Internal helper method, sets the values of a sub-array column,
+        marking null rows in bulk
+        @param col The column
+        @param values A numpy array of the selected elements
+        @param valid A numpy bool array of validity flags
+        @param asarray If True keep the values as a numpy array, otherwise
+        convert them to lists
+        """
+        col.values = values
+        if asarray:
+            self._nanEmptyColumns(col, valid)
+        else:
+            col.values = values.tolist()
+            self._nullEmptyColumns(col, valid.tolist())
 
-    def readArray(self, colNumbers, start, stop, chunk=None):
+
+    def readArray(self, colNumbers, start, stop, chunk=None, asarray=False):
         """
         Read the requested array columns which may include null entries
         @param colNumbers Column numbers
         @param start The first row to be read
         @param stop The last + 1 row to be read
         @param chunk The number of rows to be read in each request, default all
+        @param asarray If True return the values of each column as a numpy
+        array instead of a list. DoubleArrayColumns are returned as 2-D
+        float64 arrays with null rows filled with NaN, the id column is
+        returned as a 1-D array (it is never null).
         @return a list of columns
         """
 
         nCols = self._checkColNumbers(colNumbers)
-        nWanted = len(colNumbers)
 
-        bcolNumbers = map(lambda x: x + nCols, colNumbers)
-        if chunk:
-            data = self.chunkedRead(colNumbers + bcolNumbers, start, stop,
+        vcolNumbers = self._validityColNumbers(colNumbers, nCols)
+        if asarray:
+            data = self.chunkedRead(colNumbers + vcolNumbers, start, stop,
+                                    chunk or max(stop - start, 1),
+                                    asarray=True)
+        elif chunk:
+            data = self.chunkedRead(colNumbers + vcolNumbers, start, stop,
                                     chunk)
         else:
-            data = self.table.read(colNumbers + bcolNumbers, start, stop)
-        columns = data.columns
+            data = self.table.read(colNumbers + vcolNumbers, start, stop)
 
-        for (c, b) in izip(columns[:nWanted], columns[nWanted:]):
-            self._nullEmptyColumns(c, b)
+        return self._applyValidity(colNumbers, data.columns, asarray)
 
-        return columns[:nWanted]
+
+    def iterReadArray(self, colNumbers, start, stop, chunk,
+                      pipeline=READ_PIPELINE, asarray=False):
+        """
+        A generator version of readArray() which returns the requested
+        columns one chunk at a time
+        @param colNumbers Column numbers
+        @param start The first row to be read
+        @param stop The last + 1 row to be read
+        @param chunk The number of rows to be read in each request
+        @param pipeline The maximum number of chunk requests to have in flight
+        @param asarray If True return the values of each column as a numpy
+        array, see readArray()
+        @return an iterator of lists of columns, null entries are handled in
+        the same way as readArray()
+        """
+        nCols = self._checkColNumbers(colNumbers)
+
+        vcolNumbers = self._validityColNumbers(colNumbers, nCols)
+        for data in self.iterRead(colNumbers + vcolNumbers, start, stop,
+                                  chunk, pipeline):
+            if asarray:
+                data = self._readIntoArrays(iter([data]),
+                                            len(data.rowNumbers))
+            yield self._applyValidity(colNumbers, data.columns, asarray)
+
+
+    def readRows(self, colNumbers, rowIndices, gap=READ_ROWS_GAP,
+                 pipeline=READ_PIPELINE, asarray=False):
+        """
+        Read the requested array columns for an arbitrary set of rows. The
+        rows are sorted and merged into contiguous ranges so that as few
+        calls as possible are made.
+        @param colNumbers Column numbers
+        @param rowIndices A list of row indices, in any order
+        @param gap The maximum number of unwanted rows between two requested
+        rows which will be read in order to avoid splitting a range
+        @param pipeline The maximum number of requests to have in flight
+        @param asarray If True return the values of each column as a numpy
+        array, see readArray(). Each chunk is copied into the arrays as soon
+        as it is received.
+        @return a list of columns whose values correspond to rowIndices, null
+        entries are handled in the same way as readArray()
+        """
+        columns = None
+        for (positions, cols) in self.iterReadRows(
+                colNumbers, rowIndices, gap, pipeline, asarray):
+            if columns is None:
+                columns = cols
+                values = [None] * len(columns)
+                for (n, c) in enumerate(columns):
+                    if isinstance(c.values, numpy.ndarray):
+                        values[n] = self._emptyArray(c, len(rowIndices))
+                    else:
+                        values[n] = [None] * len(rowIndices)
+
+            for (v, c) in izip(values, cols):
+                if isinstance(v, numpy.ndarray):
+                    v[positions] = c.values
+                else:
+                    for (n, x) in izip(positions, c.values):
+                        v[n] = x
+
+        if columns is None:
+            headers = self._getHeaders()
+            columns = [deepcopy(headers[n]) for n in colNumbers]
+            if asarray:
+                for c in columns:
+                    a = self._emptyArray(c, 0)
+                    if a is not None:
+                        c.values = a
+            return columns
+
+        for (c, v) in izip(columns, values):
+            c.values = v
+        return columns
+
+
+    def iterReadRows(self, colNumbers, rowIndices, gap=READ_ROWS_GAP,
+                     pipeline=READ_PIPELINE, asarray=False):
+        """
+        A generator version of readRows() which returns the requested rows
+        one chunk at a time, so that they can be copied into their final
+        destination without holding all rows in memory
+        @param colNumbers Column numbers
+        @param rowIndices A list of row indices, in any order
+        @param gap The maximum number of unwanted rows between two requested
+        rows which will be read in order to avoid splitting a range
+        @param pipeline The maximum number of requests to have in flight
+        @param asarray If True return the values of each column as a numpy
+        array, see readArray()
+        @return an iterator of (positions, columns) tuples where columns hold
+        some of the requested rows, and positions is a list of the index in
+        rowIndices of each of those rows. Null entries are handled in the
+        same way as readArray(). If any rows do not exist an exception is
+        raised after the last chunk.
+        """
+        nCols = self._checkColNumbers(colNumbers)
+        allColNumbers = colNumbers + self._validityColNumbers(colNumbers, nCols)
+
+        # The positions in rowIndices of each requested row
+        wanted = {}
+        for (n, r) in enumerate(rowIndices):
+            wanted.setdefault(r, []).append(n)
+        if not wanted:
+            return
+
+        rowBytes = self._rowBytes(allColNumbers)
+        ranges = chain.from_iterable(
+            self._chunkRanges(p, q, AUTO_CHUNK, rowBytes)
+            for (p, q) in self._coalesceRows(sorted(wanted), gap))
+
+        found = set()
+        for data in self._readChunks(allColNumbers, ranges, pipeline,
+                                     rowBytes):
+            src = []
+            dst = []
+            for (i, r) in enumerate(data.rowNumbers):
+                for n in wanted.get(r, ()):
+                    src.append(i)
+                    dst.append(n)
+                    found.add(r)
+            if asarray:
+                data = self._readIntoArrays(iter([data]),
+                                            len(data.rowNumbers))
+
+            for c in data.columns:
+                if isinstance(c.values, numpy.ndarray):
+                    c.values = c.values[src]
+                else:
+                    c.values = [c.values[i] for i in src]
+            yield (dst, self._applyValidity(colNumbers, data.columns,
+                                            asarray))
+
+        missing = set(wanted).difference(found)
+        if missing:
+            raise TableConnectionError(
+                'Invalid row indices: %s' % sorted(missing))
+
+
+    def _coalesceRows(self, rows, gap):
+        """
+        Internal helper method, merges a sorted list of rows into ranges
+        @param rows A sorted list of unique row indices
+        @param gap The maximum number of unwanted rows allowed in a range
+        between two wanted rows
+        @return a list of (start, stop) ranges
+        """
+        ranges = []
+        start = rows[0]
+        stop = start + 1
+        for r in rows[1:]:
+            if r - stop > gap:
+                ranges.append((start, stop))
+                start = r
+            stop = r + 1
+        ranges.append((start, stop))
+        return ranges
 
 
     def getRowId(self, id):
@@ -481,18 +1672,80 @@ class FeatureTableConnection(TableConnection):
         @return the row index of the object, if the object is present in
         multiple rows returns the highest row index, or None if not found
         """
-        columns = self.table.getHeaders()
-        nrows = self.getNumberOfRows()
-        condition = '(%s==%d)' % (columns[0].name, id)
-        idx = self.table.getWhereList(condition=condition, variables={},
-                                      start=0, stop=nrows, step=0)
-
-        if not idx:
-            return None
-        if len(idx) > 1:
+        index = self._getRowIndex()
+        if id in self._rowIndexDuplicates:
             self.log.warn("Multiple rows found, returning last")
-            # Ordering of rows not guaranteed
-        return max(idx)
+        return index.get(id)
+
+
+    def getRowIds(self, ids):
+        """
+        Find the row indices corresponding to multiple ids in the first column
+        @param ids A list of ids
+        @return a list of row indices in the same order as ids, see getRowId()
+        """
+        index = self._getRowIndex()
+        return [index.get(id) for id in ids]
+
+
+    def containsId(self, id):
+        """
+        Check whether an id is present in the first column
+        @param id the id of the object
+        @return True if the id is present
+        """
+        return id in self._getRowIndex()
+
+
+    def _getRowIndex(self):
+        """
+        Internal helper method, gets the mapping of ids to row indices,
+        reading the whole of the first column if necessary. The index is
+        updated when rows are added through this connection, and discarded
+        when the table is closed, so if another client may have added rows
+        reopen the table to refresh it.
+        @return a dictionary of ids to the last row containing that id
+        """
+        if self._rowIndex is None:
+            index = {}
+            duplicates = set()
+            nrows = self.getNumberOfRows()
+            p = 0
+            for data in self.iterRead([0], 0, nrows):
+                ids = data.columns[0].values
+                self._updateRowIndex(index, duplicates, p, ids)
+                p += len(ids)
+            self._rowIndex = index
+            self._rowIndexRows = nrows
+            self._rowIndexDuplicates = duplicates
+        return self._rowIndex
+
+
+    def _updateRowIndex(self, index, duplicates, start, ids):
+        """
+        Internal helper method, adds ids for a contiguous set of rows to an
+        id to row index, later rows take precedence
+        @param index The index to be updated
+        @param duplicates A set of ids found in multiple rows
+        @param start The row index of the first id
+        @param ids A list of ids
+        """
+        for (r, id) in enumerate(ids, start):
+            if id in index:
+                duplicates.add(id)
+            index[id] = r
+
+
+    def _addedRows(self, ids):
+        """
+        Internal helper method, updates the row index after rows have been
+        appended to the table
+        @param ids The ids of the added rows
+        """
+        if self._rowIndex is not None:
+            self._updateRowIndex(self._rowIndex, self._rowIndexDuplicates,
+                                 self._rowIndexRows, ids)
+            self._rowIndexRows += len(ids)
 
 
     def getHeaders(self):
@@ -500,8 +1753,8 @@ class FeatureTableConnection(TableConnection):
         Get a set of columns to be used for populating the table with data
         @return a list of empty columns
         """
-        columns = self.table.getHeaders()
-        return columns[:(len(columns) / 2)]
+        columns = self._getHeaders()
+        return deepcopy(columns[:self._nDataCols()])
 
 
     def addData(self, cols, copy=True):
@@ -509,9 +1762,40 @@ class FeatureTableConnection(TableConnection):
         Add a new row of data where DoubleArrays may be null
         @param cols A list of columns obtained from getHeaders() whose values
         have been filled with the data to be added.
+        @param copy Ignored, the columns passed in are never modified. Their
+        values are referenced by the columns sent to the table, not copied.
+        """
+        self._checkDataColumns(cols)
+        columns = self._writeColumns(cols)
+        self.table.addData(columns)
+        self._addedRows(columns[0].values)
+
+
+    def chunkedAddData(self, cols, chunk=AUTO_CHUNK):
+        """
+        Add multiple rows of data where DoubleArrays may be null, split into
+        chunks to limit the number of rows added in one go
+        @param cols A list of columns obtained from getHeaders() whose values
+        have been filled with the data to be added. The columns passed in are
+        not modified.
+        @param chunk The maximum number of rows to write in each call, or
+        AUTO_CHUNK to calculate this from the row width
+        @return the number of rows written
+        """
+        self._checkDataColumns(cols)
+        columns = self._writeColumns(cols)
+        n = super(FeatureTableConnection, self).chunkedAddData(columns, chunk)
+        self._addedRows(columns[0].values)
+        return n
+
+
+    def _checkDataColumns(self, cols):
+        """
+        Internal helper method, checks a full list of data columns has the
+        expected number and types of columns
+        @param cols The id column followed by the DoubleArrayColumns
         """
-        columns = self.table.getHeaders()
-        nCols = len(columns) / 2
+        nCols = self._nDataCols()
         if len(cols) != nCols:
             raise TableConnectionError(
                 "Expected %d columns, got %d" % (nCols, len(cols)))
@@ -521,20 +1805,96 @@ class FeatureTableConnection(TableConnection):
             raise TableConnectionError(
                 "Expected 1 LongColumn and %d DoubleArrayColumn" % (nCols - 1))
 
-        if copy:
-            columns[:nCols] = deepcopy(cols)
-        else:
-            columns[:nCols] = cols
 
-        # Handle first ID column separately, it is not a DoubleArray
-        columns[nCols].values = [True] * len(cols[0].values)
-        for (c, b) in izip(columns[1:nCols], columns[(nCols + 1):]):
-            emptyval = [0.0] * c.size
-            # bool([])==false
-            b.values = [bool(x) for x in c.values]
-            c.values = [x if x else emptyval for x in c.values]
+    def upsertRows(self, ids, columns):
+        """
+        Write rows of data where DoubleArrays may be null, overwriting the
+        rows of ids which are already in the table (using table.update) and
+        appending the rest. If an id is in multiple rows only the last is
+        overwritten, see getRowId(). If an id is repeated in ids only its last
+        values are written.
+        Existing rows are found using the same id index as getRowIds(), so
+        reopen the table first if another client may have added rows.
+        Cached copies of the table are not invalidated by overwriting rows,
+        see WndcharmStorage.incrementRewriteCount().
+        @param ids A list of ids
+        @param columns The DoubleArrayColumns obtained from getHeaders()[1:]
+        whose values have been filled with the data corresponding to ids
+        @return a tuple (updated, added) of the number of rows overwritten
+        and appended
+        """
+        headers = self.getHeaders()
+        nCols = self._nDataCols()
+        if [c.name for c in columns] != [h.name for h in headers[1:nCols]]:
+            raise TableConnectionError(
+                'Expected columns: %s' % [h.name for h in headers[1:nCols]])
+        nv = [len(c.values) for c in columns]
+        if any(n != len(ids) for n in nv):
+            raise TableConnectionError(
+                'Expected %d values in each column, received: %s' % (
+                    len(ids), nv))
+
+        last = dict((id, n) for (n, id) in enumerate(ids))
+        rows = self.getRowIds(ids)
+        updates = []
+        appends = []
+        for (n, (id, r)) in enumerate(izip(ids, rows)):
+            if last[id] == n:
+                if r is None:
+                    appends.append(n)
+                else:
+                    updates.append(n)
+
+        if updates:
+            cols = self._writeColumns(
+                self._selectRows(headers[0], ids, columns, updates))
+            step = self._autoChunkRows(self._rowBytes())
+            for p in xrange(0, len(updates), step):
+                data = omero.grid.Data()
+                data.rowNumbers = [rows[n] for n in updates[p:p + step]]
+                data.columns = [self._newColumn(c, c.values[p:p + step])
+                                for c in cols]
+                self.table.update(data)
+        if appends:
+            self.chunkedAddData(
+                self._selectRows(headers[0], ids, columns, appends))
+        return (len(updates), len(appends))
+
+
+    def _selectRows(self, idHeader, ids, columns, indices):
+        """
+        Internal helper method, creates a full set of columns holding a
+        subset of the elements of ids and columns
+        @param idHeader The id column header
+        @param ids A list of ids
+        @param columns The data columns corresponding to ids
+        @param indices The indices of the elements to be selected
+        @return a list of columns, starting with the id column
+        """
+        if len(indices) == len(ids):
+            return [self._newColumn(idHeader, ids)] + columns
+        return [self._newColumn(c, [vs[n] for n in indices])
+                for (c, vs) in chain([(idHeader, ids)],
+                                     ((c, c.values) for c in columns))]
 
-        self.table.addData(columns)
+
+    def _writeColumns(self, cols):
+        """
+        Internal helper method, converts a full list of data columns which
+        may contain empty elements into the columns to be written to the
+        table, including the validity columns. The columns passed in are not
+        modified.
+        @param cols The id column followed by the DoubleArrayColumns
+        @return a list of columns
+        """
+        # Handle first ID column separately, it is not a DoubleArray
+        columns = [self._newColumn(cols[0], cols[0].values)]
+        valid = [[True] * len(cols[0].values)]
+        for c in cols[1:]:
+            values, v = self._zeroEmptyValues(c)
+            columns.append(self._newColumn(c, values))
+            valid.append(v)
+        return columns + self._validityColumns(valid)
 
 
     def addPartialData(self, cols, copy=True):
@@ -543,82 +1903,210 @@ class FeatureTableConnection(TableConnection):
         @param cols A subset of the columns obtained from getHeaders() whose
         values have been filled with the data to be added. Missing columns
         are automatically treated as nulls.
+        @param copy Ignored, the columns passed in are never modified. Their
+        values are referenced by the columns sent to the table, not copied.
         """
-        columns = self.table.getHeaders()
-        nCols = len(columns) / 2
-
-        if copy:
-            cols = deepcopy(cols)
+        headers = self._getHeaders()
+        nCols = self._nDataCols()
         columnMap = dict([(c.name, c) for c in cols])
 
         # Check the first id column is present
-        idColName = columns[0].name
+        idColName = headers[0].name
         try:
-            columns[0] = columnMap.pop(idColName)
+            idCol = columnMap.pop(idColName)
         except KeyError:
             raise TableConnectionError(
-                "First column (%s) must be provided" % idCol.name)
+                "First column (%s) must be provided" % idColName)
 
-        nRows = len(columns[0].values)
-        columns[nCols].values = [True] * nRows
+        columns = [self._newColumn(idCol, idCol.values)]
+        nRows = len(idCol.values)
+        valid = [[True] * nRows]
 
-        for n in xrange(1, nCols):
+        for h in headers[1:nCols]:
             try:
-                columns[n] = columnMap.pop(columns[n].name)
-                self._zeroEmptyColumns(columns[n], columns[nCols + n])
+                c = columnMap.pop(h.name)
             except KeyError:
-                columns[n].values = [[0.0] * columns[n].size] * nRows
-                columns[nCols + n].values = [False] * nRows
+                columns.append(
+                    self._newColumn(h, [[0.0] * h.size] * nRows))
+                valid.append([False] * nRows)
+                continue
 
-            if not isinstance(columns[n], DoubleArrayColumn):
+            if not isinstance(c, DoubleArrayColumn):
                 raise TableConnectionError(
-                    "Expected DoubleArrayColumn (%s)" % columns[n].name)
+                    "Expected DoubleArrayColumn (%s)" % c.name)
+            values, v = self._zeroEmptyValues(c)
+            columns.append(self._newColumn(c, values))
+            valid.append(v)
 
         if columnMap.keys():
             raise TableConnectionError(
                 "Unexpected columns: %s" % columnMap.keys())
 
-        self.table.addData(columns)
+        self.table.addData(columns + self._validityColumns(valid))
+        self._addedRows(columns[0].values)
+
+
+    def _newColumn(self, col, values):
+        """
+        Internal helper method, creates a column of the same type, name and
+        size as another column without copying any values
+        @param col The column to be used as a template
+        @param values The values of the new column, these are referenced
+        not copied. Numpy arrays are converted to lists.
+        @return the new column
+        """
+        if isinstance(values, numpy.ndarray):
+            values = values.tolist()
+        if hasattr(col, 'size'):
+            return col.__class__(col.name, col.description, col.size, values)
+        return col.__class__(col.name, col.description, values)
 
 
-    def _zeroEmptyColumns(self, col, bcol):
+    def _zeroEmptyValues(self, col):
         """
-        Internal helper method, sets empty elements to zeros and the
-        corresponding boolean indicator column entry to False
+        Internal helper method, replaces empty elements with zeros. The
+        column itself is not modified.
         @param col The data column
-        @param bcol The indicator column
+        @return a tuple (values, valid) where values is the column values with
+        empty elements replaced by a single shared row of zeros, or the
+        original values if there are no empty elements, and valid is a list
+        indicating whether each element is valid (True) or empty (False)
         """
-        #for (c, b) in izip(columns[1:nCols], columns[(nCols + 1):]):
+        valid = [x is not None and len(x) > 0 for x in col.values]
+        if all(valid):
+            return col.values, valid
+
         emptyval = [0.0] * col.size
-        bcol.values = [bool(x) for x in col.values]
-        col.values = [x if x else emptyval for x in col.values]
+        values = [x if y else emptyval for (x, y) in izip(col.values, valid)]
+        return values, valid
 
 
-    def _nullEmptyColumns(self, col, bcol):
+    def _nullEmptyColumns(self, col, valid):
         """
         Internal helper method, sets column elements which are indicated by
-        the boolean indicator as empty to [] if they are array-columns, or
+        the validity flags as empty to [] if they are array-columns, or
         None for scalar column types
         @param col The data column
-        @param bcol The indicator column
+        @param valid A sequence of validity flags
         """
         if isinstance(col, (LongArrayColumn, DoubleArrayColumn)):
             col.values = [x if y else []
-                          for (x, y) in izip(col.values, bcol.values)]
+                          for (x, y) in izip(col.values, valid)]
         else:
             col.values = [x if y else None
-                          for (x, y) in izip(col.values, bcol.values)]
+                          for (x, y) in izip(col.values, valid)]
+
+
+    def _nanEmptyColumns(self, col, valid):
+        """
+        Internal helper method, the numpy equivalent of _nullEmptyColumns(),
+        sets rows of floating point columns which are indicated by the
+        validity flags as empty to NaN. Other column types cannot represent
+        nulls so are left unchanged.
+        @param col The data column, values must be a numpy array
+        @param valid A numpy array of validity flags
+        """
+        if col.values.dtype.kind == 'f':
+            col.values[~valid] = numpy.nan
+
+
+    def _nDataCols(self):
+        """
+        Internal helper method, gets the number of data columns
+        @return The number of data columns, including the ID column but
+        excluding the validity indicator columns
+        """
+        nHeaders = len(self._getHeaders())
+        if self.getLayout() == LAYOUT_PACKED:
+            return nHeaders - 1
+        return nHeaders / 2
+
+
+    def _validityColNumbers(self, colNumbers, nCols):
+        """
+        Internal helper method, gets the indices of the columns which must
+        be read to obtain the validity of a set of data columns
+        @param colNumbers A list of data column numbers
+        @param nCols The number of data columns
+        @return A list of column numbers
+        """
+        if self.getLayout() == LAYOUT_PACKED:
+            return [nCols]
+        return map(lambda x: x + nCols, colNumbers)
+
+
+    def _getValidity(self, colNumbers, vcols):
+        """
+        Internal helper method, extracts the validity flags for a set of data
+        columns
+        @param colNumbers A list of data column numbers
+        @param vcols The columns read from _validityColNumbers(colNumbers),
+        the values may be lists or numpy arrays
+        @return A list of validity flag sequences corresponding to colNumbers,
+        these are numpy arrays if vcols holds numpy arrays
+        """
+        if self.getLayout() == LAYOUT_BOOLCOLUMNS:
+            return [b.values for b in vcols]
+
+        words = vcols[0].values
+        if isinstance(words, numpy.ndarray):
+            return [(words[:, n / PACKED_BITS] >> (n % PACKED_BITS)) & 1 == 1
+                    for n in colNumbers]
+        return [[bool(w[n / PACKED_BITS] >> (n % PACKED_BITS) & 1)
+                 for w in words] for n in colNumbers]
+
+
+    def _applyValidity(self, colNumbers, columns, asarray=False):
+        """
+        Internal helper method, marks null elements in columns which have
+        been read together with their validity columns
+        @param colNumbers A list of data column numbers
+        @param columns The data columns followed by the validity columns
+        @param asarray If True the columns hold numpy arrays
+        @return The data columns
+        """
+        nWanted = len(colNumbers)
+        valid = self._getValidity(colNumbers, columns[nWanted:])
+        for (c, v) in izip(columns[:nWanted], valid):
+            if asarray:
+                self._nanEmptyColumns(c, v)
+            else:
+                self._nullEmptyColumns(c, v)
+        return columns[:nWanted]
+
+
+    def _validityColumns(self, valid):
+        """
+        Internal helper method, creates the validity columns for writing
+        @param valid A list of validity flag lists, one for every data column
+        @return A list of columns in the format required by the table layout
+        """
+        headers = self._getHeaders()
+        nCols = self._nDataCols()
+        if self.getLayout() == LAYOUT_BOOLCOLUMNS:
+            return [self._newColumn(h, v)
+                    for (h, v) in izip(headers[nCols:], valid)]
+
+        # Pack the flags for each row into the bits of PACKED_BITS-bit words
+        nwords = headers[nCols].size
+        nrows = len(valid[0])
+        bits = numpy.zeros((nrows, nwords * PACKED_BITS), dtype=numpy.int64)
+        if nrows:
+            bits[:, :nCols] = numpy.array(valid, dtype=bool).T
+        words = (bits.reshape(nrows, nwords, PACKED_BITS) <<
+                 numpy.arange(PACKED_BITS)).sum(axis=2)
+        return [self._newColumn(headers[nCols], words)]
 
 
     def _checkColNumbers(self, colNumbers):
         """
         Checks the requested column numbers refer to the id or
-        double-array-columns, and not the boolean indicator columns
+        double-array-columns, and not the validity indicator columns
         @param colNumbers A list of data column numbers
         @return The number of data columns (including the ID column if
-        requested) but excluding the boolean indicator columns
+        requested) but excluding the validity indicator columns
         """
-        nCols = len(self.table.getHeaders()) / 2
+        nCols = self._nDataCols()
         invalid = filter(lambda x: x >= nCols, colNumbers)
         if len(invalid) > 0:
             raise TableConnectionError("Invalid column index: %s" % invalid)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Futures returned by the asynchronous TableConnection methods
+#
+# Operations which map to a single remote call use Ice asynchronous method
+# invocation (AMI) so no thread is needed. Operations which need a sequence
+# of dependent calls are run on a small thread pool shared by all
+# connections.
+
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+
+# Number of threads in the shared pool used for multi-call operations
+ASYNC_THREADS = 4
+
+_executor = None
+_executorLock = threading.Lock()
+
+
+def getExecutor():
+    """
+    Get the shared thread pool, this is created on first use
+    @return a multiprocessing.pool.ThreadPool
+    """
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = ThreadPool(ASYNC_THREADS)
+        return _executor
+
+
+class TableFuture(object):
+    """
+    The pending result of an asynchronous table operation
+    """
+
+    def done(self):
+        """
+        Check whether the operation has finished without blocking
+        @return True if result() will not block
+        """
+        raise NotImplementedError()
+
+
+    def result(self):
+        """
+        Wait for the operation to finish
+        @return the result of the operation, or raise its exception
+        """
+        raise NotImplementedError()
+
+
+    def exception(self):
+        """
+        Wait for the operation to finish
+        @return the exception raised by the operation, or None
+        """
+        try:
+            self.result()
+        except Exception as e:
+            return e
+        return None
+
+
+class IceFuture(TableFuture):
+    """
+    A future for one or more Ice asynchronous calls
+    """
+
+    def __init__(self, asyncResults, finish):
+        """
+        @param asyncResults A list of Ice.AsyncResult objects
+        @param finish A function called once with no arguments by result(),
+        this should call the corresponding end_ methods and return the
+        combined result
+        """
+        self._asyncResults = asyncResults
+        self._finish = finish
+        self._lock = threading.Lock()
+        self._finished = False
+        self._value = None
+        self._excInfo = None
+
+
+    def done(self):
+        return self._finished or all(
+            r.isCompleted() for r in self._asyncResults)
+
+
+    def result(self):
+        with self._lock:
+            if not self._finished:
+                try:
+                    self._value = self._finish()
+                except Exception:
+                    self._excInfo = sys.exc_info()
+                self._finished = True
+                self._finish = None
+                self._asyncResults = None
+
+        if self._excInfo:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._value
+
+
+class ExecutorFuture(TableFuture):
+    """
+    A future for a function run on the shared thread pool
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        """
+        @param fn The function to be run
+        @param args Positional arguments for fn
+        @param kwargs Keyword arguments for fn
+        """
+        self._result = getExecutor().apply_async(fn, args, kwargs)
+
+
+    def done(self):
+        return self._result.ready()
+
+
+    def result(self):
+        return self._result.get()
+
+
+def waitAll(futures):
+    """
+    Wait for a set of futures to finish
+    @param futures An iterable of TableFuture objects
+    @return a list of results in the same order as futures, if any operation
+    failed the first exception is raised after all have finished
+    """
+    futures = list(futures)
+    results = []
+    excInfo = None
+    for f in futures:
+        try:
+            results.append(f.result())
+        except Exception:
+            results.append(None)
+            if excInfo is None:
+                excInfo = sys.exc_info()
+    if excInfo:
+        raise excInfo[0], excInfo[1], excInfo[2]
+    return results
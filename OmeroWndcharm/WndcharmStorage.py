@@ -24,12 +24,19 @@
 #
 # This has now expanded to do a lot more, and should be split up/renamed
 
-from itertools import izip, chain
+from itertools import izip
+import logging
+import numpy
 from StringIO import StringIO
+import time
 from TableConnection import FeatureTableConnection, TableConnectionError
-from TableConnection import TableConnection, Connection
+from TableConnection import TableConnection, Connection, AUTO_CHUNK
+from TableConnection import ConnectionPool
+from TableConnection import LAYOUT_BOOLCOLUMNS, LAYOUT_PACKED
+from RpcStats import RpcStats
+from FeatureCache import FeatureCache, defaultFeatureCache
 import omero
-from omero.rtypes import wrap, unwrap
+from omero.rtypes import wrap, unwrap, rlong
 
 
 ######################################################################
@@ -41,6 +48,8 @@ CLASSIFIER_LABEL_NAMESPACE = '/label'
 WNDCHARM_NAMESPACE = '/wndcharm'
 CLASSIFIER_WNDCHARM_NAMESPACE = CLASSIFIER_PARENT_NAMESPACE + WNDCHARM_NAMESPACE
 WNDCHARM_VERSION_NAMESPACE = WNDCHARM_NAMESPACE + '/version'
+# Count of in-place rewrites of a feature table, see incrementRewriteCount()
+WNDCHARM_REWRITES_NAMESPACE = WNDCHARM_NAMESPACE + '/rewrites'
 
 SMALLFEATURES_TABLE = '/SmallFeatureSet.h5'
 
@@ -53,8 +62,14 @@ CLASS_LABELS_TABLE = '/ClassLabels.h5'
 # Feature handling
 ######################################################################
 
-# Maximum number of rows to read/write in one go
-CHUNK_SIZE = 100
+# Maximum number of rows to read/write in one go, AUTO_CHUNK calculates
+# this for each table from the row width (see TableConnection.CHUNK_BYTES)
+CHUNK_SIZE = AUTO_CHUNK
+
+# Default limits of the FeatureTable write-behind buffer, buffered rows are
+# written to the table when any limit is reached
+WRITE_BUFFER_BYTES = 64 * 1024 * 1024
+WRITE_BUFFER_SECONDS = 60
 
 class WndcharmStorageError(Exception):
     """
@@ -98,39 +113,204 @@ def featureSizes(names):
     Convert a list of single value feature names to a dictionary of
     feature group names and sizes
     """
-    featSizes = {}
-    for name in names:
-        ft, idx = parseFeatureName(name)
-        if ft in featSizes:
-            featSizes[ft] = max(featSizes[ft], idx)
-        else:
-            featSizes[ft] = idx
+    layout = getFeatureLayout(names)
+    return dict(izip(layout.groups, layout.sizes))
+
+
+class FeatureLayout(object):
+    """
+    The parsed form of a list of single value feature names, mapping each
+    position in the list to a feature group and an offset within the group.
+    Use getFeatureLayout() to avoid parsing the same names repeatedly.
+    """
+
+    def __init__(self, names):
+        """
+        @param names A list of single value feature names which can be parsed
+        using parseFeatureName
+        """
+        self.names = tuple(names)
+        # Feature group names in order of first appearance
+        self.groups = []
+        groupMap = {}
+        groupIndices = []
+        offsets = []
+        for name in self.names:
+            ft, idx = parseFeatureName(name)
+            try:
+                g = groupMap[ft]
+            except KeyError:
+                g = groupMap[ft] = len(self.groups)
+                self.groups.append(ft)
+            groupIndices.append(g)
+            offsets.append(idx)
+
+        # The group and offset of each position in names
+        self.groupIndices = numpy.array(groupIndices, dtype=numpy.intp)
+        self.offsets = numpy.array(offsets, dtype=numpy.intp)
+        # Indexing starts at 0, so add one to sizes
+        sizes = numpy.zeros(len(self.groups), dtype=numpy.intp)
+        numpy.maximum.at(sizes, self.groupIndices, self.offsets + 1)
+        self.sizes = sizes.tolist()
+
+
+    def columnPositions(self, cols):
+        """
+        Map the features onto a set of DoubleArray columns whose values are
+        concatenated into a single row
+        @param cols A list of DoubleArrayColumns
+        @return a tuple (colIndices, positions) where colIndices is an array
+        of the indices of the columns which hold at least one feature, and
+        positions is an array of the index of each feature in the
+        concatenated row
+        """
+        colMap = dict((c.name, n) for (n, c) in enumerate(cols))
+        starts = numpy.cumsum([0] + [c.size for c in cols])
+        groupCols = []
+        for (ft, sz) in izip(self.groups, self.sizes):
+            n = colMap.get(ft)
+            if n is None or sz > cols[n].size:
+                raise WndcharmStorageError(
+                    'Feature not found in table: %s' % createFeatureName(
+                        ft, sz - 1))
+            groupCols.append(n)
+
+        groupCols = numpy.array(groupCols, dtype=numpy.intp)
+        positions = starts[groupCols][self.groupIndices] + self.offsets
+        return numpy.unique(groupCols), positions
+
+
+# Maximum number of distinct feature name lists held by getFeatureLayout()
+FEATURE_LAYOUT_CACHE_SIZE = 16
+
+_featureLayouts = {}
+
+
+def getFeatureLayout(names):
+    """
+    Get the FeatureLayout of a list of single value feature names, layouts
+    are cached so each distinct list is only parsed once
+    @param names A list of single value feature names
+    @return a FeatureLayout
+    """
+    key = tuple(names)
+    try:
+        return _featureLayouts[key]
+    except KeyError:
+        pass
+    layout = FeatureLayout(key)
+    if len(_featureLayouts) >= FEATURE_LAYOUT_CACHE_SIZE:
+        _featureLayouts.clear()
+    _featureLayouts[key] = layout
+    return layout
+
+
+# Feature name tuples returned by columnFeatureNames() keyed by the names and
+# sizes of the columns
+_columnFeatureNames = {}
+
+
+def columnFeatureNames(cols):
+    """
+    Get the single value feature names of a list of DoubleArray columns, in
+    the order of the concatenated column values. Lists of columns with the
+    same names and sizes share the same tuple, so callers can hold onto it
+    without making a copy.
+    @param cols A list of DoubleArrayColumns
+    @return a tuple of feature names
+    """
+    key = tuple((c.name, c.size) for c in cols)
+    try:
+        return _columnFeatureNames[key]
+    except KeyError:
+        pass
+    names = tuple(createFeatureName(c.name, x)
+                  for c in cols for x in xrange(c.size))
+    if len(_columnFeatureNames) >= FEATURE_LAYOUT_CACHE_SIZE:
+        _columnFeatureNames.clear()
+    _columnFeatureNames[key] = names
+    return names
+
+
+class BufferedFeatures(object):
+    """
+    A copy of the features saved by FeatureTable.saveFeatures() held in the
+    write-behind buffer
+    """
 
-    # Indexing starts at 0, so add one to sizes
-    for ft in featSizes:
-        featSizes[ft] += 1
-    return featSizes
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
 
 
 class FeatureTable(object):
-    def __init__(self, client, tableName):
-        self.tc = FeatureTableConnection(client=client, tableName=tableName)
+    def __init__(self, client, tableName, stats=None, cache=None,
+                 bufferRows=0, bufferBytes=WRITE_BUFFER_BYTES,
+                 bufferSeconds=WRITE_BUFFER_SECONDS):
+        """
+        @param cache If provided a FeatureCache which will be used by
+        bulkLoadFeatures()
+        @param bufferRows If greater than 0 saveFeatures() holds rows in a
+        write-behind buffer until this many rows have been saved, see flush()
+        @param bufferBytes Flush the buffer when it holds approximately this
+        many bytes of feature values
+        @param bufferSeconds Flush the buffer when a row is saved more than
+        this many seconds after the oldest buffered row. There is no
+        background thread, so rows are never written between calls.
+        """
+        self.log = logging.getLogger(__name__)
+        self.tc = FeatureTableConnection(
+            client=client, tableName=tableName, stats=stats)
         self.versiontag = None
+        self.cache = cache
+        # Version tags of tables opened by openTable()
+        self._versionTags = {}
+        # Positions of each FeatureLayout in the open table
+        self._layoutPositions = {}
+
+        self.bufferRows = bufferRows
+        self.bufferBytes = bufferBytes
+        self.bufferSeconds = bufferSeconds
+        # (id, features) tuples saved but not yet written to the open table
+        self._buffer = []
+        self._bufferIds = set()
+        self._bufferReplace = False
+        self._bufferSize = 0
+        self._bufferStart = None
+        # True if the last attempt to write the buffer raised an exception
+        self._flushFailed = False
 
     def close(self):
-        self.tc.close(False)
+        """
+        Write any buffered rows and close the connection. If a previous
+        flush() failed its exception has already been raised, and is
+        presumably propagating, so if the rows still can't be written the
+        error is logged instead of raised to avoid masking the original one.
+        """
+        try:
+            self.flush()
+        except Exception:
+            if not self._flushFailed:
+                raise
+            self.log.error(
+                'Failed to write %d buffered rows to table %s, ids: %s',
+                len(self._buffer), self.tc.tableId,
+                sorted(self._bufferIds), exc_info=True)
+        finally:
+            self.tc.close(False)
 
     @property
     def conn(self):
         return self.tc.conn
 
 
-    def createTable(self, featureNames, version):
+    def createTable(self, featureNames, version, layout=LAYOUT_BOOLCOLUMNS):
         """
         Initialise an OMERO.table for storing features
         @param featureNames Either a mapping of feature names to feature sizes,
         or a list of single value feature names which can be parsed using
         parseFeatureName
+        @param layout The table layout, see FeatureTableConnection
         """
         # Unparsed list or dict?
         if hasattr(featureNames, 'keys'):
@@ -140,7 +320,8 @@ class FeatureTable(object):
 
         colNames = sorted(features.keys())
         desc = [(name, features[name]) for name in colNames]
-        self.tc.createNewTable('id', desc)
+        self.flush()
+        self.tc.createNewTable('id', desc, layout)
 
         self.versiontag = getVersionAnnotation(self.conn, version)
         if not self.versiontag:
@@ -155,11 +336,23 @@ class FeatureTable(object):
         self.openTable(tid, version)
 
     def openTable(self, tableId, version=None):
+        """
+        Open a feature table, the version tag of each table is only loaded
+        once, and no remote calls are made if the table is already open
+        @param tableId The OriginalFile id of the table
+        @param version If provided the version which the table must match
+        @return True if the table was opened, False if not found
+        """
+        if self.tc.table and self.tc.tableId != long(tableId):
+            self.flush()
         try:
-            vertag = getVersion(self.conn, 'OriginalFile', tableId)
+            vertag = self._versionTags.get(long(tableId))
             if not vertag:
-                raise WndcharmStorageError(
-                    'Table id %d has no version tag' % tableId)
+                vertag = getVersion(self.conn, 'OriginalFile', tableId)
+                if not vertag:
+                    raise WndcharmStorageError(
+                        'Table id %d has no version tag' % tableId)
+                self._versionTags[long(tableId)] = vertag
             if version is not None:
                 assertVersionMatch(version, vertag, 'table:%d' % tableId)
             self.tc.openTable(tableId)
@@ -170,6 +363,55 @@ class FeatureTable(object):
             return False
 
 
+    def migrateTable(self, layout=LAYOUT_PACKED):
+        """
+        Copy the open table into a new table with a different layout. The
+        version tag and any file annotations are moved to the new table which
+        is then opened, the original table is left in place without them.
+        @param layout The layout of the new table
+        @return the id of the new table
+        """
+        self.flush()
+        oldId = self.tc.tableId
+        newId = self.tc.copyTable(layout)
+        self._replaceTable(oldId, newId)
+        return newId
+
+
+    def compactTable(self, sort=False):
+        """
+        Copy the open table into a new table containing only the last row
+        for each id, see FeatureTableConnection.compactTable(). The version
+        tag and any file annotations are moved to the new table which is then
+        opened, the original table is left in place without them.
+        @param sort If True sort the rows of the new table by id
+        @return the id of the new table, or None if the table has no
+        duplicate ids (and is already sorted if sort is True)
+        """
+        self.flush()
+        oldId = self.tc.tableId
+        newId = self.tc.compactTable(sort)
+        if newId is not None:
+            self._replaceTable(oldId, newId)
+        return newId
+
+
+    def _replaceTable(self, oldId, newId):
+        """
+        Internal helper method, moves the version tag and file annotations
+        from the open table to a copy, and opens the copy
+        """
+        # versiontag is a gateway wrapper, addTagTo() needs the model object
+        tag = getattr(self.versiontag, '_obj', self.versiontag)
+        addTagTo(self.conn, tag, 'OriginalFile', newId)
+        unlinkTagFrom(self.conn, tag, 'OriginalFile', oldId)
+        self._versionTags.pop(long(oldId), None)
+        moveFileAnnotations(self.conn, oldId, newId)
+
+        self.tc.closeTable()
+        self.tc.openTable(newId)
+
+
     def isTableCompatible(self, features):
         """
         Check whether an existing table is compatible with this set of features,
@@ -178,9 +420,9 @@ class FeatureTable(object):
         """
         cols = self.tc.getHeaders()
         colMap = dict([(c.name, c) for c in cols])
-        featSizes = featureSizes(features.names)
+        layout = getFeatureLayout(features.names)
 
-        for (ft, sz) in featSizes.iteritems():
+        for (ft, sz) in izip(layout.groups, layout.sizes):
             if (ft not in colMap or colMap[ft].size != sz):
                 print '%s [%d] is incompatible' %  (ft, sz)
                 return False
@@ -189,75 +431,335 @@ class FeatureTable(object):
 
     def tableContainsId(self, id):
         """
-        Check whether this ID is already present in the table
+        Check whether this ID is already present in the table, including
+        rows held in the write-behind buffer
         """
-        return self.tc.getRowId(id) is not None
+        return id in self._bufferIds or self.tc.containsId(id)
 
 
-    def saveFeatures(self, id, features):
+    def saveFeatures(self, id, features, replace=False):
         """
         Save the features to a table
         @param features an object with field names holding a list of single
         value feature names, and values holding a list of doubles corresponding
         to names
+        @param replace If True overwrite the existing row for this id if
+        there is one instead of appending a new row
+        """
+        if self.bufferRows <= 0:
+            self.saveFeaturesBatch([(id, features)], replace)
+            return
+
+        if self._buffer and replace != self._bufferReplace:
+            self.flush()
+        if not self._buffer:
+            self._bufferReplace = replace
+            self._bufferStart = time.time()
+        # Copy the values in case the caller reuses the features object
+        self._buffer.append((id, BufferedFeatures(
+                    features.names, list(features.values))))
+        self._bufferIds.add(id)
+        self._bufferSize += 8 * (len(features.values) + 1)
+
+        if len(self._buffer) >= self.bufferRows or \
+                self._bufferSize >= self.bufferBytes or \
+                time.time() - self._bufferStart >= self.bufferSeconds:
+            self.flush()
+
+
+    def flush(self):
         """
+        Write any rows held in the write-behind buffer to the open table.
+        This is called automatically before the rows of the table are read
+        or a different table is opened, and by close().
+        If the write fails the rows are kept in the buffer, so they are still
+        reported by tableContainsId() and the next flush() will retry them.
+        @return the number of rows written
+        """
+        if not self._buffer:
+            return 0
+        try:
+            n = self.saveFeaturesBatch(self._buffer, self._bufferReplace)
+        except Exception:
+            self._flushFailed = True
+            raise
+        self._flushFailed = False
+        self._buffer = []
+        self._bufferIds = set()
+        self._bufferSize = 0
+        self._bufferStart = None
+        return n
+
+
+    def saveFeaturesBatch(self, items, replace=False):
+        """
+        Save the features of multiple objects to a table, using as few remote
+        calls as possible
+        @param items A list of (id, features) tuples, see saveFeatures()
+        @param replace If True overwrite the existing rows for ids which are
+        already in the table instead of appending new rows
+        @return the number of rows written
+        """
+        if not items:
+            return 0
         cols = self.tc.getHeaders()
-        colMap = dict([(c.name, c) for c in cols])
-        cols[0].values = [id]
 
-        for (name, value) in izip(features.names, features.values):
-            ft, idx = parseFeatureName(name)
-            col = colMap[ft]
-            if not col.values:
-                col.values = [[float('nan')] * col.size]
-            col.values[0][idx] = value
+        # The features of each row are scattered into a single row of
+        # concatenated column values, once for all rows with the same names
+        starts = numpy.cumsum([0] + [c.size for c in cols[1:]])
+        values = numpy.empty((len(items), starts[-1]))
+        values.fill(float('nan'))
+        present = numpy.zeros((len(items), len(cols) - 1), dtype=bool)
+
+        layoutRows = {}
+        for (n, (id, features)) in enumerate(items):
+            layoutRows.setdefault(
+                getFeatureLayout(features.names), []).append(n)
+        for (layout, rows) in layoutRows.iteritems():
+            colIndices, positions = self._columnPositions(layout, cols[1:])
+            bad = [items[n][0] for n in rows
+                   if len(items[n][1].values) != len(layout.names)]
+            if bad:
+                raise WndcharmStorageError(
+                    'Expected %d feature values for ids: %s' % (
+                        len(layout.names), bad))
+            values[numpy.ix_(rows, positions)] = [
+                items[n][1].values for n in rows]
+            present[numpy.ix_(rows, colIndices)] = True
+
+        cols[0].values = [id for (id, features) in items]
+        for (n, col) in enumerate(cols[1:]):
+            col.values = values[:, starts[n]:starts[n + 1]].tolist()
+            if not present[:, n].all():
+                # Feature groups which weren't provided are null
+                col.values = [v if p else [] for (v, p) in izip(
+                        col.values, present[:, n])]
+
+        if replace:
+            updated, added = self.tc.upsertRows(cols[0].values, cols[1:])
+            if updated:
+                # Invalidate incremental cache updates in all processes, this
+                # must happen after the rows have been overwritten
+                incrementRewriteCount(self.conn, self.tc.tableId)
+                if self.cache is not None:
+                    self.cache.remove(self.tc.tableId)
+        else:
+            self.tc.chunkedAddData(cols, CHUNK_SIZE)
+        return len(items)
+
+
+    def _columnPositions(self, layout, cols):
+        """
+        Internal helper method, gets the positions of a feature layout in the
+        open table, see FeatureLayout.columnPositions()
+        """
+        key = (self.tc.tableId, layout)
+        try:
+            return self._layoutPositions[key]
+        except KeyError:
+            pass
+        if len(self._layoutPositions) >= FEATURE_LAYOUT_CACHE_SIZE:
+            self._layoutPositions.clear()
+        p = self._layoutPositions[key] = layout.columnPositions(cols)
+        return p
 
-        self.tc.addData(cols)
+
+    def getFeatureNames(self):
+        """
+        Get the single value feature names of the open table, see
+        columnFeatureNames()
+        @return a tuple of feature names, this is the same object for all
+        tables with the same columns
+        """
+        # Skip the first id column
+        return columnFeatureNames(self.tc.getHeaders()[1:])
 
 
     def loadFeatures(self, id):
         """
         Load features for an object from a table
-        @return a (names, values) tuple where names is a list of single value
-        features and value are the corresponding feature values
+        @return a (names, values) tuple where names is a tuple of single value
+        features shared with other calls (see getFeatureNames()) and value are
+        the corresponding feature values
         """
+        self.flush()
         r = self.tc.getRowId(id)
+        headers = self.tc.getHeaders()
         # Skip the first id column
-        colNumbers = range(1, len(self.tc.getHeaders()))
+        colNumbers = range(1, len(headers))
         cols = self.tc.readArray(colNumbers, r, r + 1)
-        names = []
         values = []
         for col in cols:
-            names.extend([createFeatureName(col.name, x)
-                          for x in xrange(col.size)])
             values.extend(col.values[0])
 
-        return (names, values)
+        return (columnFeatureNames(headers[1:]), values)
 
 
-    def bulkLoadFeatures(self):
+    def bulkLoadFeatures(self, ids=None):
         """
-        Load features for all objects in a table
-        @return a (names, values, ids) tuple where names is a list of single
-        value features, values is a list of lists of the corresponding feature
-        values and ids is a list of object IDs.
-        In other words values[i] is the list of feature values corresponding to
-        object with ID given by ids[i].
+        Load features for all objects in a table into a single matrix.
+        Rows are read in chunks which are copied into the preallocated matrix
+        as soon as they are received, so the peak memory use is the matrix
+        (8 bytes per feature per row) plus a few chunks (see
+        TableConnection.CHUNK_BYTES). If a cache is used the matrix is copied
+        from the memory mapped cache entry instead.
+        @param ids If provided only load features for these object IDs, all
+        of which must be present in the table
+        @return a (names, values, ids) tuple where names is a tuple of single
+        value features (see getFeatureNames()), values is a 2-D float64 numpy
+        array with one row per object and one column per feature, with null
+        features set to NaN, and ids is a 1-D int64 numpy array of object IDs.
+        In other words values[i] holds the feature values corresponding to
+        object with ID given by ids[i]. Both arrays are writable and owned by
+        the caller.
         """
+        self.flush()
+        if self.cache is not None:
+            return self._bulkLoadCached(ids)
+
+        names = self.getFeatureNames()
         colNumbers = range(len(self.tc.getHeaders()))
-        nr = self.tc.getNumberOfRows()
-        cols = self.tc.readArray(colNumbers, 0, nr, CHUNK_SIZE)
-        names = []
-        ids = cols[0].values
 
-        for col in cols[1:]:
-            names.extend([createFeatureName(col.name, x) for x in xrange(col.size)])
-            values = map(lambda *args: list(chain.from_iterable(args)),
-                         *[c.values for c in cols[1:]])
+        if ids is None:
+            nr = self.tc.getNumberOfRows()
+            values = numpy.empty((nr, len(names)))
+            ids = numpy.empty(nr, dtype=numpy.int64)
+            p = 0
+            for cols in self.tc.iterReadArray(colNumbers, 0, nr, CHUNK_SIZE,
+                                              asarray=True):
+                q = p + len(cols[0].values)
+                ids[p:q] = cols[0].values
+                self._copyColumns(cols[1:], values, slice(p, q))
+                p = q
+        else:
+            rows = self.tc.getRowIds(ids)
+            missing = [id for (id, r) in izip(ids, rows) if r is None]
+            if missing:
+                raise WndcharmStorageError(
+                    'Features not found for ids: %s' % missing)
+            values = numpy.empty((len(rows), len(names)))
+            ids = numpy.empty(len(rows), dtype=numpy.int64)
+            # Each chunk is copied straight into its rows of the matrix
+            for (positions, cols) in self.tc.iterReadRows(
+                    colNumbers, rows, asarray=True):
+                ids[positions] = cols[0].values
+                self._copyColumns(cols[1:], values, positions)
 
         return (names, values, ids)
 
 
+    def loadCachedFeatures(self, incremental=True):
+        """
+        Load the contents of the table from the cache, the table is read and
+        the cache updated if the table has been modified since it was cached
+        @param incremental If True and an older version of the table is
+        cached only read the rows added since then, unless the table appears
+        to have been rewritten (fewer rows, the ids of the cached rows have
+        changed, or existing rows have been overwritten in place since they
+        were cached as recorded by incrementRewriteCount()).
+        @return a FeatureCache.CachedFeatures object
+        """
+        self.flush()
+        if self.cache is None:
+            raise WndcharmStorageError('No cache')
+        # Get the timestamp first so a concurrent modification invalidates
+        # the entry
+        tableId = self.tc.tableId
+        lastModification = self.tc.getLastModification()
+        nrows = self.tc.getNumberOfRows()
+        c = self.cache.get(tableId, lastModification, nrows)
+        if c is not None:
+            return c
+
+        # This must be read before any rows. Writers increment it after
+        # overwriting rows, so if it matches an older entry no rows of that
+        # entry have been overwritten since they were read.
+        rewrites = getRewriteCount(self.conn, tableId)
+        if incremental:
+            old = self.cache.latest(tableId)
+            if old is not None and old.rewrites == rewrites and \
+                    self._isCachedPrefix(old, nrows):
+                names, ids, values = self._readFeatureArrays(
+                    old.nrows, nrows)
+                return self.cache.put(
+                    tableId, lastModification, nrows, old.names,
+                    numpy.concatenate((old.ids, ids)),
+                    numpy.concatenate((old.values, values)), rewrites)
+
+        names, ids, values = self._readFeatureArrays(0, nrows)
+        return self.cache.put(tableId, lastModification, nrows, names, ids,
+                              values, rewrites)
+
+
+    def _isCachedPrefix(self, cached, nrows):
+        """
+        Internal helper method, checks whether an older cached version of
+        the table matches the first rows of the table by comparing ids
+        @param cached The cached table
+        @param nrows The current number of rows in the table
+        @return True if only rows after cached.nrows need to be read
+        """
+        if cached.nrows > nrows:
+            return False
+        if cached.nrows == 0:
+            return True
+        data = self.tc.chunkedRead([0], 0, cached.nrows, CHUNK_SIZE,
+                                   asarray=True)
+        return numpy.array_equal(data.columns[0].values, cached.ids)
+
+
+    def _bulkLoadCached(self, ids):
+        """
+        Internal helper method, bulkLoadFeatures() using the cache
+        """
+        c = self.loadCachedFeatures()
+        # Copy so the arrays are writable as when the cache isn't used
+        if ids is None:
+            return (self.getFeatureNames(), numpy.array(c.values),
+                    numpy.array(c.ids))
+
+        # Later rows take precedence, as in FeatureTableConnection.getRowId
+        index = dict(izip(c.ids.tolist(), xrange(c.nrows)))
+        missing = [id for id in ids if id not in index]
+        if missing:
+            raise WndcharmStorageError(
+                'Features not found for ids: %s' % missing)
+        rows = [index[id] for id in ids]
+        return (self.getFeatureNames(), c.values[rows],
+                numpy.array(ids, dtype=numpy.int64))
+
+
+    def _readFeatureArrays(self, start, stop):
+        """
+        Internal helper method, reads a range of rows into arrays
+        @return a (names, ids, values) tuple where names is a tuple of single
+        value features, ids a 1-D array of object ids and values a 2-D
+        float64 array with null features set to NaN
+        """
+        colNumbers = range(len(self.tc.getHeaders()))
+        cols = self.tc.readArray(colNumbers, start, stop, CHUNK_SIZE,
+                                 asarray=True)
+        names = self.getFeatureNames()
+        values = numpy.empty((stop - start, len(names)))
+        self._copyColumns(cols[1:], values)
+        return (names, cols[0].values, values)
+
+
+    def _copyColumns(self, cols, values, rows=slice(None)):
+        """
+        Internal helper method, copies DoubleArray columns read as arrays
+        into consecutive columns of a matrix
+        @param cols A list of DoubleArrayColumns holding 2-D arrays
+        @param values A 2-D array with a column for each single value feature
+        @param rows The rows of values to be filled, either a slice or a
+        list of row indices corresponding to the rows of cols, default all
+        """
+        p = 0
+        for col in cols:
+            values[rows, p:p + col.size] = col.values
+            p += col.size
+
+
 
 ######################################################################
 # Save a classifier
@@ -271,10 +773,14 @@ class ClassifierTables(object):
     names, and the third stores the class IDs and class names
     """
 
-    def __init__(self, client, tableNameF, tableNameW, tableNameL):
-        self.tcF = TableConnection(client=client, tableName=tableNameF)
-        self.tcW = TableConnection(client=client, tableName=tableNameW)
-        self.tcL = TableConnection(client=client, tableName=tableNameL)
+    def __init__(self, client, tableNameF, tableNameW, tableNameL,
+                 stats=None):
+        self.tcF = TableConnection(
+            client=client, tableName=tableNameF, stats=stats)
+        self.tcW = TableConnection(
+            client=client, tableName=tableNameW, stats=stats)
+        self.tcL = TableConnection(
+            client=client, tableName=tableNameL, stats=stats)
         self.versiontag = None
 
     def close(self):
@@ -365,13 +871,15 @@ class ClassifierTables(object):
         self.tcL.chunkedAddData(colsL, CHUNK_SIZE)
 
 
-    def loadClassifierTables(self):
+    def loadClassifierTables(self, asarray=False):
         """
         Load the classifier state (reduced features, labels and weights)
+        @param asarray If True return the ids, labels, features and weights
+        as numpy arrays instead of lists
         """
         dF = self.tcF.chunkedRead(
             range(len(self.tcF.getHeaders())), 0,
-            self.tcF.getNumberOfRows(), CHUNK_SIZE)
+            self.tcF.getNumberOfRows(), CHUNK_SIZE, asarray=asarray)
         colsF = dF.columns
         ids = colsF[0].values
         trainClassIds = colsF[1].values
@@ -379,14 +887,14 @@ class ClassifierTables(object):
 
         dW = self.tcW.chunkedRead(
             range(len(self.tcW.getHeaders())), 0,
-            self.tcW.getNumberOfRows(), CHUNK_SIZE)
+            self.tcW.getNumberOfRows(), CHUNK_SIZE, asarray=asarray)
         colsW = dW.columns
         featureNames = colsW[0].values
         weights = colsW[1].values
 
         dL = self.tcL.chunkedRead(
             range(len(self.tcL.getHeaders())), 0,
-            self.tcL.getNumberOfRows(), CHUNK_SIZE)
+            self.tcL.getNumberOfRows(), CHUNK_SIZE, asarray=asarray)
         colsL = dL.columns
         classIds = colsL[0].values
         classNames = colsL[1].values
@@ -450,6 +958,41 @@ def getVersion(conn, objType, objId):
         'Multiple versions attached to %s:%d' % (objType, objId))
 
 
+def getRewriteCount(conn, tableId):
+    """
+    Get the number of times existing rows of a feature table have been
+    overwritten in place, see incrementRewriteCount()
+    """
+    obj = conn.getObject('OriginalFile', tableId)
+    for a in obj.listAnnotations(WNDCHARM_REWRITES_NAMESPACE):
+        return unwrap(a._obj.getLongValue())
+    return 0
+
+
+def incrementRewriteCount(conn, tableId):
+    """
+    Record that existing rows of a feature table have been overwritten in
+    place. The table's lastModification timestamp and number of rows can't be
+    used to distinguish this from rows being appended, so this count is used
+    to invalidate incremental updates of cached copies of the table held by
+    other processes (see FeatureTable.loadCachedFeatures()).
+    """
+    us = conn.getUpdateService()
+    obj = conn.getObject('OriginalFile', tableId)
+    for a in obj.listAnnotations(WNDCHARM_REWRITES_NAMESPACE):
+        ann = a._obj
+        ann.setLongValue(rlong(unwrap(ann.getLongValue()) + 1))
+        us.saveObject(ann)
+        return
+
+    ann = omero.model.LongAnnotationI()
+    ann.setNs(wrap(WNDCHARM_REWRITES_NAMESPACE))
+    ann.setLongValue(rlong(1))
+    annLink = omero.model.OriginalFileAnnotationLinkI()
+    annLink.link(omero.model.OriginalFileI(tableId, False), ann)
+    us.saveObject(annLink)
+
+
 def assertVersionMatch(requiredver, actualver, source=None):
     if source:
         source = ' (%s)' % source
@@ -510,6 +1053,27 @@ def addFileAnnotationTo(tc, obj):
         (tfile.getId(), oclass, obj.getId())
 
 
+def moveFileAnnotations(conn, oldFileId, newFileId):
+    """
+    Point all Wndcharm file annotations of one table file to another, for
+    instance when a table has been copied
+    @return the number of annotations updated
+    """
+    qs = conn.getQueryService()
+
+    p = omero.sys.ParametersI()
+    p.map['ns'] = wrap(WNDCHARM_NAMESPACE)
+    p.map['fid'] = wrap(long(oldFileId))
+    anns = qs.findAllByQuery(
+        'from FileAnnotation a where a.ns=:ns and a.file.id=:fid', p)
+
+    for a in anns:
+        a.setFile(omero.model.OriginalFileI(newFileId, False))
+    if anns:
+        conn.getUpdateService().saveArray(anns)
+    return len(anns)
+
+
 def getAttachedTableFile(tc, obj):
     """
     See if this object (dataset/project) has a table file annotation
@@ -586,6 +1150,26 @@ def addTagTo(conn, tag, objType, objId):
     return 'Attached tag to %s id:%d\n' % (objType, objId)
 
 
+def unlinkTagFrom(conn, tag, objType, objId):
+    """
+    Remove a tag from an object (dataset/project/image), the tag itself is
+    not deleted
+    """
+    obj = conn.getObject(objType, objId)
+    linkIds = [a.link.getId() for a in obj.listAnnotations()
+               if isinstance(a, omero.gateway.TagAnnotationWrapper) and
+               unwrap(tag.getId()) == a.getId()]
+    if not linkIds:
+        return 'Not tagged %s id:%d\n' % (objType, objId)
+
+    handle = conn.deleteObjects(objType + 'AnnotationLink', linkIds)
+    try:
+        conn._waitOnCmd(handle)
+    finally:
+        handle.close()
+    return 'Removed tag from %s id:%d\n' % (objType, objId)
+
+
 def createClassifierTagSet(conn, classifierName, instanceName, labels,
                            project = None):
     """
@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Table I/O benchmarks for TableConnection and WndcharmStorage, run against
+# the in-process LocalTables stand-in so no server is required.
+#
+# Each benchmark is run in a separate process so that the peak memory
+# (maximum resident set size) can be reported. Results are saved as JSON,
+# use --compare to compare them with a previous run, e.g.
+#
+#   python table_benchmarks.py -o before.json
+#   (change something)
+#   python table_benchmarks.py -o after.json --compare before.json
+#
+# Use --rows 1000,1000000 --max-bytes 0 to run the largest tables, this
+# requires a lot of memory.
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'OmeroWndcharm'))
+
+from copy import deepcopy
+from optparse import OptionParser
+import json
+import platform
+import random
+import resource
+import subprocess
+import time
+import numpy
+
+import omero
+from LocalTables import LocalClient, LocalStore
+from RpcStats import RpcStats
+from TableConnection import TableConnection, FeatureTableConnection, \
+    AUTO_CHUNK
+from WndcharmStorage import FeatureTable, ClassifierTables, \
+    createFeatureName
+
+# Table sizes used by default
+DEFAULT_ROWS = [1000, 10000, 100000]
+# The number of features in the small and large Wndcharm feature sets
+DEFAULT_WIDTHS = [1059, 2919]
+# Synthetic features are split into groups of this size
+FEATURE_GROUP_SIZE = 24
+# Benchmarks which make one call per object are limited to this many objects
+PER_OBJECT_LIMIT = 1000
+# Number of rows written per call when populating tables
+POPULATE_CHUNK = 1000
+# Skip benchmarks whose data is estimated to need more than this many bytes
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Approximate size of a Python float in a list
+PYTHON_FLOAT_BYTES = 32
+
+
+class SyntheticFeatures(object):
+    """
+    A set of features in the format expected by FeatureTable.saveFeatures()
+    """
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+
+
+def featureDescription(width):
+    """
+    Split width features into named groups
+    @return a list of (name, size) tuples
+    """
+    desc = []
+    for n in xrange(0, width, FEATURE_GROUP_SIZE):
+        desc.append(('ft%04d' % len(desc), min(FEATURE_GROUP_SIZE, width - n)))
+    return desc
+
+
+def featureNames(width):
+    return [createFeatureName(name, x)
+            for (name, size) in featureDescription(width)
+            for x in xrange(size)]
+
+
+def populateFeatureTable(ftc, rows, width, nulls=True, create=True):
+    """
+    Fill a FeatureTableConnection with random data, if nulls is True every
+    tenth element of the second column is null. If create is False the
+    table must already exist.
+    """
+    desc = featureDescription(width)
+    if create:
+        ftc.createNewTable('id', desc)
+    for p in xrange(0, rows, POPULATE_CHUNK):
+        q = min(p + POPULATE_CHUNK, rows)
+        cols = ftc.getHeaders()
+        cols[0].values = range(p, q)
+        for (c, (name, size)) in zip(cols[1:], desc):
+            c.values = numpy.random.rand(q - p, size).tolist()
+        if nulls and len(cols) > 2:
+            for r in xrange(0, q - p, 10):
+                cols[2].values[r] = []
+        ftc.addData(cols, copy=False)
+    return ftc.tableId
+
+
+def populateTable(tc, rows, width):
+    """
+    Fill a TableConnection with an id column and a single array column of
+    random data
+    """
+    tc.newTable([omero.grid.LongColumn('id'),
+                 omero.grid.DoubleArrayColumn('features', '', width)])
+    for p in xrange(0, rows, POPULATE_CHUNK):
+        q = min(p + POPULATE_CHUNK, rows)
+        cols = tc.getHeaders()
+        cols[0].values = range(p, q)
+        cols[1].values = numpy.random.rand(q - p, width).tolist()
+        tc.chunkedAddData(cols, AUTO_CHUNK)
+    return tc.tableId
+
+
+class Benchmark(object):
+    """
+    The context of a single benchmark run. Subclasses implement setup(), which
+    is not timed, and run() which must return the number of rows processed.
+    """
+
+    # Calls a benchmark makes are limited to this many objects
+    limit = None
+
+    def __init__(self, rows, width, latency, bandwidth):
+        self.rows = rows
+        self.width = width
+        self.store = LocalStore()
+        self.setupClient = LocalClient(self.store)
+        self.client = LocalClient(self.store, latency, bandwidth)
+        self.stats = RpcStats()
+
+    def objects(self):
+        if self.limit:
+            return min(self.rows, self.limit)
+        return self.rows
+
+    def estimatedBytes(self):
+        return self.rows * self.width * PYTHON_FLOAT_BYTES
+
+    def payloadBytes(self, nrows):
+        return nrows * (self.width + 1) * 8
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class ChunkedAddData(Benchmark):
+    def setup(self):
+        self.tc = TableConnection(client=self.client, tableName='/bench.h5',
+                                  stats=self.stats)
+        self.tc.newTable([omero.grid.LongColumn('id'),
+                          omero.grid.DoubleArrayColumn(
+                    'features', '', self.width)])
+        self.cols = self.tc.getHeaders()
+        self.cols[0].values = range(self.rows)
+        self.cols[1].values = numpy.random.rand(
+            self.rows, self.width).tolist()
+        self.stats.reset()
+
+    def run(self):
+        self.tc.chunkedAddData(self.cols, AUTO_CHUNK)
+        return self.rows
+
+    def close(self):
+        self.tc.close(False)
+
+
+class ChunkedRead(Benchmark):
+    asarray = False
+
+    def setup(self):
+        tid = populateTable(
+            TableConnection(client=self.setupClient, tableName='/bench.h5'),
+            self.rows, self.width)
+        self.tc = TableConnection(client=self.client, tableName='/bench.h5',
+                                  stats=self.stats)
+        self.tc.openTable(tid)
+        self.stats.reset()
+
+    def run(self):
+        data = self.tc.chunkedRead([0, 1], 0, self.rows, AUTO_CHUNK,
+                                   asarray=self.asarray)
+        return len(data.rowNumbers)
+
+    def close(self):
+        self.tc.close(False)
+
+
+class ChunkedReadArray(ChunkedRead):
+    asarray = True
+
+
+class FeatureTableBenchmark(Benchmark):
+    """
+    Base class for benchmarks using a populated FeatureTableConnection
+    """
+
+    def setup(self):
+        self.tid = populateFeatureTable(
+            FeatureTableConnection(client=self.setupClient,
+                                   tableName='/bench.h5'),
+            self.rows, self.width)
+        self.ftc = FeatureTableConnection(
+            client=self.client, tableName='/bench.h5', stats=self.stats)
+        self.ftc.openTable(self.tid)
+        self.nCols = len(self.ftc.getHeaders())
+        self.stats.reset()
+
+    def close(self):
+        self.ftc.close(False)
+
+
+class ReadArray(FeatureTableBenchmark):
+    def run(self):
+        cols = self.ftc.readArray(range(self.nCols), 0, self.rows,
+                                  chunk=AUTO_CHUNK)
+        return len(cols[0].values)
+
+
+class ReadSubArray(FeatureTableBenchmark):
+    def estimatedBytes(self):
+        return self.rows * self.width * 8
+
+    def payloadBytes(self, nrows):
+        return nrows * (self.width / 10 + 1) * 8
+
+    def run(self):
+        headers = self.ftc.getHeaders()
+        can = dict((n, range(0, headers[n].size, 10))
+                   for n in xrange(1, self.nCols))
+        cols = self.ftc.readSubArray(can, 0, self.rows, chunk=AUTO_CHUNK)
+        return len(cols[0].values)
+
+
+class GetRowId(FeatureTableBenchmark):
+    limit = PER_OBJECT_LIMIT
+
+    def payloadBytes(self, nrows):
+        return nrows * 8
+
+    def run(self):
+        ids = random.sample(xrange(self.rows), self.objects())
+        for id in ids:
+            self.ftc.getRowId(id)
+        return len(ids)
+
+
+class AddData(Benchmark):
+    """
+    FeatureTableConnection.addData(), also see AddDataDeepcopy
+    """
+
+    def setup(self):
+        self.ftc = FeatureTableConnection(
+            client=self.client, tableName='/bench.h5', stats=self.stats)
+        desc = featureDescription(self.width)
+        self.ftc.createNewTable('id', desc)
+        self.cols = self.ftc.getHeaders()
+        self.cols[0].values = range(self.rows)
+        for (c, (name, size)) in zip(self.cols[1:], desc):
+            c.values = numpy.random.rand(self.rows, size).tolist()
+        self.stats.reset()
+
+    def run(self):
+        self.ftc.addData(self.write(), copy=False)
+        return self.rows
+
+    def write(self):
+        return self.cols
+
+    def close(self):
+        self.ftc.close(False)
+
+
+class AddDataDeepcopy(AddData):
+    """
+    The same as AddData but deep-copies the columns first, as addData()
+    used to. The difference in peak memory between the two is the memory
+    saved by not copying.
+    """
+
+    def write(self):
+        return deepcopy(self.cols)
+
+
+class SaveFeatures(Benchmark):
+    limit = PER_OBJECT_LIMIT
+
+    def estimatedBytes(self):
+        return self.objects() * self.width * PYTHON_FLOAT_BYTES
+
+    def setup(self):
+        self.ft = FeatureTable(self.client, '/bench.h5', self.stats)
+        names = featureNames(self.width)
+        self.ft.createTable(names, 'bench')
+        self.features = [
+            SyntheticFeatures(names, numpy.random.rand(self.width).tolist())
+            for n in xrange(self.objects())]
+        self.stats.reset()
+
+    def run(self):
+        for (id, f) in enumerate(self.features):
+            self.ft.saveFeatures(id, f)
+        return len(self.features)
+
+    def close(self):
+        self.ft.close()
+
+
+class FeatureTableLoadBenchmark(Benchmark):
+    """
+    Base class for benchmarks using a populated FeatureTable
+    """
+
+    def setup(self):
+        ft = FeatureTable(self.setupClient, '/bench.h5')
+        ft.createTable(featureNames(self.width), 'bench')
+        populateFeatureTable(ft.tc, self.rows, self.width, nulls=False,
+                             create=False)
+        tid = ft.tc.tableId
+        ft.close()
+
+        self.ft = FeatureTable(self.client, '/bench.h5', self.stats)
+        self.ft.openTable(tid)
+        self.stats.reset()
+
+    def close(self):
+        self.ft.close()
+
+
+class LoadFeatures(FeatureTableLoadBenchmark):
+    limit = PER_OBJECT_LIMIT
+
+    def run(self):
+        ids = random.sample(xrange(self.rows), self.objects())
+        for id in ids:
+            self.ft.loadFeatures(id)
+        return len(ids)
+
+
+class BulkLoadFeatures(FeatureTableLoadBenchmark):
+    def run(self):
+        names, values, ids = self.ft.bulkLoadFeatures()
+        return len(ids)
+
+
+class ClassifierTablesBenchmark(Benchmark):
+    """
+    Base class for benchmarks using ClassifierTables
+    """
+
+    def classifierData(self):
+        return ([n for n in xrange(self.rows)],
+                [n % 4 for n in xrange(self.rows)],
+                numpy.random.rand(self.rows, self.width).tolist(),
+                ['ft%d' % n for n in xrange(self.width)],
+                numpy.random.rand(self.width).tolist(),
+                ['c%d' % n for n in xrange(4)])
+
+    def close(self):
+        self.ct.close()
+
+
+class SaveClassifierTables(ClassifierTablesBenchmark):
+    def setup(self):
+        self.ct = ClassifierTables(self.client, '/F.h5', '/W.h5', '/L.h5',
+                                   self.stats)
+        self.ct.createClassifierTables(
+            ['ft%d' % n for n in xrange(self.width)], 'bench')
+        self.data = self.classifierData()
+        self.stats.reset()
+
+    def run(self):
+        self.ct.saveClassifierTables(*self.data)
+        return self.rows
+
+
+class LoadClassifierTables(ClassifierTablesBenchmark):
+    asarray = False
+
+    def setup(self):
+        ct = ClassifierTables(self.setupClient, '/F.h5', '/W.h5', '/L.h5')
+        ct.createClassifierTables(
+            ['ft%d' % n for n in xrange(self.width)], 'bench')
+        ct.saveClassifierTables(*self.classifierData())
+        tids = (ct.tcF.tableId, ct.tcW.tableId, ct.tcL.tableId)
+        ct.close()
+
+        self.ct = ClassifierTables(self.client, '/F.h5', '/W.h5', '/L.h5',
+                                   self.stats)
+        self.ct.openTables(*tids)
+        self.stats.reset()
+
+    def run(self):
+        cls = self.ct.loadClassifierTables(asarray=self.asarray)
+        return len(cls['ids'])
+
+
+BENCHMARKS = {
+    'chunkedAddData': ChunkedAddData,
+    'chunkedRead': ChunkedRead,
+    'chunkedRead_asarray': ChunkedReadArray,
+    'readArray': ReadArray,
+    'readSubArray': ReadSubArray,
+    'getRowId': GetRowId,
+    'addData': AddData,
+    'addData_deepcopy': AddDataDeepcopy,
+    'saveFeatures': SaveFeatures,
+    'loadFeatures': LoadFeatures,
+    'bulkLoadFeatures': BulkLoadFeatures,
+    'saveClassifierTables': SaveClassifierTables,
+    'loadClassifierTables': LoadClassifierTables,
+    }
+
+
+def runBenchmark(name, rows, width, latency, bandwidth):
+    """
+    Run a single benchmark in this process
+    @return a dictionary of results
+    """
+    b = BENCHMARKS[name](rows, width, latency, bandwidth)
+    b.setup()
+    setupRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        t0 = time.time()
+        n = b.run()
+        seconds = time.time() - t0
+    finally:
+        b.close()
+
+    calls, rpcSeconds, rpcBytes = b.stats.totals()
+    return {
+        'benchmark': name,
+        'rows': rows,
+        'width': width,
+        'objects': n,
+        'seconds': seconds,
+        'objectsPerSecond': n / seconds if seconds else None,
+        'megabytesPerSecond':
+            b.payloadBytes(n) / seconds / 1e6 if seconds else None,
+        'rpcCalls': calls,
+        'rpcSeconds': rpcSeconds,
+        'rpcBytes': rpcBytes,
+        'setupMaxRssKB': setupRss,
+        'peakMaxRssKB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+def runSubprocess(name, rows, width, options):
+    """
+    Run a single benchmark in a child process
+    @return a dictionary of results
+    """
+    args = [sys.executable, os.path.abspath(__file__), '--child',
+            '-b', name, '-r', str(rows), '-w', str(width),
+            '--latency', str(options.latency)]
+    if options.bandwidth:
+        args += ['--bandwidth', str(options.bandwidth)]
+    p = subprocess.Popen(args, stdout=subprocess.PIPE)
+    out, err = p.communicate()
+    if p.returncode:
+        return {'benchmark': name, 'rows': rows, 'width': width,
+                'error': 'Exit code %d' % p.returncode}
+    return json.loads(out)
+
+
+def gitCommit():
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        out, err = p.communicate()
+        return out.strip() or None
+    except OSError:
+        return None
+
+
+def compareResults(old, new):
+    """
+    Print the relative throughput and peak memory of two sets of results
+    """
+    oldMap = dict(((r['benchmark'], r['rows'], r['width']), r)
+                  for r in old['results'])
+    print '%-24s %8s %6s %10s %10s' % (
+        'benchmark', 'rows', 'width', 'speedup', 'memory')
+    for r in new['results']:
+        o = oldMap.get((r['benchmark'], r['rows'], r['width']))
+        if not o or not o.get('seconds') or not r.get('seconds'):
+            continue
+        print '%-24s %8d %6d %9.2fx %9.2fx' % (
+            r['benchmark'], r['rows'], r['width'],
+            o['seconds'] / r['seconds'],
+            float(r['peakMaxRssKB']) / o['peakMaxRssKB'])
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-b', '--benchmarks', default=','.join(sorted(BENCHMARKS)),
+                      help='Comma separated benchmark names [%default]')
+    parser.add_option('-r', '--rows',
+                      default=','.join(str(r) for r in DEFAULT_ROWS),
+                      help='Comma separated table sizes [%default]')
+    parser.add_option('-w', '--widths',
+                      default=','.join(str(w) for w in DEFAULT_WIDTHS),
+                      help='Comma separated feature counts [%default]')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='Simulated seconds per call [%default]')
+    parser.add_option('--bandwidth', type='float', default=None,
+                      help='Simulated bytes per second')
+    parser.add_option('--max-bytes', type='int', default=DEFAULT_MAX_BYTES,
+                      help='Skip benchmarks estimated to use more memory '
+                      'than this, 0 for no limit [%default]')
+    parser.add_option('-o', '--output', help='Save results to this JSON file')
+    parser.add_option('--compare', help='Compare with this JSON file')
+    parser.add_option('--inline', action='store_true',
+                      help='Run in this process, peak memory is not '
+                      'reported per benchmark')
+    parser.add_option('--child', action='store_true',
+                      help='Internal, run a single benchmark')
+    options, args = parser.parse_args()
+
+    names = options.benchmarks.split(',')
+    rowsList = [int(r) for r in options.rows.split(',')]
+    widths = [int(w) for w in options.widths.split(',')]
+
+    if options.child:
+        print json.dumps(runBenchmark(names[0], rowsList[0], widths[0],
+                                      options.latency, options.bandwidth))
+        return
+
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark: %s' % name)
+
+    results = []
+    for name in names:
+        for width in widths:
+            for rows in rowsList:
+                b = BENCHMARKS[name]
+                estimate = b(rows, width, 0, None).estimatedBytes()
+                if options.max_bytes and estimate > options.max_bytes:
+                    r = {'benchmark': name, 'rows': rows, 'width': width,
+                         'skipped': 'Estimated %d bytes' % estimate}
+                elif options.inline:
+                    r = runBenchmark(name, rows, width, options.latency,
+                                     options.bandwidth)
+                else:
+                    r = runSubprocess(name, rows, width, options)
+                results.append(r)
+
+                if 'seconds' in r:
+                    print '%-24s %8d %6d %9.3fs %10.1f/s %6d calls %8d KB' % (
+                        name, rows, width, r['seconds'],
+                        r['objectsPerSecond'] or 0, r['rpcCalls'],
+                        r['peakMaxRssKB'])
+                else:
+                    print '%-24s %8d %6d %s' % (
+                        name, rows, width, r.get('skipped', r.get('error')))
+                sys.stdout.flush()
+
+    output = {
+        'commit': gitCommit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': options.latency,
+        'bandwidth': options.bandwidth,
+        'results': results,
+        }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            compareResults(json.load(f), output)
+
+
+if __name__ == '__main__':
+    main()
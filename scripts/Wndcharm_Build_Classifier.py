@@ -113,27 +113,23 @@ def addToFeatureSet(ftb, ds, fts, classId, imagesOnly):
 
     #fts = wndcharm.FeatureSet.FeatureSet_Discrete({'num_images': 0})
     if imagesOnly:
-        for image in ds.listChildren():
-            imId = image.getId()
+        imIds = [image.getId() for image in ds.listChildren()]
+        for imId in imIds:
             message += '\tProcessing features for image id:%d\n' % imId
-
-            sig = wndcharm.FeatureSet.Signatures()
-            (sig.names, sig.values) = ftb.loadFeatures(imId)
-            sig.source_file = str(imId)
-            sig.version = version
-            fts.AddSignature(sig, classId)
+        names, values, ids = ftb.bulkLoadFeatures(imIds)
 
     else:
         names, values, ids = ftb.bulkLoadFeatures()
         message += '\tProcessing all features for dataset id:%d\n' % ds.getId()
 
-        for imId, vals in izip(ids, values):
-            sig = wndcharm.FeatureSet.Signatures()
-            sig.names = names
-            sig.values = vals
-            sig.source_file = str(imId)
-            sig.version = version
-            fts.AddSignature(sig, classId)
+    for imId, vals in izip(ids, values):
+        sig = wndcharm.FeatureSet.Signatures()
+        sig.names = names
+        # Signatures expects a list not a numpy array
+        sig.values = vals.tolist()
+        sig.source_file = str(imId)
+        sig.version = version
+        fts.AddSignature(sig, classId)
 
     fts.classnames_list[classId] = ds.getName()
     return message
@@ -166,9 +162,15 @@ def trainClassifier(client, scriptParams):
     message += 'tableNameOutW:' + tableNameOutW + '\n'
     message += 'tableNameOutL:' + tableNameOutL + '\n'
 
-    ftb = WndcharmStorage.FeatureTable(client, tableNameIn)
+    stats = None
+    if scriptParams.get('RPC_Stats'):
+        stats = WndcharmStorage.RpcStats()
+    # Share one session and pool of open tables between all connections
+    pool = WndcharmStorage.ConnectionPool(client=client, stats=stats)
+    ftb = WndcharmStorage.FeatureTable(
+        pool, tableNameIn, stats, WndcharmStorage.defaultFeatureCache())
     ctb = WndcharmStorage.ClassifierTables(
-        client, tableNameOutF, tableNameOutW, tableNameOutL)
+        pool, tableNameOutF, tableNameOutW, tableNameOutL, stats)
 
     try:
         # Training
@@ -184,6 +186,10 @@ def trainClassifier(client, scriptParams):
     finally:
         ftb.close()
         ctb.close()
+        pool.closeTables()
+
+    if stats is not None:
+        message += stats.summary()
 
     return message
 
@@ -222,6 +228,11 @@ def runScript():
             description='Should the features table be cross-references with the list of images in the dataset?',
             default=True),
 
+        scripts.Bool(
+            'RPC_Stats', optional=True, grouping='9',
+            description='Report the number and duration of remote calls',
+            default=False),
+
         version = '0.0.1',
         authors = ['Simon Li', 'OME Team'],
         institutions = ['University of Dundee'],
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+from omero import scripts
+from omero.util import script_utils
+import omero.model
+from omero.rtypes import rstring, rlong
+from datetime import datetime
+
+
+from OmeroWndcharm import WndcharmStorage
+
+
+
+def compactTable(ftb, ds, sort):
+    message = ''
+
+    tid = WndcharmStorage.getAttachedTableFile(ftb.tc, ds)
+    if tid is None:
+        message += 'No table found\n'
+        return message
+
+    if not ftb.openTable(tid):
+        message += 'ERROR: Table not opened\n'
+        return message
+
+    nrows = ftb.tc.getNumberOfRows()
+    message += 'Opened table id:%d rows:%d\n' % (tid, nrows)
+    newId = ftb.compactTable(sort)
+    if newId is None:
+        message += 'Table is already compact\n'
+    else:
+        message += 'Created table id:%d rows:%d, table id:%d is unused\n' % (
+            newId, ftb.tc.getNumberOfRows(), tid)
+    return message
+
+
+def processDatasets(client, scriptParams):
+    message = ''
+
+    # for params with default values, we can get the value directly
+    dataType = scriptParams['Data_Type']
+    ids = scriptParams['IDs']
+    contextName = scriptParams['Context_Name']
+    sort = scriptParams.get('Sort_By_Id', False)
+
+    tableName = '/Wndcharm/' + contextName + '/SmallFeatureSet.h5'
+    message += 'tableName:' + tableName + '\n'
+    stats = None
+    if scriptParams.get('RPC_Stats'):
+        stats = WndcharmStorage.RpcStats()
+    ftb = WndcharmStorage.FeatureTable(client, tableName, stats)
+
+    try:
+        # Get the datasets
+        objects, logMessage = script_utils.getObjects(ftb.conn, scriptParams)
+        message += logMessage
+
+        if not objects:
+            return message
+
+        datasets = WndcharmStorage.datasetGenerator(ftb.conn, dataType, ids)
+        for ds in datasets:
+            message += 'Processing dataset id:%d\n' % ds.getId()
+            msg = compactTable(ftb, ds, sort)
+            message += msg
+
+    except:
+        print message
+        raise
+    finally:
+        ftb.close()
+
+    if stats is not None:
+        message += stats.summary()
+
+    return message
+
+
+def runScript():
+    """
+    The main entry point of the script, as called by the client via the scripting service, passing the required parameters. 
+    """
+
+    client = scripts.client(
+        'Wndcharm_Compact_Features.py',
+        'Remove duplicate rows from feature tables, keeping the most recent '
+        'features for each image',
+
+        scripts.String('Data_Type', optional=False, grouping='1',
+                       description='The data you want to work with.',
+                       values=[rstring('Project'), rstring('Dataset')],
+                       default='Dataset'),
+
+        scripts.List(
+            'IDs', optional=False, grouping='1',
+            description='List of Dataset IDs or Image IDs').ofType(rlong(0)),
+
+        scripts.String(
+            'Context_Name', optional=False, grouping='1',
+            description='The name of the classification context.',
+            default='Example'),
+
+        scripts.Bool(
+            'Sort_By_Id', optional=False, grouping='2',
+            description='Sort the rows of the compacted table by image ID',
+            default=True),
+
+        scripts.Bool(
+            'RPC_Stats', optional=True, grouping='9',
+            description='Report the number and duration of remote calls',
+            default=False),
+
+        version = '0.0.1',
+        authors = ['Simon Li', 'OME Team'],
+        institutions = ['University of Dundee'],
+        contact = 'ome-users@lists.openmicroscopy.org.uk',
+    )
+
+    try:
+        startTime = datetime.now()
+        session = client.getSession()
+        client.enableKeepAlive(60)
+        scriptParams = {}
+
+        # process the list of args above.
+        for key in client.getInputKeys():
+            if client.getInput(key):
+                scriptParams[key] = client.getInput(key, unwrap=True)
+        message = str(scriptParams) + '\n'
+
+        # Run the script
+        message += processDatasets(client, scriptParams) + '\n'
+
+        stopTime = datetime.now()
+        message += 'Duration: %s' % str(stopTime - startTime)
+
+        print message
+        client.setOutput('Message', rstring(str(message)))
+
+    finally:
+        client.closeSession()
+
+if __name__ == '__main__':
+    runScript()
+
@@ -105,27 +105,23 @@ def addToFeatureSet(ftb, ds, fts, classId, imagesOnly):
         return message
 
     if imagesOnly:
-        for image in ds.listChildren():
-            imId = image.getId()
+        imIds = [image.getId() for image in ds.listChildren()]
+        for imId in imIds:
             message += '\tProcessing features for image id:%d\n' % imId
-
-            sig = Signatures()
-            (sig.names, sig.values) = ftb.loadFeatures(imId)
-            sig.source_file = str(imId)
-            sig.version = version
-            fts.AddSignature(sig, classId)
+        names, values, ids = ftb.bulkLoadFeatures(imIds)
 
     else:
         names, values, ids = ftb.bulkLoadFeatures()
         message += '\tProcessing all features for dataset id:%d\n' % ds.getId()
 
-        for imId, vals in izip(ids, values):
-            sig = Signatures()
-            sig.names = names
-            sig.values = vals
-            sig.source_file = str(imId)
-            sig.version = version
-            fts.AddSignature(sig, classId)
+    for imId, vals in izip(ids, values):
+        sig = Signatures()
+        sig.names = names
+        # Signatures expects a list not a numpy array
+        sig.values = vals.tolist()
+        sig.source_file = str(imId)
+        sig.version = version
+        fts.AddSignature(sig, classId)
 
     fts.classnames_list[classId] = ds.getName()
     return message
@@ -150,7 +146,11 @@ def runCrossValidate(client, scriptParams):
     tableNameIn = '/Wndcharm/' + contextName + WndcharmStorage.SMALLFEATURES_TABLE
     message += 'tableNameIn:' + tableNameIn + '\n'
 
-    ftb = WndcharmStorage.FeatureTable(client, tableNameIn)
+    stats = None
+    if scriptParams.get('RPC_Stats'):
+        stats = WndcharmStorage.RpcStats()
+    ftb = WndcharmStorage.FeatureTable(
+        client, tableNameIn, stats, WndcharmStorage.defaultFeatureCache())
 
     try:
         message += 'Running cross-validation\n'
@@ -165,6 +165,9 @@ def runCrossValidate(client, scriptParams):
     finally:
         ftb.close()
 
+    if stats is not None:
+        message += stats.summary()
+
     return message
 
 
@@ -206,6 +209,11 @@ def runScript():
             description='Should the features table be cross-references with the list of images in the dataset?',
             default=True),
 
+        scripts.Bool(
+            'RPC_Stats', optional=True, grouping='9',
+            description='Report the number and duration of remote calls',
+            default=False),
+
         version = '0.0.1',
         authors = ['Simon Li', 'Chris Coletta', 'OME Team'],
         institutions = ['University of Dundee'],
@@ -49,9 +49,11 @@ def countCompleted(ftb, ds):
         return message
 
     message += 'Opened table id:%d\n' % tid
-    d = tc.chunkedRead([0], 0, tc.table.getNumberOfRows(), 100)
-    ftImIds = d.columns[0].values
-    matchedIds = set(imIds).intersection(ftImIds)
+    imIds = set(imIds)
+    matchedIds = set()
+    for d in tc.iterRead([0], 0, tc.table.getNumberOfRows(),
+                         WndcharmStorage.CHUNK_SIZE):
+        matchedIds.update(imIds.intersection(d.columns[0].values))
     message += 'Image feature status PRESENT:%d ABSENT:%d\n' % \
         (len(matchedIds), len(imIds) - len(matchedIds))
     return message
@@ -67,7 +69,10 @@ def processImages(client, scriptParams):
 
     tableName = '/Wndcharm/' + contextName + '/SmallFeatureSet.h5'
     message += 'tableName:' + tableName + '\n'
-    ftb = WndcharmStorage.FeatureTable(client, tableName)
+    stats = None
+    if scriptParams.get('RPC_Stats'):
+        stats = WndcharmStorage.RpcStats()
+    ftb = WndcharmStorage.FeatureTable(client, tableName, stats)
 
     try:
         # Get the datasets
@@ -89,6 +94,9 @@ def processImages(client, scriptParams):
     finally:
         ftb.close()
 
+    if stats is not None:
+        message += stats.summary()
+
     return message
 
 
@@ -115,6 +123,11 @@ def runScript():
             description='The name of the classification context.',
             default='Example'),
 
+        scripts.Bool(
+            'RPC_Stats', optional=True, grouping='9',
+            description='Report the number and duration of remote calls',
+            default=False),
+
         version = '0.0.1',
         authors = ['Simon Li', 'OME Team'],
         institutions = ['University of Dundee'],
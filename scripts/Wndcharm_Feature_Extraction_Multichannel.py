@@ -35,6 +35,10 @@ from wndcharm.FeatureSet import Signatures
 from wndcharm.PyImageMatrix import PyImageMatrix
 from OmeroWndcharm import WndcharmStorage
 
+# Maximum number of images whose features are held in memory before being
+# written to the table in a single batch, see FeatureTable.flush()
+SAVE_BATCH_SIZE = 200
+
 try:
     from PIL import Image, ImageDraw, ImageFont     # see ticket:2597
 except: #pragma: nocover
@@ -109,7 +113,7 @@ def extractFeatures(ftb, ds, newOnly, chNames, imageId = None, im = None):
     if version != ft.version:
         return message + 'Incompatible version: Stored=%s Calculated=%s' % (
             version, ft.version)
-    ftb.saveFeatures(imageId, ftall)
+    ftb.saveFeatures(imageId, ftall, replace=not newOnly)
 
     return message + 'Extracted features from Image id:%d\n' % imageId
 
@@ -148,7 +152,11 @@ def processImages(client, scriptParams):
 
     tableName = '/Wndcharm/' + contextName + '/SmallFeatureSet.h5'
     message += 'tableName:' + tableName + '\n'
-    ftb = WndcharmStorage.FeatureTable(client, tableName)
+    stats = None
+    if scriptParams.get('RPC_Stats'):
+        stats = WndcharmStorage.RpcStats()
+    ftb = WndcharmStorage.FeatureTable(client, tableName, stats,
+                                       bufferRows=SAVE_BATCH_SIZE)
 
     try:
         nimages = 0
@@ -176,6 +184,10 @@ def processImages(client, scriptParams):
                 message += 'Processing image id:%d\n' % image.getId()
                 msg = extractFeatures(ftb, d, newOnly, chNames, im=image)
                 message += msg + '\n'
+            # Each dataset has its own table
+            n = ftb.flush()
+            if n:
+                message += 'Saved features for %d images\n' % n
 
     except:
         print message
@@ -183,6 +195,9 @@ def processImages(client, scriptParams):
     finally:
         ftb.close()
 
+    if stats is not None:
+        message += stats.summary()
+
     return message
 
 
@@ -214,6 +229,11 @@ def runScript():
             description='If features already exist for an image do not recalculate.',
             default=True),
 
+        scripts.Bool(
+            'RPC_Stats', optional=True, grouping='9',
+            description='Report the number and duration of remote calls',
+            default=False),
+
         version = '0.0.1',
         authors = ['Simon Li', 'OME Team'],
         institutions = ['University of Dundee'],
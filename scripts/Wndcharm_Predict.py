@@ -25,6 +25,7 @@ from omero import scripts
 import omero.model
 from omero.rtypes import rstring, rlong, unwrap
 from datetime import datetime
+from itertools import izip
 import numpy
 
 from OmeroWndcharm import WndcharmStorage
@@ -162,12 +163,17 @@ def addToFeatureSet(ftb, ds, fts, classId):
 
 
     #fts = wndcharm.FeatureSet.FeatureSet_Discrete({'num_images': 0})
-    for image in ds.listChildren():
-        imId = image.getId()
+    imIds = [image.getId() for image in ds.listChildren()]
+    for imId in imIds:
         message += '\tProcessing features for image id:%d\n' % imId
+    names, values, ids = ftb.bulkLoadFeatures(imIds)
+
+    for imId, vals in izip(ids, values):
         #message += extractFeatures(tc, d, im = image) + '\n'
         sig = wndcharm.FeatureSet.Signatures()
-        (sig.names, sig.values) = ftb.loadFeatures(imId)
+        sig.names = names
+        # Signatures expects a list not a numpy array
+        sig.values = vals.tolist()
         #sig.source_file = image.getName()
         sig.source_file = str(imId)
         sig.version = version
@@ -201,9 +207,15 @@ def predict(client, scriptParams):
     message += 'tableNameW:' + tableNameW + '\n'
     message += 'tableNameL:' + tableNameL + '\n'
 
-    ftb = WndcharmStorage.FeatureTable(client, tableNameIn)
+    stats = None
+    if scriptParams.get('RPC_Stats'):
+        stats = WndcharmStorage.RpcStats()
+    # Share one session and pool of open tables between all connections
+    pool = WndcharmStorage.ConnectionPool(client=client, stats=stats)
+    ftb = WndcharmStorage.FeatureTable(
+        pool, tableNameIn, stats, WndcharmStorage.defaultFeatureCache())
     ctb = WndcharmStorage.ClassifierTables(
-        client, tableNameF, tableNameW, tableNameL)
+        pool, tableNameF, tableNameW, tableNameL, stats)
 
     try:
         message += 'Loading classifier\n'
@@ -231,6 +243,10 @@ def predict(client, scriptParams):
     finally:
         ftb.close()
         ctb.close()
+        pool.closeTables()
+
+    if stats is not None:
+        message += stats.summary()
 
     return message
 
@@ -269,6 +285,11 @@ def runScript():
             description='The name of the classification context.',
             default='Example'),
 
+        scripts.Bool(
+            'RPC_Stats', optional=True, grouping='9',
+            description='Report the number and duration of remote calls',
+            default=False),
+
         version = '0.0.1',
         authors = ['Simon Li', 'OME Team'],
         institutions = ['University of Dundee'],
@@ -19,6 +19,7 @@ setup(
     description='Scripts for using WND-CHARM in OMERO',
     long_description=open('README.md').read(),
     install_requires=[
+        'numpy',
         'wndcharm>=0.1.0',
         ],
     #dependency_links=['git+https://github.com/wnd-charm/wnd-charm.git'],
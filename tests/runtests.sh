@@ -1,9 +1,10 @@
 #!/bin/sh
 
 [ -z "$ICE_CONFIG" ] && export ICE_CONFIG=ice.config
+# Set LOCAL_TABLES=1 to run test_TableConnection without a server
 # Python 2.7
-exec python -munittest test_TableConnection test_WndcharmStorage test_Wndcharm
+exec python -munittest test_LocalTables test_FeatureCache test_RpcStats test_TableConnection test_WndcharmStorage test_Wndcharm
 
 # Python 2.6
-#exec python -munittest2.__main__ test_TableConnection test_WndcharmStorage test_Wndcharm
+#exec python -munittest2.__main__ test_LocalTables test_FeatureCache test_RpcStats test_TableConnection test_WndcharmStorage test_Wndcharm
 
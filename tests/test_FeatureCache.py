@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+# These tests do not require a server
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import os
+import shutil
+import tempfile
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'OmeroWndcharm'))
+
+from FeatureCache import FeatureCache
+from LocalTables import LocalClient, LocalStore
+from RpcStats import RpcStats
+from WndcharmStorage import FeatureTable
+
+
+class TestFeatures(object):
+    def __init__(self, inc = 0):
+        self.names = ['a [0]', 'a [1]', 'b [0]']
+        self.values = map(lambda x: x + inc, [10., 11., 12.])
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def test_getPut(self):
+        cache = FeatureCache(self.cacheDir)
+        self.assertIsNone(cache.get(1, 100, 2))
+
+        c = cache.put(1, 100, 2, ['a', 'b'], [5, 6], [[1., 2.], [3., 4.]])
+        self.assertEqual(c.ids.tolist(), [5, 6])
+
+        c = cache.get(1, 100, 2)
+        self.assertEqual(c.names, ['a', 'b'])
+        self.assertEqual(c.ids.tolist(), [5, 6])
+        self.assertEqual(c.values.tolist(), [[1., 2.], [3., 4.]])
+        self.assertIsNone(cache.get(1, 101, 2))
+        self.assertIsNone(cache.get(1, 100, 3))
+
+        # Other versions of the same table are replaced
+        cache.put(1, 101, 0, ['a', 'b'], [], numpy.empty((0, 2)))
+        self.assertIsNone(cache.get(1, 100, 2))
+        self.assertEqual(cache.get(1, 101, 0).values.shape, (0, 2))
+
+        cache.remove(1)
+        self.assertIsNone(cache.get(1, 101, 0))
+
+    def test_evict(self):
+        values = numpy.zeros((10, 100))
+        cache = FeatureCache(self.cacheDir)
+        cache.put(1, 100, 10, ['x'] * 100, range(10), values)
+        size = sum(os.path.getsize(os.path.join(self.cacheDir, d, f))
+                   for d in os.listdir(self.cacheDir)
+                   if d.startswith('table-')
+                   for f in os.listdir(os.path.join(self.cacheDir, d)))
+
+        cache = FeatureCache(self.cacheDir, maxBytes=int(size * 2.5))
+        cache.put(2, 100, 10, ['x'] * 100, range(10), values)
+        # Make 2 the least recently used
+        os.utime(os.path.join(self.cacheDir, 'table-2-100-10'), (0, 0))
+
+        cache.put(3, 100, 10, ['x'] * 100, range(10), values)
+        self.assertIsNotNone(cache.get(1, 100, 10))
+        self.assertIsNone(cache.get(2, 100, 10))
+        self.assertIsNotNone(cache.get(3, 100, 10))
+
+    def test_tooLarge(self):
+        store = LocalStore()
+        cache = FeatureCache(self.cacheDir, maxBytes=1)
+        ft = FeatureTable(LocalClient(store), '/test.h5', cache=cache)
+        ft.createTable(TestFeatures().names, '1.0')
+        ft.saveFeatures(7, TestFeatures())
+        ft.saveFeatures(8, TestFeatures(1))
+
+        # Evicted as soon as it is added, but the data is still returned
+        names, values, ids = ft.bulkLoadFeatures()
+        numpy.testing.assert_array_equal(ids, [7, 8])
+        numpy.testing.assert_array_equal(
+            values, [[10., 11., 12.], [11., 12., 13.]])
+        self.assertEqual([d for d in os.listdir(self.cacheDir)
+                          if d.startswith('table-')], [])
+        ft.close()
+
+    def test_featureTable(self):
+        store = LocalStore()
+        cache = FeatureCache(self.cacheDir)
+        ft = FeatureTable(LocalClient(store), '/test.h5')
+        ft.createTable(TestFeatures().names, '1.0')
+        ft.saveFeatures(7, TestFeatures())
+        ft.saveFeatures(8, TestFeatures(1))
+        tid = ft.tc.tableId
+        names, values, ids = ft.bulkLoadFeatures()
+        self.assertEqual(ids.tolist(), [7, 8])
+        self.assertEqual(values.tolist(), [[10., 11., 12.], [11., 12., 13.]])
+        ft.close()
+
+        stats = RpcStats()
+        ft = FeatureTable(LocalClient(store), '/test.h5', stats, cache)
+        ft.openTable(tid)
+        names2, values2, ids2 = ft.bulkLoadFeatures()
+        self.assertIs(names2, names)
+        self.assertTrue(values2.flags.writeable)
+        numpy.testing.assert_array_equal(values2, values)
+        numpy.testing.assert_array_equal(ids2, ids)
+        names2, values2, ids2 = ft.bulkLoadFeatures([8])
+        self.assertEqual(values2.tolist(), [[11., 12., 13.]])
+        self.assertEqual(ids2.tolist(), [8])
+
+        # A single read of the table, then one timestamp check per load
+        self.assertEqual(stats.methods['table.read'].calls, 3)
+
+        ft.saveFeatures(9, TestFeatures(2))
+        names, values, ids = ft.bulkLoadFeatures()
+        self.assertEqual(ids.tolist(), [7, 8, 9])
+        self.assertEqual(values[2].tolist(), [12., 13., 14.])
+        ft.close()
+
+    def test_incremental(self):
+        store = LocalStore()
+        cache = FeatureCache(self.cacheDir)
+        stats = RpcStats()
+        ft = FeatureTable(LocalClient(store), '/test.h5', stats, cache)
+        ft.createTable(TestFeatures().names, '1.0')
+        for n in xrange(4):
+            ft.saveFeatures(n, TestFeatures(n))
+        ft.loadCachedFeatures()
+
+        ft.saveFeatures(4, TestFeatures(4))
+        stats.reset()
+        c = ft.loadCachedFeatures()
+        self.assertEqual(c.ids.tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(c.values[4].tolist(), [14., 15., 16.])
+        # Timestamp, cached ids, new rows
+        self.assertEqual(stats.methods['table.read'].calls, 3)
+        self.assertEqual(len(os.listdir(self.cacheDir)), 2)
+
+        # Modified without adding rows
+        tableData = store.tables[ft.tc.tableId]
+        tableData.touch()
+        tableData.lastModification += 1
+        c = ft.loadCachedFeatures()
+        self.assertEqual(c.ids.tolist(), [0, 1, 2, 3, 4])
+
+        # Rewritten, so reread everything
+        data = ft.tc.table.read([0], 0, 1)
+        data.columns[0].values = [10]
+        ft.tc.table.update(data)
+        stats.reset()
+        c = ft.loadCachedFeatures()
+        self.assertEqual(c.ids.tolist(), [10, 1, 2, 3, 4])
+        self.assertEqual(c.values[4].tolist(), [14., 15., 16.])
+        self.assertEqual(stats.methods['table.read'].calls, 3)
+
+        ft.close()
+
+    def test_rewriteInvalidates(self):
+        store = LocalStore()
+        cache = FeatureCache(self.cacheDir)
+        ft = FeatureTable(LocalClient(store), '/test.h5', cache=cache)
+        ft.createTable(TestFeatures().names, '1.0')
+        ft.saveFeatures(7, TestFeatures())
+        ft.saveFeatures(8, TestFeatures(1))
+        tid = ft.tc.tableId
+        ft.loadCachedFeatures()
+
+        # Overwritten in place by another process without a cache, with and
+        # without appending rows
+        for (n, items) in enumerate([[(7, TestFeatures(5))],
+                                     [(8, TestFeatures(6)),
+                                      (9, TestFeatures(7))]]):
+            writer = FeatureTable(LocalClient(store), '/test.h5')
+            writer.openTable(tid)
+            writer.saveFeaturesBatch(items, replace=True)
+            writer.close()
+            tableData = store.tables[tid]
+            tableData.lastModification += 1
+
+            c = ft.loadCachedFeatures()
+            self.assertEqual(c.rewrites, n + 1)
+            for (id, features) in items:
+                row = c.ids.tolist().index(id)
+                self.assertEqual(c.values[row].tolist(), features.values)
+
+        ft.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
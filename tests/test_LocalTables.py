@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+# These tests do not require a server
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import time
+import Ice
+import omero
+from omero.rtypes import rlong, unwrap
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'OmeroWndcharm'))
+
+from LocalTables import LocalClient, LocalStore
+from TableConnection import TableConnection
+
+
+class TestLocalTables(unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalStore()
+        self.tableName = '/test_LocalTables/test.h5'
+
+    def create_table(self, cli):
+        t = cli.getSession().sharedResources().newTable(0, self.tableName)
+        cols = [omero.grid.LongColumn('lc1', '', [1, 2, 3, 4]),
+                omero.grid.DoubleArrayColumn('dac1', '', 2,
+                                             [[1., 2.], [3., 4.],
+                                              [5., 6.], [7., 8.]]),
+                omero.grid.StringColumn('sc1', '', 8,
+                                        ['a', 'b', 'c', 'd'])]
+        t.initialize(cols)
+        t.addData(cols)
+        return t
+
+    def test_readWrite(self):
+        cli = LocalClient(self.store)
+        t = self.create_table(cli)
+        self.assertEqual(t.getNumberOfRows(), 4)
+        self.assertEqual([h.values for h in t.getHeaders()], [[], [], []])
+
+        d = t.read([2, 1], 1, 10)
+        self.assertEqual(d.rowNumbers, [1, 2, 3])
+        self.assertEqual(d.columns[0].values, ['b', 'c', 'd'])
+        self.assertEqual(d.columns[1].values, [[3., 4.], [5., 6.], [7., 8.]])
+
+        d = t.readCoordinates([3, 0])
+        self.assertEqual(d.columns[0].values, [4, 1])
+
+        d.columns[0].values = [40, 10]
+        t.update(d)
+        self.assertEqual(t.read([0], 0, 4).columns[0].values, [10, 2, 3, 40])
+
+        self.assertEqual(t.getWhereList(
+                '(lc1>=x)', {'x': rlong(3)}, 0, 0, 0), [0, 2, 3])
+
+    def test_openTable(self):
+        t = self.create_table(LocalClient(self.store))
+        tid = unwrap(t.getOriginalFile().getId())
+
+        tc = TableConnection(client=LocalClient(self.store),
+                             tableName=self.tableName)
+        tc.openTable(tid)
+        self.assertEqual(tc.getNumberOfRows(), 4)
+        self.assertEqual([unwrap(f.getId()) for f in tc.findByName()], [tid])
+
+        tc.table.delete()
+        tc.closeTable()
+        self.assertRaises(Exception, tc.openTable, tid)
+
+    def test_latency(self):
+        cli = LocalClient(self.store, latency=0.05)
+        t = self.create_table(cli)
+
+        t0 = time.time()
+        rs = [t.begin_read([0], n, n + 1) for n in xrange(4)]
+        self.assertEqual([t.end_read(r).columns[0].values for r in rs],
+                         [[1], [2], [3], [4]])
+        t1 = time.time()
+        t.read([0], 0, 1)
+        t2 = time.time()
+
+        # Asynchronous calls overlap
+        self.assertLess(t1 - t0, 0.15)
+        self.assertGreaterEqual(t2 - t1, 0.05)
+
+    def test_messageSizeMax(self):
+        tid = unwrap(self.create_table(
+                LocalClient(self.store)).getOriginalFile().getId())
+        cli = LocalClient(self.store, messageSizeMax=24)
+        t = cli.getSession().sharedResources().openTable(
+            omero.model.OriginalFileI(tid, False))
+
+        self.assertRaises(Ice.MemoryLimitException, t.read, [0], 0, 4)
+        r = t.begin_read([0], 0, 4)
+        self.assertRaises(Ice.MemoryLimitException, t.end_read, r)
+
+        tc = TableConnection(client=cli, tableName=self.tableName)
+        tc.openTable(tid)
+        data = tc.chunkedRead([0], 0, 4, 4)
+        self.assertEqual(data.columns[0].values, [1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2013 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+# These tests do not require a server
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import os
+import threading
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'OmeroWndcharm'))
+
+from RpcStats import RpcStats, InstrumentedProxy
+
+
+class TestService(object):
+    """
+    Stands in for a remote service with synchronous, asynchronous and
+    generator methods
+    """
+
+    def ping(self, x):
+        return x
+
+    def begin_ping(self, x):
+        return object()
+
+    def end_ping(self, r):
+        return r
+
+    def getObjects(self, n, delay):
+        for i in xrange(n):
+            time.sleep(delay)
+            yield i
+
+
+class TestRpcStats(unittest.TestCase):
+
+    def test_record(self):
+        stats = RpcStats(buckets=(0.1, 1.0))
+        stats.record('a', 0.05, 10)
+        stats.record('a', 0.5, 20, error=True)
+        stats.record('b', 5.0)
+        self.assertEqual(stats.methods['a'].calls, 2)
+        self.assertEqual(stats.methods['a'].errors, 1)
+        self.assertEqual(stats.methods['a'].histogram, [1, 1, 0])
+        self.assertEqual(stats.methods['b'].histogram, [0, 0, 1])
+        calls, seconds, nbytes = stats.totals()
+        self.assertEqual((calls, nbytes), (3, 30))
+        self.assertAlmostEqual(seconds, 5.55)
+
+    def test_threads(self):
+        stats = RpcStats()
+        proxy = InstrumentedProxy(TestService(), stats, 'svc.')
+
+        def run():
+            for n in xrange(500):
+                proxy.end_ping(proxy.begin_ping(n))
+                proxy.ping(n)
+        threads = [threading.Thread(target=run) for n in xrange(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(stats.methods['svc.ping'].calls, 8000)
+        self.assertEqual(proxy._pending, {})
+
+    def test_generator(self):
+        stats = RpcStats()
+        proxy = InstrumentedProxy(TestService(), stats, 'svc.')
+        result = proxy.getObjects(3, 0.02)
+        # Consumed when called, so the time includes iterating
+        self.assertGreaterEqual(stats.methods['svc.getObjects'].seconds, 0.06)
+        self.assertEqual(list(result), [0, 1, 2])
+        self.assertEqual(stats.methods['svc.getObjects'].calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
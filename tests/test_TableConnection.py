@@ -31,25 +31,35 @@ else:
 import omero
 from omero.rtypes import unwrap
 import collections
+import numpy
 
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'OmeroWndcharm'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 
 from TableConnection import Connection, TableConnection, FeatureTableConnection
+from TableConnection import TableConnectionError, ConnectionPool
+from TableConnection import AUTO_CHUNK, LAYOUT_BOOLCOLUMNS, LAYOUT_PACKED
+from RpcStats import RpcStats
+from TableFutures import waitAll
+from LocalTables import LocalClient
 
 
 class ClientHelper(unittest.TestCase):
 
     def create_client(self):
-        cli = omero.client()
+        if os.environ.get('LOCAL_TABLES'):
+            cli = LocalClient()
+        else:
+            cli = omero.client()
         sess = cli.createSession()
         return (cli, sess)
 
     def setUp(self):
         """
         Create a connection for creating the test tables.
-        ICE_CONFIG must be set.
+        ICE_CONFIG must be set, or LOCAL_TABLES to use the in-process
+        stand-in instead of a server.
         """
         self.cli, self.sess = self.create_client()
         self.tableName = '/test_TableConnection/test.h5'
@@ -150,6 +160,210 @@ class TestTableConnection(ClientHelper):
 
         tc.close()
 
+    def test_rpcStats(self):
+        tid = self.create_table()
+        stats = RpcStats()
+        tc = TableConnection(client=self.cli, tableName=self.tableName,
+                             stats=stats)
+        tc.openTable(tid)
+        tc.chunkedRead([0], 0, 4, 2, pipeline=1)
+        tc.chunkedRead([0], 0, 4, 2, pipeline=2)
+
+        self.assertEqual(stats.methods['resources.openTable'].calls, 1)
+        self.assertEqual(stats.methods['gateway.getObject'].calls, 1)
+        read = stats.methods['table.read']
+        self.assertEqual(read.calls, 4)
+        self.assertEqual(read.errors, 0)
+        self.assertEqual(read.bytes, 64)
+        self.assertEqual(sum(read.histogram), 4)
+        self.assertIn('table.read calls:4', stats.summary())
+
+        tc.close()
+
+    def test_openTableRpcs(self):
+        tid = self.create_table()
+        stats = RpcStats()
+        tc = TableConnection(client=self.cli, tableName=self.tableName,
+                             stats=stats)
+        stats.reset()
+        t = tc.openTable(tid)
+        calls = stats.totals()[0]
+        # getObject and openTable
+        self.assertEqual(calls, 2)
+
+        # Already open
+        self.assertIs(tc.openTable(tid), t)
+        self.assertEqual(stats.totals()[0], calls)
+
+        # The file name is cached
+        tc.closeTable()
+        tc.openTable(tid)
+        self.assertEqual(stats.methods['gateway.getObject'].calls, 1)
+        self.assertEqual(stats.methods['resources.openTable'].calls, 2)
+
+        tc.close()
+
+    def test_chunkedAuto(self):
+        tid = self.create_table()
+        tc = TableConnection(client=self.cli, tableName=self.tableName)
+        t = tc.openTable(tid)
+        # One LongColumn, so 8 bytes per row
+        tc.chunkBytes = 16
+
+        cols = tc.getHeaders()
+        cols[0].values = [5, 6, 7]
+        n = tc.chunkedAddData(cols, AUTO_CHUNK)
+        self.assertEqual(n, 3)
+
+        chunks = [d.columns[0].values for d in tc.iterRead([0], 1, 7)]
+        self.assertEqual(chunks, [[2, 3], [4, 5], [6, 7]])
+
+        tc.close()
+
+    def test_iterRead(self):
+        tid = self.create_table()
+        tc = TableConnection(client=self.cli, tableName=self.tableName)
+        t = tc.openTable(tid)
+
+        chunks = [d.columns[0].values for d in tc.iterRead([0], 0, 4, 3)]
+        self.assertEqual(chunks, [[1, 2, 3], [4]])
+
+        tc.close()
+
+    def test_chunkedRead_asarray(self):
+        tid = self.create_table()
+        tc = TableConnection(client=self.cli, tableName=self.tableName)
+        t = tc.openTable(tid)
+
+        data = tc.chunkedRead([0], 1, 4, 2, asarray=True)
+        self.assertEqual(data.columns[0].values.dtype, numpy.int64)
+        self.assertEqual(data.columns[0].values.tolist(), [2, 3, 4])
+        self.assertEqual(data.rowNumbers.tolist(), [1, 2, 3])
+
+        tc.close()
+
+    def test_chunkedReadPipeline(self):
+        tid = self.create_table()
+        tc = TableConnection(client=self.cli, tableName=self.tableName)
+        t = tc.openTable(tid)
+
+        seq = tc.chunkedRead([0], 0, 4, 1, pipeline=1)
+        for n in (2, 3, 10):
+            data = tc.chunkedRead([0], 0, 4, 1, pipeline=n)
+            self.assertEqual(data.rowNumbers, seq.rowNumbers)
+            self.assertEqual(data.columns[0].values, [1, 2, 3, 4])
+            self.assertEqual(data.lastModification, seq.lastModification)
+
+        tc.close()
+
+    def test_async(self):
+        tid = self.create_table()
+        tc = TableConnection(client=self.cli, tableName=self.tableName)
+        f = tc.openTableAsync(tid)
+        self.assertIsNotNone(f.result())
+
+        cols = tc.getHeaders()
+        cols[0].values = [5, 6]
+        self.assertIsNone(tc.addDataAsync(cols).result())
+        cols[0].values = [7, 8, 9]
+        self.assertEqual(tc.chunkedAddDataAsync(cols, 2).result(), 3)
+
+        fs = [tc.readAsync([0], 0, 2),
+              tc.chunkedReadAsync([0], 1, 9, 3),
+              tc.chunkedReadAsync([0], 7, 9, 3, asarray=True),
+              tc.getWhereListAsync('(lc1>x)', {'x': omero.rtypes.rlong(6)})]
+        r = waitAll(fs)
+        self.assertTrue(all(f.done() for f in fs))
+        self.assertEqual(r[0].columns[0].values, [1, 2])
+        self.assertEqual(r[1].columns[0].values, [2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(r[2].columns[0].values.tolist(), [8, 9])
+        self.assertEqual(r[3], [6, 7, 8])
+
+        f = tc.readAsync([3], 0, 2)
+        self.assertIsNotNone(f.exception())
+        self.assertRaises(Exception, f.result)
+
+        tc.close()
+
+
+
+class TestConnectionPool(ClientHelper):
+
+    def create_table(self):
+        tc = TableConnection(client=self.cli, tableName=self.tableName)
+        tc.newTable([omero.grid.LongColumn('lc1', '', [])])
+        tid = tc.tableId
+        tc.close(False)
+        return tid
+
+    def test_sharedSession(self):
+        tid = self.create_table()
+        stats = RpcStats()
+        pool = ConnectionPool(client=self.cli, stats=stats)
+        tc1 = TableConnection(client=pool, tableName=self.tableName)
+        tc2 = FeatureTableConnection(client=pool, tableName=self.tableName)
+        self.assertIs(tc1.conn, tc2.conn)
+        self.assertEqual(stats.methods['resources.areTablesEnabled'].calls, 1)
+        self.assertEqual(stats.methods['resources.repositories'].calls, 1)
+
+        t1 = tc1.openTable(tid)
+        tc1.getHeaders()
+        self.assertIs(tc2.openTable(tid), t1)
+        tc1.closeTable()
+        tc2.closeTable()
+        tc1.openTable(tid)
+        tc1.getHeaders()
+        self.assertEqual(stats.methods['resources.openTable'].calls, 1)
+        self.assertEqual(stats.methods['table.getHeaders'].calls, 1)
+        self.assertNotIn('table.close', stats.methods)
+
+        tc1.close()
+        tc2.close()
+        pool.closeTables()
+        self.assertEqual(stats.methods['table.close'].calls, 1)
+
+    def test_poolDeleteAllTables(self):
+        tid = self.create_table()
+        pool = ConnectionPool(client=self.cli)
+        tc1 = TableConnection(client=pool, tableName=self.tableName)
+        tc2 = TableConnection(client=pool, tableName=self.tableName)
+        tc1.openTable(tid)
+        tc1.getHeaders()
+        tc1.closeTable()
+
+        tc1.deleteAllTables()
+        self.assertNotIn(tid, pool.headers)
+        self.assertRaises(Exception, tc2.openTable, tid)
+
+        tc1.close()
+        tc2.close()
+        pool.closeTables()
+
+    def test_evict(self):
+        tids = [self.create_table() for n in xrange(3)]
+        stats = RpcStats()
+        pool = ConnectionPool(client=self.cli, stats=stats, maxTables=1)
+        tc = TableConnection(client=pool, tableName=self.tableName)
+
+        # Only unused tables are counted
+        tc.openTable(tids[0])
+        tc.openTable(tids[1])
+        self.assertNotIn('table.close', stats.methods)
+        tc.openTable(tids[2])
+        self.assertEqual(stats.methods['table.close'].calls, 1)
+        tc.closeTable()
+        self.assertEqual(stats.methods['table.close'].calls, 2)
+
+        # tids[2] is still open, tids[1] was closed
+        tc.openTable(tids[2])
+        self.assertEqual(stats.methods['resources.openTable'].calls, 3)
+        tc.openTable(tids[1])
+        self.assertEqual(stats.methods['resources.openTable'].calls, 4)
+        tc.closeTable()
+        self.assertEqual(stats.methods['table.close'].calls, 3)
+
+        pool.closeTables()
+        self.assertEqual(stats.methods['table.close'].calls, 4)
 
 
 class TestFeatureTableConnection(ClientHelper):
@@ -163,11 +377,11 @@ class TestFeatureTableConnection(ClientHelper):
         ftc.close()
         return tid
 
-    def create_table_with_data(self):
+    def create_table_with_data(self, layout=LAYOUT_BOOLCOLUMNS):
         cli, sess = self.create_client()
         ftc = FeatureTableConnection(client=cli, tableName=self.tableName)
         desc = [('a', 3), ('b', 1)]
-        ftc.createNewTable('ID', desc)
+        ftc.createNewTable('ID', desc, layout)
 
         cols = ftc.getHeaders()
         cols[0].values = [1, 8, 3, 6]
@@ -191,6 +405,111 @@ class TestFeatureTableConnection(ClientHelper):
         self.assertEqual([h.name for h in headers[3:]],
                          ['_b_ID', '_b_a', '_b_b'])
 
+    def test_packedLayout(self):
+        tid = self.create_table_with_data(LAYOUT_PACKED)
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        headers = ftc.table.getHeaders()
+        self.assertEqual([h.name for h in headers], ['ID', 'a', 'b', '_valid_v2'])
+        self.assertEqual(ftc.getLayout(), LAYOUT_PACKED)
+        self.assertEqual([h.name for h in ftc.getHeaders()], ['ID', 'a', 'b'])
+
+        bs = ftc.isValid([2, 0, 1], 0, 4)
+        self.assertEqual(bs[1].values, [True, True, True, True])
+        self.assertEqual(bs[2].values, [False, True, True, False])
+        self.assertEqual(bs[0].values, [True, False, True, False])
+
+        xs = ftc.readArray([2, 0, 1], 0, 4)
+        self.assertEqual(xs[1].values, [1, 8, 3, 6])
+        self.assertEqual(xs[2].values, [[], [1., 2., 3.], [4., 5., 6.], []])
+        self.assertEqual(xs[0].values, [[7.], [], [8.], []])
+
+        xs = ftc.readSubArray({1: [0, 2]}, 0, 4, asarray=True)
+        self.assertTrue(numpy.isnan(xs[0].values[[0, 3]]).all())
+        self.assertEqual(xs[0].values[1:3].tolist(), [[1., 3.], [4., 6.]])
+
+    def test_copyTable(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        newId = ftc.copyTable(LAYOUT_PACKED, chunk=3)
+        self.assertNotEqual(newId, tid)
+        ftc.closeTable()
+
+        ftc.openTable(newId)
+        self.assertEqual(ftc.getLayout(), LAYOUT_PACKED)
+        xs = ftc.readArray([0, 1, 2], 0, ftc.getNumberOfRows())
+        self.assertEqual(xs[0].values, [1, 8, 3, 6])
+        self.assertEqual(xs[1].values, [[], [1., 2., 3.], [4., 5., 6.], []])
+        self.assertEqual(xs[2].values, [[7.], [], [8.], []])
+
+    def test_compactTable(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+        self.assertIsNone(ftc.compactTable())
+
+        cols = ftc.getHeaders()
+        cols[0].values = [3, 1]
+        cols[1].values = [[11., 12., 13.], []]
+        cols[2].values = [[17.], [18.]]
+        ftc.addData(cols)
+
+        for (sort, ids, a, b) in (
+            (False, [8, 6, 3, 1], [[1., 2., 3.], [], [11., 12., 13.], []],
+             [[], [], [17.], [18.]]),
+            (True, [1, 3, 6, 8], [[], [11., 12., 13.], [], [1., 2., 3.]],
+             [[18.], [17.], [], []])):
+            ftc.openTable(tid)
+            newId = ftc.compactTable(sort, chunk=3)
+            self.assertNotEqual(newId, tid)
+            ftc.closeTable()
+
+            ftc.openTable(newId)
+            xs = ftc.readArray([0, 1, 2], 0, ftc.getNumberOfRows())
+            self.assertEqual(xs[0].values, ids)
+            self.assertEqual(xs[1].values, a)
+            self.assertEqual(xs[2].values, b)
+            self.assertIsNone(ftc.compactTable(sort))
+            ftc.closeTable()
+
+    def test_compactTableSorted(self):
+        tid = self.create_table_with_data()
+        stats = RpcStats()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName,
+                                     stats=stats)
+        ftc.openTable(tid)
+        # Ids in a scrambled order, every id written twice
+        ids = [(n * 17) % 40 + 1 for n in xrange(80)]
+        cols = ftc.getHeaders()
+        cols[0].values = ids
+        cols[1].values = [[float(i), 0., 0.] for i in ids]
+        cols[2].values = [[]] * len(ids)
+        ftc.addData(cols)
+
+        # The id column and then the whole table are each read in one call,
+        # not one call per scattered row
+        stats.reset()
+        newId = ftc.compactTable(True, chunk=5)
+        self.assertEqual(stats.methods['table.read'].calls, 2)
+        ftc.closeTable()
+
+        # Rows held in memory are limited by sortBytes
+        ftc.openTable(tid)
+        newId2 = ftc.compactTable(True, chunk=5, sortBytes=1)
+        ftc.closeTable()
+
+        for n in (newId, newId2):
+            ftc.openTable(n)
+            xs = ftc.readArray([0, 1], 0, ftc.getNumberOfRows())
+            self.assertEqual(xs[0].values, range(1, 41))
+            self.assertEqual([x[0] for x in xs[1].values],
+                             map(float, range(1, 41)))
+            ftc.closeTable()
+        ftc.close()
+
     def test_isValid(self):
         tid = self.create_table_with_data()
         ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
@@ -223,6 +542,30 @@ class TestFeatureTableConnection(ClientHelper):
         self.assertEqual(xs[1].values, [[], [1., 3.], [4., 6.], []])
         self.assertEqual(xs[0].values, [[7.], [], [8.], []])
 
+    def test_readSubArray_chunked(self):
+        tid = self.create_table_with_data(LAYOUT_PACKED)
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        can = {1:[2,0], 2:[0]}
+        xs = ftc.readSubArray(can, 0, 4, chunk=3)
+        self.assertEqual(xs[0].values, [[], [3., 1.], [6., 4.], []])
+        self.assertEqual(xs[1].values, [[7.], [], [8.], []])
+
+        xs = ftc.readSubArray(can, 1, 4, asarray=True, chunk=AUTO_CHUNK)
+        self.assertEqual(xs[0].values[:2].tolist(), [[3., 1.], [6., 4.]])
+        self.assertTrue(numpy.isnan(xs[0].values[2]).all())
+
+    def test_iterReadSubArray(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        can = {0:[], 1:[1]}
+        xs = [[c.values for c in cols] for cols in
+              ftc.iterReadSubArray(can, 0, 4, 3)]
+        self.assertEqual(xs, [[[1, 8, 3], [[], [2.], [5.]]], [[6], [[]]]])
+
     def test_readArray(self):
         tid = self.create_table_with_data()
         ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
@@ -238,6 +581,78 @@ class TestFeatureTableConnection(ClientHelper):
         self.assertEqual(xs[2].values, [[], [1., 2., 3.], [4., 5., 6.], []])
         self.assertEqual(xs[0].values, [[7.], [], [8.], []])
 
+    def test_readArray_asarray(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        nan = float('nan')
+        for chunk in (None, 3):
+            xs = ftc.readArray([2, 0, 1], 0, 4, chunk=chunk, asarray=True)
+            self.assertIsInstance(xs[1].values, numpy.ndarray)
+            numpy.testing.assert_array_equal(xs[1].values, [1, 8, 3, 6])
+            numpy.testing.assert_array_equal(
+                xs[2].values, [[nan, nan, nan], [1., 2., 3.], [4., 5., 6.],
+                               [nan, nan, nan]])
+            numpy.testing.assert_array_equal(
+                xs[0].values, [[7.], [nan], [8.], [nan]])
+
+        xs = ftc.readSubArray({1: [0, 2], 2: [0]}, 0, 4, asarray=True)
+        numpy.testing.assert_array_equal(
+            xs[0].values, [[nan, nan], [1., 3.], [4., 6.], [nan, nan]])
+        numpy.testing.assert_array_equal(
+            xs[1].values, [[7.], [nan], [8.], [nan]])
+
+    def test_readRows(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        for gap in (0, 1, 10):
+            xs = ftc.readRows([2, 0, 1], [3, 0, 2, 0], gap=gap)
+            self.assertEqual(xs[0].values, [[], [7.], [8.], [7.]])
+            self.assertEqual(xs[1].values, [6, 1, 3, 1])
+            self.assertEqual(xs[2].values, [[], [], [4., 5., 6.], []])
+
+        xs = ftc.readRows([0], [])
+        self.assertEqual(xs[0].values, [])
+
+        nan = float('nan')
+        xs = ftc.readRows([2, 0, 1], [3, 0, 2, 0], asarray=True)
+        numpy.testing.assert_array_equal(
+            xs[0].values, [[nan], [7.], [8.], [7.]])
+        numpy.testing.assert_array_equal(xs[1].values, [6, 1, 3, 1])
+        numpy.testing.assert_array_equal(
+            xs[2].values, [[nan, nan, nan], [nan, nan, nan], [4., 5., 6.],
+                           [nan, nan, nan]])
+        xs = ftc.readRows([0, 1], [], asarray=True)
+        self.assertEqual(xs[1].values.shape, (0, 3))
+
+        chunks = list(ftc.iterReadRows([0, 1], [3, 0, 3], asarray=True))
+        self.assertEqual(len(chunks), 1)
+        positions, xs = chunks[0]
+        self.assertEqual(positions, [1, 0, 2])
+        numpy.testing.assert_array_equal(xs[0].values, [1, 6, 6])
+        self.assertRaises(TableConnectionError, list,
+                          ftc.iterReadRows([0], [0, 100]))
+
+    def test_iterReadArray(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        chunks = list(ftc.iterReadArray([2, 0], 0, 4, 3))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0][0].values, [[7.], [], [8.]])
+        self.assertEqual(chunks[0][1].values, [1, 8, 3])
+        self.assertEqual(chunks[1][0].values, [[]])
+        self.assertEqual(chunks[1][1].values, [6])
+
+        chunks = list(ftc.iterReadArray([2, 0], 0, 4, 3, asarray=True))
+        numpy.testing.assert_array_equal(
+            chunks[0][0].values, [[7.], [float('nan')], [8.]])
+        numpy.testing.assert_array_equal(chunks[1][1].values, [6])
+
     def test_getRowId(self):
         tid = self.create_table_with_data()
         ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
@@ -249,6 +664,24 @@ class TestFeatureTableConnection(ClientHelper):
         self.assertEqual(ftc.getRowId(8), 1)
         self.assertIsNone(ftc.getRowId(1000))
 
+    def test_getRowIds(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        self.assertEqual(ftc.getRowIds([6, 1000, 1]), [3, None, 0])
+        self.assertTrue(ftc.containsId(8))
+        self.assertFalse(ftc.containsId(1000))
+
+        # The index should be updated when rows are added
+        cols = ftc.getHeaders()
+        cols[0].values = [1000, 1]
+        cols[1].values = [[], []]
+        cols[2].values = [[], []]
+        ftc.addData(cols)
+        self.assertEqual(ftc.getRowIds([6, 1000, 1]), [3, 4, 5])
+        self.assertTrue(ftc.containsId(1000))
+
     def test_getHeaders(self):
         tid = self.create_table()
         ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
@@ -258,6 +691,24 @@ class TestFeatureTableConnection(ClientHelper):
         self.assertEqual(len(headers), 3)
         self.assertEqual([h.name for h in headers], ['ID', 'a', 'b'])
 
+    def test_getHeadersCached(self):
+        tid = self.create_table()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        headers = ftc.getHeaders()
+        headers[0].values = [1]
+        headers2 = ftc.getHeaders()
+        self.assertEqual([h.name for h in headers2], ['ID', 'a', 'b'])
+        self.assertEqual(headers2[0].values, [])
+        self.assertIsNot(headers[0], headers2[0])
+
+        self.assertEqual(ftc.getColumnIndex('b'), 2)
+        self.assertEqual(ftc.getColumnIndex('_b_a'), 4)
+
+        ftc.closeTable()
+        self.assertIsNone(ftc._headers)
+
     def test_addData(self):
         tid = self.create_table_with_data()
         ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
@@ -276,6 +727,50 @@ class TestFeatureTableConnection(ClientHelper):
                                         [11., 12., 13.], [14., 15., 16.]])
         self.assertEqual(xs[2].values, [[7.], [], [8.], [], [17.], [18.]])
 
+    def test_upsertRows(self):
+        for layout in (LAYOUT_BOOLCOLUMNS, LAYOUT_PACKED):
+            tid = self.create_table_with_data(layout)
+            ftc = FeatureTableConnection(client=self.cli,
+                                         tableName=self.tableName)
+            ftc.openTable(tid)
+
+            cols = ftc.getHeaders()[1:]
+            cols[0].values = [[11., 12., 13.], [], [14., 15., 16.], []]
+            cols[1].values = [[17.], [18.], [], [19.]]
+            self.assertEqual(ftc.upsertRows([8, 2, 1, 8], cols), (2, 1))
+
+            xs = ftc.readArray([0, 1, 2], 0, ftc.getNumberOfRows())
+            self.assertEqual(xs[0].values, [1, 8, 3, 6, 2])
+            self.assertEqual(xs[1].values, [[14., 15., 16.], [], [4., 5., 6.],
+                                            [], []])
+            self.assertEqual(xs[2].values, [[], [19.], [8.], [], [18.]])
+            self.assertEqual(ftc.getRowId(2), 4)
+
+            cols[0].values = [[]]
+            self.assertRaises(TableConnectionError, ftc.upsertRows, [5], cols)
+            ftc.close(False)
+
+    def test_addData_unmodified(self):
+        tid = self.create_table_with_data()
+        ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
+        ftc.openTable(tid)
+
+        cols = ftc.getHeaders()
+        cols[0].values = [2, 4]
+        cols[1].values = [[], [14., 15., 16.]]
+        cols[2].values = numpy.array([[17.], [18.]])
+        ftc.addData(cols, copy=False)
+        self.assertEqual(cols[1].values, [[], [14., 15., 16.]])
+        self.assertIsInstance(cols[2].values, numpy.ndarray)
+
+        ftc.addPartialData([cols[0], cols[1]], copy=False)
+        self.assertEqual(cols[1].values, [[], [14., 15., 16.]])
+
+        xs = ftc.readArray([1, 2], 4, ftc.getNumberOfRows())
+        self.assertEqual(xs[0].values, [[], [14., 15., 16.],
+                                        [], [14., 15., 16.]])
+        self.assertEqual(xs[1].values, [[17.], [18.], [], []])
+
     def test_addPartialData(self):
         tid = self.create_table_with_data()
         ftc = FeatureTableConnection(client=self.cli, tableName=self.tableName)
@@ -29,6 +29,7 @@ else:
     import unittest
 
 import uuid
+import numpy
 import omero
 from omero.rtypes import wrap, unwrap
 import os
@@ -37,6 +38,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 
 import WndcharmStorage
 from WndcharmStorage import FeatureTable, ClassifierTables
+from TableConnection import ConnectionPool, LAYOUT_PACKED
+from RpcStats import RpcStats
+from LocalTables import LocalClient, LocalStore
 
 
 class ClientHelper(unittest.TestCase):
@@ -117,6 +121,26 @@ class TestWndcharmStorage(unittest.TestCase):
         self.assertEqual(ftsz['a b'], 15)
         self.assertEqual(ftsz['c d'], 4)
 
+    def test_getFeatureLayout(self):
+        names = ['c [1]', 'a b [1]', 'c [0]', 'a b [0]']
+        layout = WndcharmStorage.getFeatureLayout(names)
+        self.assertIs(WndcharmStorage.getFeatureLayout(list(names)), layout)
+        self.assertEqual(layout.groups, ['c', 'a b'])
+        self.assertEqual(layout.sizes, [2, 2])
+        self.assertEqual(layout.groupIndices.tolist(), [0, 1, 0, 1])
+        self.assertEqual(layout.offsets.tolist(), [1, 1, 0, 0])
+
+        cols = [omero.grid.DoubleArrayColumn('a b', '', 3),
+                omero.grid.DoubleArrayColumn('b', '', 1),
+                omero.grid.DoubleArrayColumn('c', '', 2)]
+        colIndices, positions = layout.columnPositions(cols)
+        self.assertEqual(colIndices.tolist(), [0, 2])
+        self.assertEqual(positions.tolist(), [5, 1, 4, 0])
+
+        layout = WndcharmStorage.getFeatureLayout(['c [2]'])
+        self.assertRaises(WndcharmStorage.WndcharmStorageError,
+                          layout.columnPositions, cols)
+
 
 class FeatureTableHelper(ClientHelper):
 
@@ -270,11 +294,11 @@ class TestFeatureTable(FeatureTableHelper):
         ft.openTable(tid)
 
         names, values = ft.loadFeatures(7)
-        self.assertEqual(names, ['a [0]', 'a [1]', 'b [0]'])
+        self.assertEqual(names, ('a [0]', 'a [1]', 'b [0]'))
         self.assertEqual(values, [1., 2., 5.])
 
-        names, values = ft.loadFeatures(8)
-        self.assertEqual(names, ['a [0]', 'a [1]', 'b [0]'])
+        names2, values = ft.loadFeatures(8)
+        self.assertIs(names2, names)
         self.assertEqual(values, [3., 4., 6.])
 
     def test_bulkLoadFeatures(self):
@@ -283,9 +307,247 @@ class TestFeatureTable(FeatureTableHelper):
         ft.openTable(tid)
 
         names, values, ids = ft.bulkLoadFeatures()
-        self.assertEqual(names, ['a [0]', 'a [1]', 'b [0]'])
-        self.assertEqual(values, [[1., 2., 5.], [3., 4., 6.]])
-        self.assertEqual(ids, [7, 8])
+        self.assertEqual(names, ('a [0]', 'a [1]', 'b [0]'))
+        self.assertEqual(values.tolist(), [[1., 2., 5.], [3., 4., 6.]])
+        self.assertEqual(ids.tolist(), [7, 8])
+
+        names2, values, ids = ft.bulkLoadFeatures([8, 7])
+        self.assertIs(names2, names)
+        self.assertEqual(values.tolist(), [[3., 4., 6.], [1., 2., 5.]])
+        self.assertEqual(ids.tolist(), [8, 7])
+
+        self.assertRaises(WndcharmStorage.WndcharmStorageError,
+                          ft.bulkLoadFeatures, [7, 100])
+
+
+class TestLocalFeatureTable(unittest.TestCase):
+    # Runs against the in-process stand-in, no server required
+
+    def setUp(self):
+        self.store = LocalStore()
+        self.tableName = '/test_WndcharmStorage/test.h5'
+
+    def test_featureTable(self):
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        ft.createTable(TestFeatures().names, version='1.0')
+        ft.saveFeatures(7, TestFeatures())
+        tid = ft.tc.tableId
+        ft.close()
+
+        stats = RpcStats()
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName, stats=stats)
+        self.assertTrue(ft.openTable(tid, '1.0'))
+        self.assertTrue(ft.tableContainsId(7))
+        names, values = ft.loadFeatures(7)
+        self.assertEqual(values, [10., 11., 12.])
+        self.assertEqual(names, ('a [0]', 'a [1]', 'b [0]'))
+        self.assertIs(ft.bulkLoadFeatures()[0], names)
+
+        calls = stats.totals()[0]
+        self.assertTrue(ft.openTable(tid, '1.0'))
+        self.assertEqual(stats.totals()[0], calls)
+
+    def test_saveFeaturesReplace(self):
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        ft.createTable(TestFeatures().names, version='1.0')
+        ft.saveFeatures(7, TestFeatures())
+        ft.saveFeatures(7, TestFeatures(1), replace=True)
+        ft.saveFeatures(8, TestFeatures(2), replace=True)
+        self.assertEqual(ft.tc.getNumberOfRows(), 2)
+        names, values = ft.loadFeatures(7)
+        self.assertEqual(values, [11., 12., 13.])
+
+    def test_saveFeaturesBatch(self):
+        stats = RpcStats()
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName, stats=stats)
+        ft.createTable(TestFeatures().names, version='1.0')
+        partial = TestFeatures(2)
+        partial.names = partial.names[:2]
+        partial.values = partial.values[:2]
+        stats.reset()
+        self.assertEqual(ft.saveFeaturesBatch(
+                [(7, TestFeatures()), (8, TestFeatures(1)), (9, partial)]), 3)
+        self.assertEqual(stats.methods['table.addData'].calls, 1)
+
+        names, values, ids = ft.bulkLoadFeatures()
+        self.assertEqual(ids.tolist(), [7, 8, 9])
+        self.assertEqual(values[:2].tolist(),
+                         [[10., 11., 12.], [11., 12., 13.]])
+        self.assertEqual(values[2, :2].tolist(), [12., 13.])
+        self.assertTrue(numpy.isnan(values[2, 2]))
+
+        names, values, ids = ft.bulkLoadFeatures([9, 7, 9])
+        self.assertEqual(ids.tolist(), [9, 7, 9])
+        self.assertEqual(values[1].tolist(), [10., 11., 12.])
+        self.assertEqual(values[2, :2].tolist(), [12., 13.])
+
+        self.assertEqual(ft.saveFeaturesBatch(
+                [(8, TestFeatures(3)), (10, TestFeatures(4))], replace=True),
+                         2)
+        self.assertEqual(ft.tc.getNumberOfRows(), 4)
+        self.assertEqual(ft.loadFeatures(8)[1], [13., 14., 15.])
+        self.assertEqual(ft.saveFeaturesBatch([]), 0)
+
+        bad = TestFeatures()
+        bad.names = ['a [0]', 'a [2]', 'b [0]']
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.saveFeaturesBatch,
+                          [(11, bad)])
+        bad.names = ['a [0]', 'a [1]', 'c [0]']
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.saveFeaturesBatch,
+                          [(11, bad)])
+        bad = TestFeatures()
+        bad.values = bad.values[:2]
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.saveFeaturesBatch,
+                          [(11, bad)])
+        self.assertEqual(ft.tc.getNumberOfRows(), 4)
+
+    def test_writeBuffer(self):
+        stats = RpcStats()
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName, stats=stats, bufferRows=3)
+        ft.createTable(TestFeatures().names, version='1.0')
+        tid = ft.tc.tableId
+        stats.reset()
+        ft.saveFeatures(7, TestFeatures())
+        ft.saveFeatures(8, TestFeatures(1))
+        self.assertTrue(ft.tableContainsId(8))
+        self.assertEqual(stats.totals()[0], 0)
+        ft.saveFeatures(9, TestFeatures(2))
+        self.assertEqual(stats.methods['table.addData'].calls, 1)
+        self.assertEqual(ft.tc.getNumberOfRows(), 3)
+
+        # Flushed before reading
+        ft.saveFeatures(10, TestFeatures(3))
+        names, values = ft.loadFeatures(10)
+        self.assertEqual(values, [13., 14., 15.])
+
+        # Flushed when the replace flag changes
+        ft.saveFeatures(11, TestFeatures(4))
+        ft.saveFeatures(7, TestFeatures(5), replace=True)
+        self.assertEqual(ft.tc.getNumberOfRows(), 5)
+        self.assertEqual(ft.flush(), 1)
+        self.assertEqual(ft.flush(), 0)
+
+        ft.bufferBytes = 1
+        ft.saveFeatures(12, TestFeatures())
+        self.assertEqual(ft.tc.getNumberOfRows(), 6)
+        ft.bufferBytes = 1000
+        ft.bufferSeconds = 0
+        ft.saveFeatures(13, TestFeatures())
+        self.assertEqual(ft.tc.getNumberOfRows(), 7)
+
+        ft.bufferSeconds = 1000
+        ft.saveFeatures(14, TestFeatures())
+        ft.close()
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        ft.openTable(tid)
+        names, values, ids = ft.bulkLoadFeatures()
+        self.assertEqual(ids.tolist(), [7, 8, 9, 10, 11, 12, 13, 14])
+        self.assertEqual(values[0].tolist(), [15., 16., 17.])
+
+    def test_writeBufferFailure(self):
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName, bufferRows=3)
+        ft.createTable(TestFeatures().names, version='1.0')
+        ft.saveFeatures(7, TestFeatures())
+
+        calls = []
+        def failingSave(items, replace=False):
+            calls.append(items)
+            raise WndcharmStorage.WndcharmStorageError('Write failed')
+        ft.saveFeaturesBatch = failingSave
+
+        # The rows are kept and written by the next flush
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.flush)
+        self.assertTrue(ft.tableContainsId(7))
+        del ft.saveFeaturesBatch
+        self.assertEqual(ft.flush(), 1)
+        self.assertEqual(ft.tc.getNumberOfRows(), 1)
+
+        # close() logs a repeated failure instead of masking the first one
+        ft.saveFeatures(8, TestFeatures(1))
+        ft.saveFeaturesBatch = failingSave
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.flush)
+        ft.close()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([id for (id, features) in calls[2]], [8])
+
+    def test_compactFeatureTable(self):
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        ft.createTable(TestFeatures().names, version='1.0')
+        ft.saveFeatures(8, TestFeatures())
+        ft.saveFeatures(7, TestFeatures())
+        ft.saveFeatures(8, TestFeatures(1))
+        tid = ft.tc.tableId
+        newId = ft.compactTable(sort=True)
+        self.assertEqual(ft.tc.tableId, newId)
+        # The version tag is moved, not copied
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.openTable, tid)
+        ft.close()
+
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        self.assertTrue(ft.openTable(newId, '1.0'))
+        names, values, ids = ft.bulkLoadFeatures()
+        self.assertEqual(ids.tolist(), [7, 8])
+        self.assertEqual(values.tolist(), [[10., 11., 12.], [11., 12., 13.]])
+        self.assertIsNone(ft.compactTable())
+
+    def test_migrateFeatureTable(self):
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        ft.createTable(TestFeatures().names, version='1.0')
+        ft.saveFeatures(7, TestFeatures())
+        tid = ft.tc.tableId
+        ft.close()
+
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        self.assertTrue(ft.openTable(tid, '1.0'))
+        newId = ft.migrateTable(LAYOUT_PACKED)
+        self.assertNotEqual(newId, tid)
+        self.assertEqual(ft.tc.tableId, newId)
+        self.assertRaises(WndcharmStorage.WndcharmStorageError, ft.openTable, tid)
+        ft.close()
+
+        ft = FeatureTable(client=LocalClient(self.store),
+                          tableName=self.tableName)
+        self.assertTrue(ft.openTable(newId, '1.0'))
+        names, values = ft.loadFeatures(7)
+        self.assertEqual(values, [10., 11., 12.])
+
+    def test_classifierTables(self):
+        ct = ClassifierTables(LocalClient(self.store), '/F.h5', '/W.h5', '/L.h5')
+        ct.createClassifierTables(['a', 'b'], '1.0')
+        ct.saveClassifierTables([1, 2], [0, 1], [[1., 2.], [3., 4.]],
+                                ['a', 'b'], [.5, .5], ['c0', 'c1'])
+        cls = ct.loadClassifierTables()
+        self.assertEqual(cls['featureMatrix'], [[1., 2.], [3., 4.]])
+        self.assertEqual(cls['classNames'], ['c0', 'c1'])
+
+    def test_connectionPool(self):
+        pool = ConnectionPool(client=LocalClient(self.store))
+        ft = FeatureTable(pool, self.tableName)
+        ft.createTable(TestFeatures().names, version='1.0')
+        ft.saveFeatures(7, TestFeatures())
+        ct = ClassifierTables(pool, '/F.h5', '/W.h5', '/L.h5')
+        ct.createClassifierTables(['a', 'b'], '1.0')
+        self.assertIs(ft.conn, ct.tcF.conn)
+        ft.close()
+        ct.close()
+
+        ft = FeatureTable(pool, self.tableName)
+        self.assertTrue(ft.openTable(ft.tc.findByName().next().getId()))
+        self.assertEqual(ft.loadFeatures(7)[1], [10., 11., 12.])
+        ft.close()
+        pool.close()
+
 
 
 class TestClassifierTables(FeatureTableHelper):